@@ -1,7 +1,17 @@
+import math
+import queue
+import time
 import tkinter as tk
+import weakref
 from tkinter import colorchooser, filedialog, messagebox
 
+import cache
+import ediciones
+import histogram
 import logic
+import sesion
+import tiles
+import worker
 
 try:
     import cv2
@@ -25,6 +35,7 @@ logic.np = np
 # Idea general del proyecto:
 # - `app.py` = capa de UI: botones, sliders, canvas, eventos, mostrar imágenes.
 # - `logic.py` = capa de procesamiento: máscara HSV, reemplazo de color, preview.
+# - `worker.py` = hilos de cálculo: la UI nunca espera a OpenCV (ver `TrabajadorFondo`).
 #
 # Nota sobre dependencias:
 # - Importamos `cv2`/`numpy`/`PIL` con try/except para dar errores amigables.
@@ -32,6 +43,40 @@ logic.np = np
 #   las mismas dependencias (o detecte si faltan).
 class ColorReplaceApp:
 
+    # Lado máximo (en píxeles) de la copia reducida (proxy) usada para las vistas previas.
+    # Es mayor que el canvas por defecto, así que la proxy se ve igual de nítida en pantalla.
+    PROXY_LADO_MAX = 1600
+
+    # Lado (px) del nivel más pequeño de la vista previa progresiva (ver `_crear_niveles_vista`).
+    # A este tamaño la primera vista previa tarda unos pocos ms, sea cual sea la imagen.
+    PROGRESIVO_LADO_MIN = 200
+
+    # Espera (ms) tras el último movimiento de un slider antes de recalcular la vista previa.
+    # Así, arrastrar un slider no lanza un cálculo por cada valor intermedio.
+    RETARDO_VISTA_PREVIA_MS = 150
+
+    # Cada cuánto (ms) el hilo de Tk recoge los resultados de los trabajos en segundo plano.
+    INTERVALO_RESULTADOS_MS = 30
+
+    # Lado (px) por debajo del cual ya no se añaden niveles a la pirámide de visualización.
+    PIRAMIDE_LADO_MIN = 256
+
+    # Halo (px) que se añade alrededor de la zona dibujada para que la máscara dentro de ella
+    # salga igual que sobre la imagen completa (ver `tiles.margen_mascara`). Es el de los
+    # valores máximos de los sliders, así el recorte no cambia al moverlos y las máscaras
+    # siguen pasando por `cache_mascara`.
+    MARGEN_ZONA = tiles.margen_mascara(31, 8)
+
+    # RAM (bytes) para todo lo que se guarda de la imagen: la sesión (imagen, HSV, resultado,
+    # índice de histograma y recortes de la zona, ver `sesion.SesionImagen`) y las cachés de
+    # máscaras y de pasos. Lo que no cabe se descarta o va a un fichero temporal mapeado.
+    PRESUPUESTO_MEMORIA = sesion.PRESUPUESTO_DEFECTO
+
+    # Partes de `PRESUPUESTO_MEMORIA` para las salidas guardadas de los pasos encadenados
+    # (`ediciones.PilaEdiciones`) y para `cache_mascara`; la sesión se queda con el resto.
+    FRACCION_PASOS = 0.25
+    FRACCION_MASCARAS = 0.25
+
     # Constructor: recibe el root de Tkinter y prepara el estado inicial.
     # Aquí se definen variables que se irán actualizando durante el uso.
     def __init__(self, root):
@@ -39,15 +84,63 @@ class ColorReplaceApp:
         self.root.title("Color Replace - OpenCV")
         self.root.geometry("1200x700")
 
+        # Imagen cargada con sus planos derivados (HSV, resultado) y su presupuesto de memoria.
+        # `image_bgr` es la imagen de la sesión (puede estar mapeada desde disco).
+        self.sesion = None
         self.image_bgr = None
-        self.image_hsv = None
-        self.result_bgr = None
+        self.proxy_bgr = None
+        self.proxy_hsv = None
+        self.proxy_escala = 1.0
+        # Niveles de la vista previa progresiva, del más pequeño a la proxy: (bgr, hsv, escala).
+        self.niveles_vista = []
+        # Buffers del tinte de la vista previa de selección; solo los usa el hilo de vistas previas.
+        self._trabajo_vista = {}
+        # Índice de histograma de la imagen (ver `_crear_indice`); None mientras se calcula.
+        self.indice_hsv = None
+        # Reglas de reemplazo múltiple: (origen_hsv, tolerancia, destino_hsv, fuerza).
+        # Si hay alguna, Procesar las aplica todas a la vez en lugar del par objetivo/destino.
+        self.reglas = []
+        # Pasos encadenados (cada uno sobre la salida del anterior), con deshacer/rehacer y
+        # sus salidas en caché (ver `ediciones.PilaEdiciones`).
+        self.pila = ediciones.PilaEdiciones(max_bytes=int(self.PRESUPUESTO_MEMORIA * self.FRACCION_PASOS))
+        # Parámetros (`_parametros`) con los que se calculó el resultado guardado en la sesión.
+        self._parametros_resultado = None
         self.pick_mode = False
+        # Zona de trabajo dibujada en el canvas: (y0, y1, x0, x1) en píxeles de la imagen
+        # completa, o None para usar toda la imagen. Fuera de ella no se calcula la máscara.
+        self.roi = None
+        self.roi_mode = False
+        self._roi_inicio = None
+        # Recortes HSV contiguos de la zona (más su halo), por imagen y región (ver `_recorte`):
+        # (id(imagen), región) -> (recorte, sesión en la que cuenta, finalizador).
+        self._recortes = {}
         self.picked_hsv = None
         self.target_hsv = (30, 200, 200)
         self.display_info = None
+        # Caché de visualización: clave ("original", "vista_previa", "resultado") ->
+        # pirámide RGB y último render (ver `show_image`). De la imagen de origen solo se
+        # guarda una referencia débil, para no retener un resultado que la sesión descarte.
+        self._visualizacion = {}
+        self._visible = None
+        self._render_programado = None
+        self._tamano_canvas = None
+        # Caché de máscaras por etapas: al mover un solo slider se reutiliza lo ya calculado.
+        self.cache_mascara = cache.CacheMascara(max_bytes=int(self.PRESUPUESTO_MEMORIA * self.FRACCION_MASCARAS))
+
+        # Cálculos en segundo plano: uno para las vistas previas (proxy) y otro para Procesar
+        # (resolución completa), para que una vista previa nunca espere a un procesado largo.
+        # Ambos entregan sus resultados en `resultados`, que se vacía desde el hilo de Tk.
+        self.resultados = queue.Queue()
+        self.trabajador_vista = worker.TrabajadorFondo("vista-previa", self.resultados)
+        self.trabajador_proceso = worker.TrabajadorFondo("procesar", self.resultados)
+        # Y otro para el índice de histograma de cada imagen cargada (ver `_crear_indice`).
+        self.trabajador_indice = worker.TrabajadorFondo("indice", self.resultados)
+        # Qué vista previa se recalcula al mover un slider: None, "seleccion" o "reemplazo".
+        self.modo_vista = None
+        self._vista_programada = None
 
         self._build_ui()
+        self.root.after(self.INTERVALO_RESULTADOS_MS, self._recoger_resultados)
 
     # Construye toda la interfaz:
     # - Panel izquierdo: botones y controles (sliders/checkbox)
@@ -74,24 +167,50 @@ class ColorReplaceApp:
 
         tk.Label(self.left, text="Tolerancia (HSV)").pack(anchor="w", pady=(10, 0))
         self.tol_var = tk.IntVar(value=20)
-        tk.Scale(self.left, from_=0, to=60, orient=tk.HORIZONTAL, variable=self.tol_var).pack(fill=tk.X)
+        tk.Scale(self.left, from_=0, to=histogram.TOLERANCIA_MAX, orient=tk.HORIZONTAL, variable=self.tol_var, command=self._on_parametro).pack(fill=tk.X)
+        tk.Button(self.left, text="Tolerancia automática", command=self.auto_tolerance).pack(fill=tk.X)
 
         tk.Label(self.left, text="Suavizado (feather)").pack(anchor="w", pady=(10, 0))
         self.blur_var = tk.IntVar(value=7)
-        tk.Scale(self.left, from_=1, to=31, orient=tk.HORIZONTAL, variable=self.blur_var).pack(fill=tk.X)
+        tk.Scale(self.left, from_=1, to=31, orient=tk.HORIZONTAL, variable=self.blur_var, command=self._on_parametro).pack(fill=tk.X)
 
         tk.Label(self.left, text="Morph iteraciones").pack(anchor="w", pady=(10, 0))
         self.morph_var = tk.IntVar(value=1)
-        tk.Scale(self.left, from_=0, to=8, orient=tk.HORIZONTAL, variable=self.morph_var).pack(fill=tk.X)
+        tk.Scale(self.left, from_=0, to=8, orient=tk.HORIZONTAL, variable=self.morph_var, command=self._on_parametro).pack(fill=tk.X)
 
         tk.Label(self.left, text="Fuerza de mezcla").pack(anchor="w", pady=(10, 0))
         self.mix_var = tk.IntVar(value=80)
-        tk.Scale(self.left, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.mix_var).pack(fill=tk.X)
+        tk.Scale(self.left, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.mix_var, command=self._on_parametro).pack(fill=tk.X)
 
         self.keep_v_var = tk.BooleanVar(value=True)
-        tk.Checkbutton(self.left, text="Mantener brillo (V)", variable=self.keep_v_var).pack(anchor="w", pady=(8, 0))
+        tk.Checkbutton(self.left, text="Mantener brillo (V)", variable=self.keep_v_var, command=self._on_parametro).pack(
+            anchor="w", pady=(8, 0)
+        )
+
+        tk.Label(self.left, text="Reglas (varios colores)").pack(anchor="w", pady=(10, 0))
+        self.rules_list = tk.Listbox(self.left, height=4)
+        self.rules_list.pack(fill=tk.X)
+        tk.Button(self.left, text="Añadir regla", command=self.add_rule).pack(fill=tk.X)
+        tk.Button(self.left, text="Quitar regla", command=self.remove_rule).pack(fill=tk.X)
+
+        tk.Label(self.left, text="Pasos (encadenados)").pack(anchor="w", pady=(10, 0))
+        self.steps_list = tk.Listbox(self.left, height=4)
+        self.steps_list.pack(fill=tk.X)
+        tk.Button(self.left, text="Añadir paso", command=self.add_step).pack(fill=tk.X)
+        tk.Button(self.left, text="Cambiar paso", command=self.update_step).pack(fill=tk.X)
+        tk.Button(self.left, text="Quitar paso", command=self.remove_step).pack(fill=tk.X)
+        historial = tk.Frame(self.left)
+        historial.pack(fill=tk.X)
+        tk.Button(historial, text="Deshacer", command=self.undo_step).pack(side=tk.LEFT, fill=tk.X, expand=True)
+        tk.Button(historial, text="Rehacer", command=self.redo_step).pack(side=tk.LEFT, fill=tk.X, expand=True)
 
+        tk.Label(self.left, text="Zona (opcional)").pack(anchor="w", pady=(10, 0))
+        tk.Button(self.left, text="Dibujar zona (arrastrar)", command=self.enable_roi).pack(fill=tk.X)
+        tk.Button(self.left, text="Quitar zona", command=self.clear_roi).pack(fill=tk.X)
+
+        tk.Button(self.left, text="Vista previa (rápida)", command=self.preview_replace).pack(fill=tk.X, pady=(10, 0))
         tk.Button(self.left, text="Procesar", command=self.process).pack(fill=tk.X, pady=10)
+        tk.Button(self.left, text="Guardar resultado...", command=self.save_result).pack(fill=tk.X)
 
         self.status = tk.Label(self.left, text="Listo", fg="gray")
         self.status.pack(anchor="w", pady=(10, 0))
@@ -99,11 +218,18 @@ class ColorReplaceApp:
         self.canvas = tk.Canvas(self.right, bg="#222")
         self.canvas.pack(fill=tk.BOTH, expand=True)
         self.canvas.bind("<Button-1>", self.on_canvas_click)
+        self.canvas.bind("<B1-Motion>", self.on_canvas_drag)
+        self.canvas.bind("<ButtonRelease-1>", self.on_canvas_release)
+        self.canvas.bind("<Configure>", self._on_canvas_resize)
 
     # Abre un diálogo para elegir una imagen y la carga con OpenCV.
     # Guarda:
-    # - `image_bgr`: imagen original (BGR, OpenCV)
-    # - `image_hsv`: la misma imagen convertida a HSV (para seleccionar/reemplazar)
+    # - `sesion`: la imagen y sus planos (HSV bajo demanda, resultado) con presupuesto de memoria
+    # - `image_bgr`: imagen original (BGR, OpenCV), la de la sesión
+    # - `proxy_bgr` / `proxy_hsv`: copia reducida para las vistas previas (ver `_crear_proxy`)
+    # - `niveles_vista`: pirámide de la proxy para las vistas previas progresivas
+    # - `indice_hsv`: histograma HSV para contar la selección al instante (ver `histogram.py`),
+    #   que se calcula en segundo plano (ver `_crear_indice`)
     # Y muestra la imagen en el canvas.
     def load_image(self):
         if cv2 is None or Image is None:
@@ -116,29 +242,71 @@ class ColorReplaceApp:
         if not path:
             return
 
-        self.image_bgr = cv2.imread(path)
-        if self.image_bgr is None:
+        nueva = sesion.abrir(path, self.PRESUPUESTO_MEMORIA - self.pila.max_bytes - self.cache_mascara.max_bytes)
+        if nueva is None:
             messagebox.showerror("Error", "No se pudo cargar la imagen.")
             return
 
-        self.image_hsv = cv2.cvtColor(self.image_bgr, cv2.COLOR_BGR2HSV)
-        self.result_bgr = None
+        # Los trabajos en curso son de la imagen anterior: sus resultados ya no sirven.
+        self._cancelar_trabajos()
+        self.sesion = nueva
+        self.image_bgr = nueva.bgr
         self.picked_hsv = None
+        self._parametros_resultado = None
+        self.roi = None
+        self.roi_mode = False
+        self._soltar_recortes()
+        self.pila.limpiar()
+        self.steps_list.delete(0, tk.END)
+        self.cache_mascara.limpiar()
+        self._visualizacion.clear()
+        self._crear_proxy()
+        self._crear_niveles_vista()
+        self.indice_hsv = None
+        self._crear_indice()
+
+        self.show_image(self.proxy_bgr, "original")
+        self.status.config(text=f"Imagen cargada | {self._texto_memoria(self.sesion)}")
 
-        self.show_image(self.image_bgr)
-        self.status.config(text="Imagen cargada")
+    # Calcula en segundo plano el índice de histograma de la imagen cargada.
+    #
+    # - Se construye por bandas de filas con `sesion.hsv_region` (ver
+    #   `histogram.indice_por_filas`): no se calcula ni se guarda el HSV completo.
+    # - Al terminar se registra en la sesión (`fijar`), así sus ~45 MB cuentan en el presupuesto.
+    # - Mientras tanto `indice_hsv` es None: no se muestra el porcentaje de selección y la
+    #   tolerancia automática avisa de que todavía no está.
+    def _crear_indice(self):
+        actual = self.sesion
+
+        def calcular(token):
+            return histogram.indice_por_filas(
+                lambda y0, y1: actual.hsv_region((y0, y1, 0, actual.ancho)),
+                actual.alto,
+                actual.ancho,
+                token.cancelado,
+            )
+
+        def al_terminar(indice, segundos):
+            if indice is None or self.sesion is not actual:
+                return
+            actual.fijar("histograma", indice.acumulado)
+            self.indice_hsv = indice
+
+        self.trabajador_indice.enviar(calcular, al_terminar, self._on_error_indice)
 
     # Vuelve a mostrar la imagen original (si hay una cargada).
     # Útil para comparar con el resultado procesado.
     def show_original(self):
         if self.image_bgr is None:
             return
-        self.show_image(self.image_bgr)
+        self._cancelar_vista_previa()
+        self.show_image(self.proxy_bgr, "original")
         self.status.config(text="Mostrando original")
 
     # Activa el “modo selección”: el próximo click en el canvas capturará el color objetivo.
     def enable_pick(self):
         self.pick_mode = True
+        self.roi_mode = False
         self.status.config(text="Selecciona en la imagen el color A CAMBIAR")
 
     # Abre el selector de color (Tkinter) para elegir el color destino.
@@ -171,144 +339,786 @@ class ColorReplaceApp:
         self.picked_hsv = logic.convertir_rgb_a_hsv(r, g, b)
         self.pick_mode = False
 
-        if self.image_hsv is None:
+        if self.image_bgr is None:
             self.status.config(text=f"Objetivo HSV: {self.picked_hsv} (carga una imagen para ver preview)")
             return
 
         self._show_selection_preview()
-        self.status.config(text=f"Objetivo HSV: {self.picked_hsv} | Destino HSV: {self.target_hsv}")
 
     # Maneja el click en el canvas.
+    # Si `roi_mode` está activo, empieza a dibujar la zona (ver `on_canvas_drag`).
     # Si `pick_mode` está activo:
     # - Convierte la coordenada del click (canvas) a coordenadas reales de la imagen.
     # - Lee el pixel HSV en esa posición y lo guarda como `picked_hsv`.
     # - Muestra una vista previa de selección (tinte rojo) para verificar la máscara.
-    #
-    # Importante: la imagen se dibuja escalada en el canvas. Por eso usamos `display_info`
-    # (guardado en `_show_on_canvas`) para mapear correctamente el click.
     def on_canvas_click(self, event):
-        if not self.pick_mode or self.image_hsv is None or self.display_info is None:
+        if self.roi_mode:
+            self._roi_inicio = (event.x, event.y)
+            return
+        if not self.pick_mode:
             return
+        punto = self._canvas_a_imagen(event.x, event.y)
+        if punto is None:
+            return
+
+        ix, iy = punto
+        hsv = self.sesion.hsv_region((iy, iy + 1, ix, ix + 1))[0, 0]
+        self.picked_hsv = (int(hsv[0]), int(hsv[1]), int(hsv[2]))
+        self.pick_mode = False
+        self._show_selection_preview()
+
+    # Convierte una posición del canvas a coordenadas (x, y) de la imagen completa.
+    #
+    # Importante: la imagen se dibuja escalada en el canvas (y puede ser la proxy o la
+    # imagen completa). Por eso usamos `display_info` (guardado en `_show_on_canvas`) y
+    # el tamaño real de `image_bgr` para mapear correctamente el click.
+    #
+    # Entrada:
+    # - recortar: si es True, un punto fuera de la imagen se lleva al borde más cercano
+    #   (para la zona, que se puede arrastrar más allá); si no, se devuelve None.
+    def _canvas_a_imagen(self, x, y, recortar=False):
+        if self.image_bgr is None or self.display_info is None:
+            return None
 
-        x, y = event.x, event.y
         # Recuperamos información sobre cómo se dibujó la imagen en el canvas
         # (posición inicial, tamaño mostrado y escala aplicada)
         x0, y0 = self.display_info["x0"], self.display_info["y0"]
         dw, dh = self.display_info["dw"], self.display_info["dh"]
-        scale = self.display_info["scale"]
+        h, w = self.image_bgr.shape[:2]
 
-        if x < x0 or y < y0 or x >= x0 + dw or y >= y0 + dh:
-            return
+        if recortar:
+            x = min(max(x, x0), x0 + dw - 1)
+            y = min(max(y, y0), y0 + dh - 1)
+        elif x < x0 or y < y0 or x >= x0 + dw or y >= y0 + dh:
+            return None
         # Convertimos la posición del click en el canvas
         # a coordenadas reales dentro de la imagen original
-        ix = int((x - x0) / scale)
-        iy = int((y - y0) / scale)
-        # Verificamos que las coordenadas calculadas estén dentro de la imagen
         # Las imágenes en OpenCV se representan como matrices tridimensionales con forma (alto, ancho, canales).
         # Al usar shape[:2] obtenemos solo alto y ancho, ignorando el número de canales.
-        h, w = self.image_hsv.shape[:2]
+        ix = int((x - x0) * w / dw)
+        iy = int((y - y0) * h / dh)
+        # Verificamos que las coordenadas calculadas estén dentro de la imagen
         if ix < 0 or iy < 0 or ix >= w or iy >= h:
-            return
+            return None
+        return ix, iy
 
-        hsv = self.image_hsv[iy, ix]
-        self.picked_hsv = (int(hsv[0]), int(hsv[1]), int(hsv[2]))
+    # Activa el “modo zona”: el próximo arrastre en el canvas define la zona de trabajo.
+    def enable_roi(self):
+        if self.image_bgr is None:
+            return
+        self.roi_mode = True
         self.pick_mode = False
-        self._show_selection_preview()
-        self.status.config(text=f"Objetivo HSV: {self.picked_hsv} | Destino HSV: {self.target_hsv}")
+        self.status.config(text="Arrastra en la imagen para marcar la zona")
+
+    # Vuelve a trabajar sobre toda la imagen.
+    def clear_roi(self):
+        self.roi_mode = False
+        if self.roi is None:
+            return
+        self._cambiar_roi(None)
+        self.status.config(text="Zona: toda la imagen")
+
+    # Arrastre con la zona a medio dibujar: muestra el rectángulo elástico.
+    def on_canvas_drag(self, event):
+        if not self.roi_mode or self._roi_inicio is None:
+            return
+        x, y = self._roi_inicio
+        self.canvas.delete("roi")
+        self.canvas.create_rectangle(x, y, event.x, event.y, outline="#ffd000", dash=(4, 2), tags="roi")
+
+    # Fin del arrastre: guarda la zona en coordenadas de la imagen completa.
+    # Un click sin arrastrar (menos de 2 px) no cambia nada.
+    def on_canvas_release(self, event):
+        if not self.roi_mode or self._roi_inicio is None:
+            return
+        inicio = self._canvas_a_imagen(*self._roi_inicio, recortar=True)
+        fin = self._canvas_a_imagen(event.x, event.y, recortar=True)
+        self._roi_inicio = None
+        self.roi_mode = False
+        if inicio is None or fin is None:
+            return
+        x0, x1 = sorted((inicio[0], fin[0]))
+        y0, y1 = sorted((inicio[1], fin[1]))
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            self.canvas.delete("roi")
+            self.status.config(text="Zona demasiado pequeña")
+            return
+        self._cambiar_roi((y0, y1 + 1, x0, x1 + 1))
+        self.status.config(text=f"Zona: {x1 + 1 - x0}x{y1 + 1 - y0} px")
+
+    # Cambia la zona, la redibuja y recalcula la vista previa que se esté mostrando.
+    def _cambiar_roi(self, roi):
+        self.roi = roi
+        self._soltar_recortes()
+        self._show_on_canvas()
+        self._refrescar_vista_previa()
+
+    # Ajusta la tolerancia automáticamente con el índice de histograma.
+    # Usa el “codo” de la curva de selección (ver `IndiceHistogramaHSV.sugerir_tolerancia`),
+    # sin generar ninguna máscara.
+    def auto_tolerance(self):
+        if self.sesion is None or self.picked_hsv is None:
+            messagebox.showwarning("Aviso", "Carga una imagen y elige el color A CAMBIAR primero.")
+            return
+        if self.indice_hsv is None:
+            self.status.config(text="Calculando el histograma de la imagen; prueba de nuevo en un momento.")
+            return
+        tolerancia = self.indice_hsv.sugerir_tolerancia(self.picked_hsv)
+        if tolerancia is None:
+            self.status.config(text=f"Sin tolerancia clara para este color{self._texto_seleccion()}")
+            return
+        self.tol_var.set(tolerancia)
+        self._show_selection_preview(f"Tolerancia automática: {tolerancia}{self._texto_seleccion()}")
+
+    # Texto “| Selección: X%” con el porcentaje de píxeles que entra en la tolerancia actual
+    # (antes del suavizado). Se obtiene del índice de histograma, sin recorrer la imagen.
+    def _texto_seleccion(self):
+        if self.indice_hsv is None or self.picked_hsv is None:
+            return ""
+        fraccion = self.indice_hsv.fraccion(self.picked_hsv, self.tol_var.get())
+        return f" | Selección: {fraccion * 100:.1f}%"
+
+    # Añade una regla con el objetivo, destino, tolerancia y fuerza actuales.
+    # Las reglas se aplican en orden; la primera tiene prioridad donde se solapan.
+    def add_rule(self):
+        if self.picked_hsv is None:
+            messagebox.showwarning("Aviso", "Primero elige el color A CAMBIAR (objetivo).")
+            return
+        regla = (self.picked_hsv, self.tol_var.get(), self.target_hsv, self.mix_var.get())
+        self.reglas.append(regla)
+        self.rules_list.insert(tk.END, f"{regla[0]} -> {regla[2]} | tol {regla[1]} | fuerza {regla[3]}")
+        self.status.config(text=f"Reglas: {len(self.reglas)}")
+
+    # Quita la regla seleccionada en la lista (o la última si no hay selección).
+    def remove_rule(self):
+        if not self.reglas:
+            return
+        seleccion = self.rules_list.curselection()
+        indice = seleccion[0] if seleccion else len(self.reglas) - 1
+        del self.reglas[indice]
+        self.rules_list.delete(indice)
+        self.status.config(text=f"Reglas: {len(self.reglas)}")
+
+    # Añade como paso encadenado el par objetivo/destino actual con los valores de los sliders.
+    def add_step(self):
+        paso = self._paso_actual()
+        if paso is None:
+            return
+        self.pila.anadir(paso)
+        self._refrescar_pasos()
+
+    # Sustituye el paso seleccionado por los valores actuales. Solo se recalcula desde él
+    # en adelante: los pasos anteriores salen de la caché de `pila`.
+    def update_step(self):
+        seleccion = self.steps_list.curselection()
+        if not seleccion:
+            messagebox.showwarning("Aviso", "Selecciona en la lista el paso a cambiar.")
+            return
+        paso = self._paso_actual()
+        if paso is None:
+            return
+        self.pila.cambiar(seleccion[0], paso)
+        self._refrescar_pasos()
+
+    # Quita el paso seleccionado (o el último si no hay selección).
+    def remove_step(self):
+        if not self.pila.pasos:
+            return
+        seleccion = self.steps_list.curselection()
+        self.pila.quitar(seleccion[0] if seleccion else len(self.pila.pasos) - 1)
+        self._refrescar_pasos()
+
+    def undo_step(self):
+        if self.pila.deshacer():
+            self._refrescar_pasos()
+
+    def redo_step(self):
+        if self.pila.rehacer():
+            self._refrescar_pasos()
+
+    # Paso con el objetivo/destino y los sliders actuales (None si falta el objetivo).
+    def _paso_actual(self):
+        if self.picked_hsv is None:
+            messagebox.showwarning("Aviso", "Primero elige el color A CAMBIAR (objetivo).")
+            return None
+        return ediciones.crear_paso(
+            self.picked_hsv,
+            self.tol_var.get(),
+            self.blur_var.get(),
+            self.morph_var.get(),
+            self.target_hsv,
+            self.mix_var.get(),
+            self.keep_v_var.get(),
+        )
+
+    # Actualiza la lista de pasos y muestra la vista previa de la cadena.
+    def _refrescar_pasos(self):
+        self.steps_list.delete(0, tk.END)
+        for i, paso in enumerate(self.pila.pasos, 1):
+            self.steps_list.insert(tk.END, f"{i}. {ediciones.describir_paso(paso)}")
+        self.status.config(text=f"Pasos: {len(self.pila.pasos)}")
+        self.preview_replace()
 
     # Botón principal de procesamiento.
     # Flujo:
-    # 1) Valida dependencias y que exista imagen + color objetivo.
-    # 2) Crea máscara HSV llamando a `logic.crear_mascara_hsv`.
-    # 3) Reemplaza el color llamando a `logic.reemplazar_color`.
-    # 4) Muestra el resultado en el canvas.
-    def process(self):
+    # 1) Valida dependencias y que exista imagen + color objetivo (o reglas).
+    # 2) En segundo plano (`trabajador_proceso`), crea la(s) máscara(s) HSV y reemplaza el
+    #    color con `_reemplazar_en`. La ventana sigue respondiendo mientras tanto.
+    # 3) Al terminar, muestra el resultado en el canvas y el tiempo que ha tardado.
+    #
+    # Es el único paso (junto con guardar) que trabaja a resolución completa;
+    # las vistas previas usan la proxy.
+    #
+    # Entrada:
+    # - despues: opcional, función a llamar (en el hilo de Tk) cuando el resultado esté listo.
+    def process(self, despues=None):
         if cv2 is None or np is None:
             messagebox.showerror("Error", "Faltan dependencias: cv2 o numpy.")
             return
-        if self.image_hsv is None:
+        if self.sesion is None:
             messagebox.showwarning("Aviso", "Carga una imagen primero.")
             return
-        if self.picked_hsv is None:
+        if self.picked_hsv is None and not self.reglas and not self.pila.pasos:
             messagebox.showwarning(
                 "Aviso",
                 "Primero elige el color A CAMBIAR (objetivo) con click o con el picker.",
             )
             return
 
-        mask = logic.crear_mascara_hsv(
-            self.image_hsv,
-            self.picked_hsv,
-            self.tol_var.get(),
-            self.blur_var.get(),
-            self.morph_var.get(),
-        )
-        if mask is None:
-            messagebox.showerror("Error", "No se pudo crear la mascara.")
+        # Los valores se copian aquí, en el hilo de Tk: el hilo de cálculo no lee los sliders.
+        parametros = self._parametros()
+        actual = self.sesion
+        image_bgr = self.image_bgr
+        pantalla = self._lado_pantalla()
+
+        # Se mide cada etapa (ver `logic.Medidor`) para mostrar el desglose en la barra de estado.
+        # El HSV completo se pide aquí, en el hilo de cálculo (ver `sesion.SesionImagen.hsv`).
+        # La pirámide de visualización del resultado también se hace aquí: reducir la
+        # resolución completa en el hilo de Tk congelaría la ventana con imágenes grandes.
+        def calcular(token):
+            image_hsv = actual.hsv()
+            with logic.Medidor() as medidor:
+                resultado = self._reemplazar_en(
+                    image_bgr, image_hsv, parametros, parametros["suavizado"], parametros["morph"], 1.0, token
+                )
+            if resultado is None or token.cancelado():
+                return resultado, medidor, None
+            return resultado, medidor, self._crear_piramide(resultado, pantalla)
+
+        def al_terminar(calculado, segundos):
+            resultado, medidor, niveles = calculado
+            if resultado is None:
+                messagebox.showerror("Error", "No se pudo procesar la imagen.")
+                return
+            # La sesión lo cuenta en su presupuesto (y puede guardarlo en disco).
+            resultado = actual.guardar("resultado", resultado)
+            self._parametros_resultado = parametros
+            # Desde aquí, mover un slider muestra la vista previa del reemplazo.
+            self.modo_vista = "reemplazo"
+            self.show_image(resultado, "resultado", niveles=niveles)
+            self.status.config(
+                text=f"Procesado en {segundos:.2f} s ({medidor.texto()}) | {self._texto_receta(parametros)} | "
+                f"{self._texto_memoria(actual)}"
+            )
+            if despues is not None:
+                despues()
+
+        self.status.config(text="Procesando...")
+        self.trabajador_proceso.enviar(calcular, al_terminar, self._on_error_proceso)
+
+    # Vista previa rápida del reemplazo sobre la proxy.
+    # Usa los mismos pasos que `process()`, pero a resolución de pantalla, así que
+    # responde al instante aunque la imagen tenga decenas de megapíxeles.
+    # Se calcula en segundo plano y de forma progresiva (ver `_vista_progresiva`); si llega
+    # otra petición antes de terminar, esta se descarta.
+    def preview_replace(self):
+        if not self.niveles_vista or (self.picked_hsv is None and not self.reglas and not self.pila.pasos):
             return
+        self.modo_vista = "reemplazo"
+        parametros = self._parametros()
 
-        self.result_bgr = logic.reemplazar_color(
-            self.image_hsv,
-            mask,
-            self.target_hsv,
-            self.mix_var.get(),
-            self.keep_v_var.get(),
+        def calcular_nivel(bgr, hsv, escala, token):
+            suavizado, morph = self._parametros_nivel(parametros, escala)
+            return self._reemplazar_en(bgr, hsv, parametros, suavizado, morph, escala, token)
+
+        self._vista_progresiva(calcular_nivel, f"Vista previa | {self._texto_receta(parametros)}")
+
+    # Máscara(s) + reemplazo sobre `image_hsv` (la imagen completa o la proxy).
+    #
+    # - Con pasos encadenados: la cadena completa (`pila.aplicar`), que reutiliza las salidas
+    #   ya calculadas de los pasos que no cambiaron. Los sliders no intervienen (las máscaras
+    #   de los pasos se calculan sobre la salida del anterior, sin `cache_mascara`).
+    # - Sin reglas: el par objetivo/destino con los sliders (`logic.reemplazar_color_roi`).
+    # - Con reglas: todas a la vez en una sola pasada (`logic.reemplazar_colores_roi`).
+    # Las máscaras pasan por `cache_mascara` en ambos casos. Solo se mezclan las regiones
+    # donde la máscara no es 0; el resto de píxeles se copia de `image_bgr`.
+    #
+    # Con una zona dibujada (`parametros["roi"]`, escalada con `escala` a esta imagen), las
+    # máscaras solo se calculan en la zona más su halo (ver `_mascara_en`) y fuera de ella
+    # el resultado es la imagen original. Con pasos, la cadena se aplica a ese mismo recorte
+    # y cada paso solo cambia la zona (`zona` de `pila.aplicar`).
+    #
+    # Se ejecuta en un hilo de cálculo: todo sale de `parametros` (ver `_parametros`) y,
+    # si `token` queda cancelado tras calcular las máscaras, no se hace la mezcla.
+    def _reemplazar_en(self, image_bgr, image_hsv, parametros, suavizado, morph, escala, token=None):
+        roi, region = self._zona_en(parametros["roi"], escala, image_hsv)
+        caja = (slice(region[0], region[1]), slice(region[2], region[3]))
+
+        reglas = parametros["reglas"]
+        if parametros["pasos"]:
+            zona = None
+            if roi is not None:
+                zona = (roi[0] - region[0], roi[1] - region[0], roi[2] - region[2], roi[3] - region[2])
+            resultado, _ = self.pila.aplicar(
+                image_bgr if roi is None else image_bgr[caja],
+                parametros["pasos"],
+                escala,
+                self._recorte(image_hsv, region),
+                token,
+                zona,
+            )
+        elif reglas:
+            masks = [
+                self._mascara_en(image_hsv, origen, tolerancia, suavizado, morph, roi, region)
+                for origen, tolerancia, _, _ in reglas
+            ]
+            if token is not None and token.cancelado():
+                return None
+            resultado = logic.reemplazar_colores_roi(
+                image_bgr[caja], self._recorte(image_hsv, region), masks, reglas, parametros["mantener_brillo"]
+            )
+        else:
+            mask = self._mascara_en(
+                image_hsv, parametros["origen_hsv"], parametros["tolerancia"], suavizado, morph, roi, region
+            )
+            if token is not None and token.cancelado():
+                return None
+            resultado = logic.reemplazar_color_roi(
+                image_bgr[caja],
+                self._recorte(image_hsv, region),
+                mask,
+                parametros["destino_hsv"],
+                parametros["fuerza"],
+                parametros["mantener_brillo"],
+            )
+
+        if roi is None or resultado is None:
+            return resultado
+        salida = image_bgr.copy()
+        salida[caja] = resultado
+        return salida
+
+    # Zona de trabajo sobre `image_hsv`.
+    #
+    # Entrada:
+    # - roi: zona en píxeles de la imagen completa (o None).
+    # - escala: tamaño de `image_hsv` respecto a la imagen completa (la de la proxy, o 1.0).
+    #
+    # Devuelve:
+    # - (roi, region): la zona escalada a `image_hsv` y la región que hay que leer, es decir,
+    #   la zona más `MARGEN_ZONA` con las columnas alineadas (`tiles.ampliar_caja`).
+    #   Sin zona: (None, toda la imagen).
+    def _zona_en(self, roi, escala, image_hsv):
+        alto, ancho = image_hsv.shape[:2]
+        if roi is None:
+            return None, (0, alto, 0, ancho)
+        y0, y1, x0, x1 = roi
+        y0 = min(alto - 1, int(y0 * escala))
+        x0 = min(ancho - 1, int(x0 * escala))
+        roi = (y0, max(y0 + 1, min(alto, math.ceil(y1 * escala))), x0, max(x0 + 1, min(ancho, math.ceil(x1 * escala))))
+        return roi, tiles.ampliar_caja(roi, self.MARGEN_ZONA, alto, ancho)
+
+    # Copia contigua de `image_hsv` en `region`.
+    #
+    # Se guarda (hasta que cambia la zona o la imagen, o `image_hsv` deja de existir) para que
+    # `cache_mascara`, que identifica cada imagen por su array, reconozca el recorte en la
+    # siguiente llamada. Mientras se guarda, cuenta en el presupuesto de la sesión (`fijar`).
+    def _recorte(self, image_hsv, region):
+        alto, ancho = image_hsv.shape[:2]
+        if region == (0, alto, 0, ancho):
+            return image_hsv
+        clave = (id(image_hsv), region)
+        entrada = self._recortes.get(clave)
+        if entrada is None:
+            y0, y1, x0, x1 = region
+            recorte = np.ascontiguousarray(image_hsv[y0:y1, x0:x1])
+            actual = self.sesion
+            if actual is not None:
+                actual.fijar(f"recorte {clave}", recorte)
+            entrada = (recorte, actual, weakref.finalize(image_hsv, self._soltar_recorte, clave))
+            self._recortes[clave] = entrada
+        return entrada[0]
+
+    # Olvida un recorte de `_recorte` y deja de contarlo en su sesión.
+    def _soltar_recorte(self, clave):
+        entrada = self._recortes.pop(clave, None)
+        if entrada is None:
+            return
+        _, actual, finalizador = entrada
+        finalizador.detach()
+        if actual is not None:
+            actual.soltar(f"recorte {clave}")
+
+    def _soltar_recortes(self):
+        for clave in list(self._recortes):
+            self._soltar_recorte(clave)
+
+    # Texto de memoria de la barra de estado: la sesión más las cachés de máscaras y de
+    # pasos, sobre `PRESUPUESTO_MEMORIA` (el total de las tres partes).
+    def _texto_memoria(self, actual):
+        otros = self.cache_mascara.bytes_usados + self.pila.bytes_usados
+        return actual.texto_uso(otros, self.PRESUPUESTO_MEMORIA)
+
+    # Máscara de un color sobre `region` de `image_hsv` (ver `_zona_en`), puesta a 0 fuera
+    # de la zona `roi`. Sin zona, es la máscara de toda la imagen.
+    def _mascara_en(self, image_hsv, origen, tolerancia, suavizado, morph, roi, region):
+        mask = self.cache_mascara.mascara(self._recorte(image_hsv, region), origen, tolerancia, suavizado, morph)
+        if roi is None or mask is None:
+            return mask
+        y0, y1, x0, x1 = roi
+        dentro = (slice(y0 - region[0], y1 - region[0]), slice(x0 - region[2], x1 - region[2]))
+        limitada = np.zeros_like(mask)
+        limitada[dentro] = mask[dentro]
+        return limitada
+
+    # Copia de los valores actuales de los sliders, colores y reglas.
+    #
+    # Los trabajos en segundo plano reciben esta copia en lugar de leer las variables de Tk
+    # (que solo se pueden usar desde el hilo principal) y así no cambian a mitad de cálculo.
+    # Mismas claves que la receta de `batch.py`, más `reglas`, `pasos` y la zona (`roi`).
+    def _parametros(self):
+        return {
+            "origen_hsv": self.picked_hsv,
+            "destino_hsv": self.target_hsv,
+            "tolerancia": self.tol_var.get(),
+            "suavizado": self.blur_var.get(),
+            "morph": self.morph_var.get(),
+            "fuerza": self.mix_var.get(),
+            "mantener_brillo": self.keep_v_var.get(),
+            "reglas": list(self.reglas),
+            "pasos": list(self.pila.pasos),
+            "roi": self.roi,
+        }
+
+    # Texto de la barra de estado con lo que se está aplicando.
+    def _texto_receta(self, parametros):
+        if parametros["pasos"]:
+            return f"Pasos: {len(parametros['pasos'])}"
+        if parametros["reglas"]:
+            return f"Reglas: {len(parametros['reglas'])}"
+        return f"Objetivo HSV: {parametros['origen_hsv']} | Destino HSV: {parametros['destino_hsv']}"
+
+    # Guarda el resultado a resolución completa.
+    # Si todavía no se ha procesado, la sesión lo descartó por memoria o se calculó con otros
+    # parámetros (otro color, sliders, reglas, pasos o zona), se procesa primero y se guarda
+    # al terminar.
+    def save_result(self):
+        if (
+            self.sesion is None
+            or self.sesion.obtener("resultado") is None
+            or self._parametros_resultado != self._parametros()
+        ):
+            self.process(despues=self._guardar_resultado)
+            return
+        self._guardar_resultado()
+
+    # Pide la ruta y escribe el resultado de la sesión (ver `save_result`).
+    def _guardar_resultado(self):
+        resultado = self.sesion.obtener("resultado")
+        if resultado is None:
+            return
+        path = filedialog.asksaveasfilename(
+            defaultextension=".png",
+            filetypes=[("PNG", "*.png"), ("JPEG", "*.jpg *.jpeg"), ("BMP", "*.bmp")],
         )
-        if self.result_bgr is None:
-            messagebox.showerror("Error", "No se pudo procesar la imagen.")
+        if not path:
             return
-        self.show_image(self.result_bgr)
-        self.status.config(text=f"Procesado | Objetivo HSV: {self.picked_hsv} | Destino HSV: {self.target_hsv}")
+        if not cv2.imwrite(path, resultado):
+            messagebox.showerror("Error", "No se pudo guardar la imagen.")
+            return
+        self.status.config(text=f"Guardado: {path}")
 
     # Genera y muestra una preview de selección (antes del reemplazo final).
     # Esto sirve para que el usuario vea si la máscara está bien ajustada con los sliders.
     #
-    # Internamente:
-    # - crea máscara con `logic.crear_mascara_hsv`
+    # Internamente (en segundo plano, con `trabajador_vista`, ver `_vista_progresiva`):
+    # - en cada nivel de `niveles_vista`, crea la máscara con `_mascara_nivel`
     # - genera preview con `logic.crear_vista_previa`
-    # - muestra la preview
-    def _show_selection_preview(self):
-        if self.image_bgr is None:
+    # - muestra la preview de cada nivel y el tiempo que ha tardado
+    #
+    # Entrada:
+    # - texto: opcional, texto de la barra de estado (por defecto, objetivo/destino/selección).
+    #   Se muestra al momento; el tiempo se añade cuando llega la preview.
+    def _show_selection_preview(self, texto=None):
+        if not self.niveles_vista:
             return
-        mask = logic.crear_mascara_hsv(
-            self.image_hsv,
-            self.picked_hsv,
-            self.tol_var.get(),
-            self.blur_var.get(),
-            self.morph_var.get(),
-        )
-        preview = logic.crear_vista_previa(self.image_bgr, mask)
-        if preview is None:
+        if texto is None:
+            texto = f"Objetivo HSV: {self.picked_hsv} | Destino HSV: {self.target_hsv}{self._texto_seleccion()}"
+        self.modo_vista = "seleccion"
+        self.status.config(text=texto)
+        parametros = self._parametros()
+
+        # Cada nivel va a un array nuevo (sin `out=`): `show_image` reconoce la imagen por
+        # identidad y el nivel anterior puede seguir en pantalla mientras se calcula este.
+        def calcular_nivel(bgr, hsv, escala, token):
+            mask = self._mascara_nivel(parametros, hsv, escala)
+            if token.cancelado():
+                return None
+            return logic.crear_vista_previa(bgr, mask, trabajo=self._trabajo_vista)
+
+        self._vista_progresiva(calcular_nivel, texto)
+
+    # Calcula una vista previa de menos a más resolución, en segundo plano.
+    #
+    # - `calcular_nivel(bgr, hsv, escala, token)` se aplica a cada nivel de `niveles_vista`,
+    #   del más pequeño a la proxy. Cada nivel intermedio se muestra en cuanto está listo
+    #   (`token.entregar`), así algo aparece en unos milisegundos aunque la proxy tarde más.
+    # - Si llega otra petición (por ejemplo, se movió un slider), el token queda cancelado:
+    #   se abandona entre niveles y la nueva empieza otra vez por el más pequeño.
+    # - texto: barra de estado; se le añade el tiempo y, mientras refina, el nivel.
+    def _vista_progresiva(self, calcular_nivel, texto):
+        niveles = list(self.niveles_vista)
+
+        def mostrar_nivel(preview, segundos, nivel):
+            self.show_image(preview, rapido=True)
+            self.status.config(text=f"{texto} | {segundos * 1000:.0f} ms (nivel {nivel}/{len(niveles)}, refinando...)")
+
+        def calcular(token):
+            inicio = time.perf_counter()
+            preview = None
+            for nivel, (bgr, hsv, escala) in enumerate(niveles, 1):
+                if token.cancelado():
+                    return None
+                preview = calcular_nivel(bgr, hsv, escala, token)
+                if preview is None:
+                    return None
+                if nivel < len(niveles):
+                    token.entregar(mostrar_nivel, preview, time.perf_counter() - inicio, nivel)
+            return preview
+
+        def al_terminar(preview, segundos):
+            if preview is None:
+                return
+            self.show_image(preview, rapido=True)
+            self.status.config(text=f"{texto} | {segundos * 1000:.0f} ms")
+
+        self.trabajador_vista.enviar(calcular, al_terminar, self._on_error_vista)
+
+    # Callback de los sliders y de “Mantener brillo”.
+    #
+    # No recalcula al momento: (re)programa `_refrescar_vista_previa` para dentro de
+    # `RETARDO_VISTA_PREVIA_MS`. Mientras el usuario sigue arrastrando, el temporizador se
+    # reinicia, así que solo se calcula cuando se detiene (o hace una pausa).
+    # Tk pasa el valor del slider como argumento; no lo necesitamos.
+    def _on_parametro(self, *_):
+        if self.modo_vista is None:
+            return
+        if self._vista_programada is not None:
+            self.root.after_cancel(self._vista_programada)
+        self._vista_programada = self.root.after(self.RETARDO_VISTA_PREVIA_MS, self._refrescar_vista_previa)
+
+    # Recalcula la vista previa que se está mostrando con los valores actuales.
+    def _refrescar_vista_previa(self):
+        self._vista_programada = None
+        if self.modo_vista == "seleccion" and self.picked_hsv is not None:
+            self._show_selection_preview()
+        elif self.modo_vista == "reemplazo":
+            self.preview_replace()
+
+    # Deja de actualizar la vista previa (por ejemplo, al volver a ver la original).
+    def _cancelar_vista_previa(self):
+        self.modo_vista = None
+        if self._vista_programada is not None:
+            self.root.after_cancel(self._vista_programada)
+            self._vista_programada = None
+        self.trabajador_vista.cancelar()
+
+    # Cancela todo lo pendiente (vistas previas y procesado), por ejemplo al cargar otra imagen.
+    def _cancelar_trabajos(self):
+        self._cancelar_vista_previa()
+        self.trabajador_proceso.cancelar()
+        self.trabajador_indice.cancelar()
+
+    # Entrega en el hilo de Tk los resultados de los trabajos en segundo plano
+    # (ver `worker.entregar_resultados`) y se vuelve a programar.
+    def _recoger_resultados(self):
+        try:
+            worker.entregar_resultados(self.resultados)
+        finally:
+            self.root.after(self.INTERVALO_RESULTADOS_MS, self._recoger_resultados)
+
+    def _on_error_proceso(self, error):
+        messagebox.showerror("Error", f"No se pudo procesar la imagen: {error}")
+        self.status.config(text="Error al procesar")
+
+    def _on_error_indice(self, error):
+        self.status.config(text=f"Error al calcular el histograma: {error}")
+
+    def _on_error_vista(self, error):
+        self.status.config(text=f"Error en la vista previa: {error}")
+
+    # Crea la copia reducida (proxy) de la imagen cargada.
+    #
+    # - Se reduce con INTER_AREA (promedia píxeles, sin aliasing) y luego se convierte a HSV,
+    #   así el HSV de la proxy es coherente con el de la imagen completa.
+    # - Si la imagen ya es pequeña, la proxy es la propia imagen (sin copia).
+    def _crear_proxy(self):
+        h, w = self.image_bgr.shape[:2]
+        escala = min(1.0, self.PROXY_LADO_MAX / max(h, w))
+        if escala >= 1.0:
+            self.proxy_bgr = self.image_bgr
+            self.proxy_hsv = self.sesion.hsv()
+            self.proxy_escala = 1.0
             return
-        self.show_image(preview)
+
+        pw = max(1, int(round(w * escala)))
+        ph = max(1, int(round(h * escala)))
+        self.proxy_bgr = cv2.resize(self.image_bgr, (pw, ph), interpolation=cv2.INTER_AREA)
+        self.proxy_hsv = cv2.cvtColor(self.proxy_bgr, cv2.COLOR_BGR2HSV)
+        self.proxy_escala = pw / w
+
+    # Pirámide de la proxy para las vistas previas progresivas (ver `_vista_progresiva`).
+    #
+    # - Se reduce la proxy a la mitad (INTER_AREA) mientras el lado siga por encima del doble
+    #   de `PROGRESIVO_LADO_MIN`; cada nivel guarda su HSV y su escala respecto a la imagen
+    #   completa. Con la proxy de 1600 px: 400, 800 y 1600 px.
+    # - Se hace una sola vez al cargar: cuesta menos que una vista previa de la proxy.
+    def _crear_niveles_vista(self):
+        niveles = [(self.proxy_bgr, self.proxy_hsv, self.proxy_escala)]
+        bgr, escala = self.proxy_bgr, self.proxy_escala
+        while max(bgr.shape[:2]) > 2 * self.PROGRESIVO_LADO_MIN:
+            h, w = bgr.shape[:2]
+            bgr = cv2.resize(bgr, (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA)
+            escala = escala * bgr.shape[1] / w
+            niveles.append((bgr, cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV), escala))
+        niveles.reverse()
+        self.niveles_vista = niveles
+
+    # Suavizado y morph de `parametros`, escalados a un nivel de la vista previa.
+    def _parametros_nivel(self, parametros, escala):
+        return logic.escalar_parametros_mascara(
+            parametros["suavizado"],
+            parametros["morph"],
+            escala,
+        )
+
+    # Máscara calculada sobre un nivel de la vista previa (`hsv`, a `escala` de la imagen
+    # completa) con los parámetros de los sliders escalados
+    # (ver `logic.escalar_parametros_mascara`). Pasa por `cache_mascara`, así que si solo
+    # cambió la fuerza o “mantener brillo” no se recalcula nada.
+    # Con una zona dibujada solo se calcula en ella (ver `_mascara_en`) y es 0 fuera.
+    def _mascara_nivel(self, parametros, hsv, escala):
+        suavizado, morph = self._parametros_nivel(parametros, escala)
+        roi, region = self._zona_en(parametros["roi"], escala, hsv)
+        mask = self._mascara_en(
+            hsv,
+            parametros["origen_hsv"],
+            parametros["tolerancia"],
+            suavizado,
+            morph,
+            roi,
+            region,
+        )
+        if roi is None or mask is None:
+            return mask
+        completa = np.zeros(hsv.shape[:2], dtype=np.uint8)
+        completa[region[0]:region[1], region[2]:region[3]] = mask
+        return completa
 
     # Muestra una imagen BGR (OpenCV) en el canvas.
-    # Conversión necesaria:
-    # - OpenCV: BGR
-    # - Pillow/Tkinter: RGB
-    def show_image(self, bgr):
-        if Image is None:
+    #
+    # Entrada:
+    # - bgr: imagen a mostrar (la proxy, una vista previa o el resultado completo)
+    # - clave: "original", "vista_previa" o "resultado". Cada una guarda su pirámide
+    #   (ver `_crear_piramide`) y su último render, así volver a mostrarla (por ejemplo
+    #   con “Ver original”) no convierte ni redimensiona nada si el canvas no cambió.
+    # - rapido: redimensionar con un filtro barato (para vistas previas mientras se
+    #   mueven los sliders); el render de calidad se programa para cuando pare.
+    # - niveles: pirámide de `bgr` ya calculada en otro hilo (ver `process`). Si no se
+    #   pasa, se calcula aquí.
+    def show_image(self, bgr, clave="vista_previa", rapido=False, niveles=None):
+        if Image is None or bgr is None:
             return
-        img = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
-        pil_img = Image.fromarray(img)
-        self._show_on_canvas(pil_img)
+        entrada = self._visualizacion.get(clave)
+        if entrada is None or entrada["fuente"]() is not bgr:
+            if niveles is None:
+                niveles = self._crear_piramide(bgr, self._lado_pantalla())
+            entrada = {
+                "fuente": weakref.ref(bgr),
+                "forma": bgr.shape[:2],
+                "niveles": niveles,
+                "render": None,
+            }
+            self._visualizacion[clave] = entrada
+        self._visible = clave
+        self._show_on_canvas(rapido)
+
+    # Pirámide RGB de una imagen para dibujarla a cualquier tamaño de canvas sin volver a
+    # tocar la resolución completa.
+    #
+    # - Se reduce a la mitad (INTER_AREA) hasta que cabe en el doble de la pantalla; ese es el
+    #   primer nivel que se guarda (la imagen completa solo se recorre aquí, una vez).
+    # - Se siguen guardando mitades hasta `PIRAMIDE_LADO_MIN`.
+    # - Para dibujar se elige el nivel más pequeño que sigue siendo mayor que el canvas, así
+    #   el último redimensionado trabaja con, como mucho, el doble de píxeles que el canvas.
+    #
+    # Entrada:
+    # - pantalla: lado mayor de la pantalla (`_lado_pantalla`). Se pasa aparte porque esta
+    #   función también se ejecuta en el hilo de cálculo, que no puede usar Tk.
+    #
+    # Devuelve:
+    # - lista de arrays RGB, de mayor a menor.
+    def _crear_piramide(self, bgr, pantalla):
+        nivel = bgr
+        while max(nivel.shape[:2]) > 2 * pantalla:
+            h, w = nivel.shape[:2]
+            nivel = cv2.resize(nivel, (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA)
+
+        niveles = [cv2.cvtColor(nivel, cv2.COLOR_BGR2RGB)]
+        while max(niveles[-1].shape[:2]) > self.PIRAMIDE_LADO_MIN:
+            h, w = niveles[-1].shape[:2]
+            niveles.append(cv2.resize(niveles[-1], (max(1, w // 2), max(1, h // 2)), interpolation=cv2.INTER_AREA))
+        return niveles
 
-    # Dibuja una imagen PIL en el canvas ajustándola al tamaño disponible.
+    # Lado mayor de la pantalla, en píxeles (solo desde el hilo de Tk).
+    def _lado_pantalla(self):
+        return max(self.root.winfo_screenwidth(), self.root.winfo_screenheight())
+
+    # Dibuja la imagen visible (`_visible`) en el canvas ajustándola al tamaño disponible.
     #
     # Qué hace:
     # - Calcula un `scale` para que la imagen quepa sin deformarse.
-    # - Redimensiona la imagen.
-    # - La centra en el canvas.
+    # - Si ya hay un render de ese tamaño (y de calidad suficiente), lo reutiliza.
+    # - Si no, redimensiona el nivel de la pirámide más adecuado:
+    #   - rápido: INTER_LINEAR, y se programa el render de calidad para después
+    #   - calidad: INTER_AREA al reducir, INTER_CUBIC al ampliar
+    # - La centra en el canvas y dibuja encima el contorno de la zona (ver `_dibujar_roi`).
     # - Guarda `display_info` para poder mapear clicks del canvas a píxeles reales.
-    def _show_on_canvas(self, pil_img):
+    def _show_on_canvas(self, rapido=False):
+        entrada = self._visualizacion.get(self._visible)
+        if entrada is None:
+            return
         cw = max(self.canvas.winfo_width(), 1)
         ch = max(self.canvas.winfo_height(), 1)
-        ow, oh = pil_img.size
+        oh, ow = entrada["forma"]
 
         scale = min(cw / ow, ch / oh)
         dw = max(1, int(ow * scale))
         dh = max(1, int(oh * scale))
-        resized = pil_img.resize((dw, dh), Image.LANCZOS)
+
+        render = entrada["render"]
+        if render is None or render["tamano"] != (dw, dh) or (render["rapido"] and not rapido):
+            niveles = entrada["niveles"]
+            nivel = next((n for n in reversed(niveles) if n.shape[1] >= dw and n.shape[0] >= dh), niveles[0])
+            if rapido:
+                interpolacion = cv2.INTER_LINEAR
+            elif nivel.shape[1] >= dw:
+                interpolacion = cv2.INTER_AREA
+            else:
+                interpolacion = cv2.INTER_CUBIC
+            resized = cv2.resize(nivel, (dw, dh), interpolation=interpolacion)
+            render = {"tamano": (dw, dh), "rapido": rapido, "foto": ImageTk.PhotoImage(Image.fromarray(resized))}
+            entrada["render"] = render
 
         self.display_info = {
             "scale": scale,
@@ -320,9 +1130,44 @@ class ColorReplaceApp:
             "oh": oh,
         }
 
-        self.tk_img = ImageTk.PhotoImage(resized)
+        self.tk_img = render["foto"]
         self.canvas.delete("all")
         self.canvas.create_image(self.display_info["x0"], self.display_info["y0"], image=self.tk_img, anchor=tk.NW)
+        self._dibujar_roi()
+
+        if self._render_programado is not None:
+            self.root.after_cancel(self._render_programado)
+            self._render_programado = None
+        if render["rapido"]:
+            self._render_programado = self.root.after(self.RETARDO_VISTA_PREVIA_MS, self._render_calidad)
+
+    # Dibuja el contorno de la zona de trabajo (si la hay) sobre la imagen del canvas.
+    def _dibujar_roi(self):
+        self.canvas.delete("roi")
+        if self.roi is None or self.display_info is None or self.image_bgr is None:
+            return
+        h, w = self.image_bgr.shape[:2]
+        sx = self.display_info["dw"] / w
+        sy = self.display_info["dh"] / h
+        x0, y0 = self.display_info["x0"], self.display_info["y0"]
+        ry0, ry1, rx0, rx1 = self.roi
+        self.canvas.create_rectangle(
+            x0 + rx0 * sx, y0 + ry0 * sy, x0 + rx1 * sx, y0 + ry1 * sy, outline="#ffd000", dash=(4, 2), tags="roi"
+        )
+
+    # Render de calidad programado tras un render rápido (ver `_show_on_canvas`).
+    def _render_calidad(self):
+        self._render_programado = None
+        self._show_on_canvas()
+
+    # Evento <Configure> del canvas (la ventana cambió de tamaño).
+    # Redibuja desde la pirámide con el filtro rápido; el de calidad llega al parar.
+    def _on_canvas_resize(self, event):
+        tamano = (event.width, event.height)
+        if tamano == self._tamano_canvas:
+            return
+        self._tamano_canvas = tamano
+        self._show_on_canvas(rapido=True)
 
 
     # Punto de entrada de la app.
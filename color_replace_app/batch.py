@@ -0,0 +1,596 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import cache_disco
+import histogram
+import logic
+import paralelo
+import tiles
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+logic.cv2 = cv2
+logic.np = np
+
+
+# Procesamiento por lotes (sin interfaz) para reemplazar un color en muchas imágenes.
+#
+# Idea general:
+# - `app.py` procesa una imagen cada vez y requiere clicks.
+# - Aquí recibimos la “receta” (color origen, color destino y parámetros de los sliders)
+#   por línea de comandos y la aplicamos a un directorio completo o a un patrón glob.
+# - Las imágenes se reparten en un `ProcessPoolExecutor` (un proceso por núcleo) para
+#   escalar con el número de CPUs.
+#
+# Uso:
+#   python batch.py --origen "#c01010" --destino "#1040c0" fotos/ --salida salida/
+#   python batch.py --origen 200,20,20 --destino 20,60,200 "fotos/**/*.jpg" --salida salida/
+#   python batch.py --origen "#c01010" --destino "#1040c0" fotos/ --salida salida/ --cache ~/.cache/color_replace
+
+EXTENSIONES = (".jpg", ".jpeg", ".png", ".bmp")
+
+# Tolerancia por defecto (la misma que el slider de la app). Con `--tolerancia auto`
+# también se usa si el histograma de la imagen no tiene un codo claro.
+TOLERANCIA_DEFECTO = 20
+
+# Receta del proceso hijo. Se fija una sola vez con `_iniciar_worker` para no
+# enviarla (pickle) con cada imagen.
+_receta_worker = None
+
+# Buffers de `logic.reemplazar_color_entero` del proceso hijo, reutilizados entre imágenes.
+_trabajo_worker = {}
+
+# Caché en disco del proceso hijo (`--cache`), o None.
+_cache_worker = None
+
+
+# Convierte un texto de color a RGB (0..255).
+#
+# Acepta:
+# - Hexadecimal: "#RRGGBB" o "RRGGBB"
+# - Lista: "r,g,b"
+#
+# Se usa como `type=` de argparse, por eso lanza ArgumentTypeError si el texto no es válido.
+def parsear_color(texto):
+    valor = texto.strip()
+    try:
+        if "," in valor:
+            partes = [int(p) for p in valor.split(",")]
+            if len(partes) != 3:
+                raise ValueError
+            r, g, b = partes
+        else:
+            valor = valor.lstrip("#")
+            if len(valor) != 6:
+                raise ValueError
+            r, g, b = int(valor[0:2], 16), int(valor[2:4], 16), int(valor[4:6], 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Color no válido: {texto!r} (usa #RRGGBB o r,g,b)")
+
+    for c in (r, g, b):
+        if c < 0 or c > 255:
+            raise argparse.ArgumentTypeError(f"Color fuera de rango 0..255: {texto!r}")
+    return r, g, b
+
+
+# Convierte el texto de `--tolerancia`: un entero o "auto".
+def parsear_tolerancia(texto):
+    if texto.strip().lower() == "auto":
+        return "auto"
+    try:
+        return int(texto)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Tolerancia no válida: {texto!r} (usa un entero o auto)")
+
+
+# Busca las imágenes a procesar.
+#
+# Entrada:
+# - entrada: un directorio o un patrón glob (por ejemplo "fotos/**/*.jpg")
+# - recursivo: si es directorio, recorre también los subdirectorios
+#
+# Devuelve:
+# - (raiz, rutas): `raiz` es la carpeta base usada para conservar la estructura
+#   relativa en la salida; `rutas` es la lista ordenada de archivos.
+def buscar_imagenes(entrada, recursivo=False):
+    if os.path.isdir(entrada):
+        raiz = entrada
+        rutas = []
+        if recursivo:
+            for carpeta, _, archivos in os.walk(entrada):
+                for nombre in archivos:
+                    if nombre.lower().endswith(EXTENSIONES):
+                        rutas.append(os.path.join(carpeta, nombre))
+        else:
+            for nombre in os.listdir(entrada):
+                ruta = os.path.join(entrada, nombre)
+                if os.path.isfile(ruta) and nombre.lower().endswith(EXTENSIONES):
+                    rutas.append(ruta)
+    else:
+        rutas = [
+            ruta for ruta in glob.glob(entrada, recursive=True)
+            if os.path.isfile(ruta) and ruta.lower().endswith(EXTENSIONES)
+        ]
+        if rutas:
+            raiz = os.path.commonpath([os.path.dirname(os.path.abspath(r)) for r in rutas])
+        else:
+            raiz = "."
+
+    return raiz, sorted(rutas)
+
+
+# Aplica la receta completa a una imagen BGR ya cargada.
+#
+# Es el mismo flujo que `ColorReplaceApp.process`:
+# BGR -> HSV -> máscara -> reemplazo -> BGR.
+# Si la receta trae una LUT (`--lut`), se usa `logic.aplicar_lut` en su lugar, y si trae
+# un tamaño de tesela (`--tesela`), `tiles.reemplazar_color_por_teselas`. Con `--paralelo`,
+# la imagen se reparte por bandas entre varios hilos (`paralelo.reemplazar_color_en_paralelo`),
+# con el mismo resultado que el flujo normal.
+#
+# - trabajo: dict opcional de buffers reutilizables (ver `logic.reemplazar_color_entero`).
+# - cache, huella: opcionales, una `cache_disco.CacheDisco` y la huella del archivo de la
+#   imagen. En el flujo normal la máscara se lee de la caché (o se guarda en ella).
+#
+# Devuelve:
+# - Imagen BGR procesada, o None si algo falla.
+def procesar_imagen(image_bgr, receta, trabajo=None, cache=None, huella=None):
+    lut = receta.get("lut")
+    if lut is not None:
+        _, result_bgr = logic.aplicar_lut(image_bgr, lut, receta["suavizado"], receta["morph"])
+        return result_bgr
+
+    if receta.get("tesela"):
+        return tiles.reemplazar_color_por_teselas(
+            image_bgr,
+            receta["origen_hsv"],
+            receta["tolerancia"],
+            receta["suavizado"],
+            receta["morph"],
+            receta["destino_hsv"],
+            receta["fuerza"],
+            receta["mantener_brillo"],
+            tesela=receta["tesela"],
+        )
+
+    if receta.get("paralelo"):
+        return paralelo.reemplazar_color_en_paralelo(
+            image_bgr,
+            receta["origen_hsv"],
+            receta["tolerancia"],
+            receta["suavizado"],
+            receta["morph"],
+            receta["destino_hsv"],
+            receta["fuerza"],
+            receta["mantener_brillo"],
+            hilos=receta["paralelo"],
+        )
+
+    with logic.medir_etapa("bgr_a_hsv", image_bgr.shape[0] * image_bgr.shape[1]):
+        image_hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+    tolerancia = receta["tolerancia"]
+    if tolerancia == "auto":
+        indice = histogram.IndiceHistogramaHSV(image_hsv)
+        tolerancia = indice.sugerir_tolerancia(receta["origen_hsv"])
+        if tolerancia is None:
+            tolerancia = TOLERANCIA_DEFECTO
+    mask = None
+    if cache is not None and huella is not None:
+        clave = cache_disco.clave_mascara(huella, receta["origen_hsv"], tolerancia, receta["suavizado"], receta["morph"])
+        mask = cache.obtener_mascara(clave)
+    if mask is None:
+        mask = logic.crear_mascara_hsv(
+            image_hsv,
+            receta["origen_hsv"],
+            tolerancia,
+            receta["suavizado"],
+            receta["morph"],
+        )
+        if mask is None:
+            return None
+        if cache is not None and huella is not None:
+            cache.guardar_mascara(clave, mask)
+    # Solo se mezclan las zonas con máscara; el resto de píxeles sale tal cual.
+    return logic.reemplazar_color_roi(
+        image_bgr,
+        image_hsv,
+        mask,
+        receta["destino_hsv"],
+        receta["fuerza"],
+        receta["mantener_brillo"],
+        trabajo=trabajo,
+    )
+
+
+# Inicializador de cada proceso hijo.
+#
+# - Guarda la receta en una global del proceso (con la LUT, si la hay, abierta de la
+#   memoria compartida: `paralelo.abrir_lut`).
+# - Limita OpenCV a 1 hilo: el paralelismo ya lo da el pool de procesos y así
+#   evitamos sobre-suscribir la CPU (N procesos x N hilos).
+# - Con `--cache`, abre la caché en disco (todos los procesos comparten la carpeta).
+def _iniciar_worker(receta):
+    global _receta_worker, _cache_worker
+    if receta.get("lut") is not None:
+        receta = dict(receta, lut=paralelo.abrir_lut(receta["lut"]))
+    _receta_worker = receta
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+    if receta.get("cache"):
+        _cache_worker = cache_disco.CacheDisco(receta["cache"], receta["cache_max_bytes"])
+
+
+# Trabajo de un proceso hijo: leer -> procesar -> escribir.
+#
+# Mientras un proceso está leyendo o escribiendo en disco, los demás están calculando,
+# así que la E/S de unas imágenes se solapa con el cálculo de otras.
+#
+# Con `--medir`, el trabajo se ejecuta dentro de un `logic.Medidor` y el resultado incluye
+# también sus etapas (se suman en el proceso principal).
+#
+# Devuelve:
+# - dict con ruta, píxeles procesados, segundos y error (None si fue bien).
+def _procesar_archivo(ruta, ruta_salida):
+    if not _receta_worker.get("medir"):
+        return _leer_procesar_escribir(ruta, ruta_salida)
+
+    with logic.Medidor(memoria=True) as medidor:
+        resultado = _leer_procesar_escribir(ruta, ruta_salida)
+    resultado["etapas"] = medidor.resumen()
+    return resultado
+
+
+def _leer_procesar_escribir(ruta, ruta_salida):
+    if _cache_worker is not None:
+        return _leer_procesar_escribir_cache(ruta, ruta_salida)
+
+    inicio = time.perf_counter()
+    with logic.medir_etapa("lectura", 0):
+        image_bgr = cv2.imread(ruta)
+    if image_bgr is None:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo cargar la imagen."}
+
+    result_bgr = procesar_imagen(image_bgr, _receta_worker, _trabajo_worker)
+    if result_bgr is None:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo procesar la imagen."}
+
+    carpeta = os.path.dirname(ruta_salida)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with logic.medir_etapa("escritura", result_bgr.shape[0] * result_bgr.shape[1]):
+        escrita = cv2.imwrite(ruta_salida, result_bgr)
+    if not escrita:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo guardar la imagen."}
+
+    h, w = image_bgr.shape[:2]
+    return {
+        "ruta": ruta,
+        "pixeles": h * w,
+        "segundos": time.perf_counter() - inicio,
+        "error": None,
+    }
+
+
+# Igual que `_leer_procesar_escribir`, pero con la caché en disco (`--cache`).
+#
+# - Se leen los bytes del archivo y se calcula su huella antes de decodificar nada.
+# - Si la salida de esa huella con esta receta está en la caché, se escriben sus bytes tal
+#   cual y la imagen no se decodifica ni se procesa (el resultado lleva "cache": True y
+#   0 píxeles, para no contar como procesados los MP que no se procesaron).
+# - Si no, se procesa como siempre (con la máscara de la caché si la hay), se codifica una
+#   vez y los mismos bytes van al archivo de salida y a la caché.
+def _leer_procesar_escribir_cache(ruta, ruta_salida):
+    inicio = time.perf_counter()
+    extension = os.path.splitext(ruta_salida)[1]
+    with logic.medir_etapa("lectura", 0):
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+        except OSError:
+            datos = None
+        huella = cache_disco.huella_datos(datos) if datos is not None else None
+    if datos is None:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo cargar la imagen."}
+
+    clave = cache_disco.clave_salida(
+        huella, _receta_worker, extension, _receta_worker.get("lut") is not None, _receta_worker.get("tesela")
+    )
+    guardada = _cache_worker.obtener_salida(clave)
+    if guardada is not None:
+        if not _escribir_bytes(ruta_salida, guardada):
+            return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo guardar la imagen."}
+        return {"ruta": ruta, "pixeles": 0, "segundos": time.perf_counter() - inicio, "error": None, "cache": True}
+
+    with logic.medir_etapa("decodificacion", 0):
+        image_bgr = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+    if image_bgr is None:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo cargar la imagen."}
+
+    result_bgr = procesar_imagen(image_bgr, _receta_worker, _trabajo_worker, _cache_worker, huella)
+    if result_bgr is None:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo procesar la imagen."}
+
+    with logic.medir_etapa("escritura", result_bgr.shape[0] * result_bgr.shape[1]):
+        codificada, salida = cv2.imencode(extension, result_bgr)
+        escrita = codificada and _escribir_bytes(ruta_salida, salida.tobytes())
+    if not escrita:
+        return {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": "No se pudo guardar la imagen."}
+    _cache_worker.guardar_salida(clave, salida.tobytes())
+
+    h, w = image_bgr.shape[:2]
+    return {
+        "ruta": ruta,
+        "pixeles": h * w,
+        "segundos": time.perf_counter() - inicio,
+        "error": None,
+    }
+
+
+# Escribe `datos` en `ruta` (creando la carpeta). Devuelve False si no se pudo.
+def _escribir_bytes(ruta, datos):
+    carpeta = os.path.dirname(ruta)
+    try:
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        with open(ruta, "wb") as f:
+            f.write(datos)
+    except OSError:
+        return False
+    return True
+
+
+# Ejecuta el lote completo con un pool de procesos.
+#
+# Entrada:
+# - tareas: lista de (ruta_entrada, ruta_salida)
+# - receta: dict con los parámetros del reemplazo
+# - workers: número de procesos (por defecto, uno por núcleo)
+# - en_vuelo: máximo de imágenes enviadas al pool y aún sin terminar.
+#   Limitarlo evita cargar en memoria miles de trabajos pendientes a la vez.
+# - progreso: callback opcional que recibe cada resultado al terminar
+#
+# Devuelve:
+# - dict resumen: imágenes, errores, megapíxeles, segundos, img/s, MP/s, imágenes servidas
+#   desde la caché en disco y etapas (suma de `logic.Medidor` de todas las imágenes; vacío
+#   si la receta no pide medir).
+def ejecutar_lote(tareas, receta, workers=None, en_vuelo=None, progreso=None):
+    workers = workers or os.cpu_count() or 1
+    en_vuelo = max(1, en_vuelo or workers * 2)
+
+    inicio = time.perf_counter()
+    procesadas = 0
+    desde_cache = 0
+    errores = []
+    pixeles = 0
+    etapas = logic.Medidor()
+
+    # La LUT (64 MB) no viaja con la receta: si está en memoria compartida
+    # (`paralelo.crear_lut_compartida`), cada hijo la abre por su nombre.
+    receta_hijos = receta
+    if receta.get("lut") is not None:
+        receta_hijos = dict(receta, lut=paralelo.referencia_lut(receta["lut"]))
+
+    pendientes = iter(tareas)
+    activos = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_iniciar_worker,
+        initargs=(receta_hijos,),
+    ) as pool:
+        while True:
+            # Rellenar hasta el límite de trabajos en vuelo.
+            while len(activos) < en_vuelo:
+                tarea = next(pendientes, None)
+                if tarea is None:
+                    break
+                activos[pool.submit(_procesar_archivo, *tarea)] = tarea[0]
+
+            if not activos:
+                break
+
+            hechos, _ = wait(activos, return_when=FIRST_COMPLETED)
+            for futuro in hechos:
+                ruta = activos.pop(futuro)
+                try:
+                    resultado = futuro.result()
+                except Exception as exc:
+                    resultado = {"ruta": ruta, "pixeles": 0, "segundos": 0.0, "error": str(exc)}
+                etapas.sumar(resultado.get("etapas", {}))
+                if resultado["error"] is None:
+                    procesadas += 1
+                    pixeles += resultado["pixeles"]
+                    desde_cache += bool(resultado.get("cache"))
+                else:
+                    errores.append(resultado)
+                if progreso is not None:
+                    progreso(resultado)
+
+    segundos = time.perf_counter() - inicio
+    megapixeles = pixeles / 1e6
+    return {
+        "imagenes": procesadas,
+        "errores": errores,
+        "megapixeles": megapixeles,
+        "segundos": segundos,
+        "imagenes_por_segundo": procesadas / segundos if segundos > 0 else 0.0,
+        "mp_por_segundo": megapixeles / segundos if segundos > 0 else 0.0,
+        "workers": workers,
+        "desde_cache": desde_cache,
+        "etapas": etapas.resumen(),
+    }
+
+
+def _crear_parser():
+    parser = argparse.ArgumentParser(
+        description="Reemplaza un color en todas las imágenes de un directorio o patrón glob.",
+    )
+    parser.add_argument("entrada", help="Directorio o patrón glob (por ejemplo \"fotos/**/*.jpg\").")
+    parser.add_argument("--salida", required=True, help="Directorio donde guardar los resultados.")
+    parser.add_argument("--origen", required=True, type=parsear_color, help="Color a cambiar (#RRGGBB o r,g,b).")
+    parser.add_argument("--destino", required=True, type=parsear_color, help="Color nuevo (#RRGGBB o r,g,b).")
+    parser.add_argument(
+        "--tolerancia",
+        type=parsear_tolerancia,
+        default=TOLERANCIA_DEFECTO,
+        help="Tolerancia HSV (0..60) o \"auto\" para elegirla por imagen con su histograma. Por defecto 20.",
+    )
+    parser.add_argument("--suavizado", type=int, default=7, help="Suavizado/feather (1..31). Por defecto 7.")
+    parser.add_argument("--morph", type=int, default=1, help="Iteraciones de morfología (0..8). Por defecto 1.")
+    parser.add_argument("--fuerza", type=int, default=80, help="Fuerza de mezcla (0..100). Por defecto 80.")
+    parser.add_argument(
+        "--no-mantener-brillo",
+        dest="mantener_brillo",
+        action="store_false",
+        help="Mezclar también el canal V (por defecto se conserva el brillo).",
+    )
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument(
+        "--lut",
+        action="store_true",
+        help="Precalcular una tabla de búsqueda para la receta (compensa con muchas imágenes).",
+    )
+    modo.add_argument(
+        "--tesela",
+        type=int,
+        default=None,
+        help="Procesar por teselas de este lado en píxeles (limita la memoria con imágenes enormes).",
+    )
+    modo.add_argument(
+        "--paralelo",
+        type=int,
+        default=None,
+        help="Repartir cada imagen por bandas entre este número de hilos (para pocas imágenes muy grandes; usar con --workers 1).",
+    )
+    parser.add_argument(
+        "--cache",
+        default=None,
+        help="Carpeta de caché en disco: las imágenes sin cambios con la misma receta se sirven de ella sin procesarlas.",
+    )
+    parser.add_argument(
+        "--cache-max-mb",
+        type=int,
+        default=cache_disco.MAX_BYTES_DEFECTO // 2 ** 20,
+        help=f"Tamaño máximo de la caché en MB. Por defecto {cache_disco.MAX_BYTES_DEFECTO // 2 ** 20}.",
+    )
+    parser.add_argument("--recursivo", action="store_true", help="Si la entrada es un directorio, incluir subdirectorios.")
+    parser.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto, uno por núcleo).")
+    parser.add_argument("--en-vuelo", type=int, default=None, help="Máximo de imágenes en proceso a la vez (por defecto 2 x workers).")
+    parser.add_argument(
+        "--medir",
+        action="store_true",
+        help="Medir cada etapa (lectura, HSV, máscara, mezcla, escritura...) y mostrar el desglose al terminar.",
+    )
+    parser.add_argument("--medir-json", default=None, help="Guardar el resumen y el desglose por etapas en este fichero JSON (implica --medir).")
+    return parser
+
+
+# Tabla con el desglose por etapas de `ejecutar_lote` (tiempo sumado de todos los procesos).
+def imprimir_etapas(etapas):
+    total = sum(valores["segundos"] for valores in etapas.values())
+    for nombre, valores in etapas.items():
+        segundos = valores["segundos"]
+        mp_s = valores["pixeles"] / 1e6 / segundos if valores["pixeles"] and segundos > 0 else 0.0
+        pico = valores["bytes"] / valores["llamadas"] / 2 ** 20 if valores["llamadas"] else 0.0
+        print(
+            f"  {nombre:<14} {segundos:9.3f} s {segundos / total * 100 if total else 0:5.1f}% | "
+            f"{mp_s:9.1f} MP/s | pico medio {pico:8.1f} MB | {valores['llamadas']} llamadas"
+        )
+
+
+# Punto de entrada del modo por lotes.
+#
+# Devuelve el código de salida del proceso (0 = todo bien, 1 = hubo errores, 2 = no hay nada que hacer).
+def main(argv=None):
+    args = _crear_parser().parse_args(argv)
+
+    if cv2 is None or np is None:
+        print("Error: faltan dependencias: cv2 o numpy.", file=sys.stderr)
+        return 2
+
+    if args.tolerancia == "auto" and (args.lut or args.tesela or args.paralelo):
+        print("Error: --tolerancia auto no se puede combinar con --lut, --tesela ni --paralelo.", file=sys.stderr)
+        return 2
+
+    raiz, rutas = buscar_imagenes(args.entrada, args.recursivo)
+    if not rutas:
+        print(f"No se encontraron imágenes en {args.entrada!r}.", file=sys.stderr)
+        return 2
+
+    receta = {
+        "origen_hsv": logic.convertir_rgb_a_hsv(*args.origen),
+        "destino_hsv": logic.convertir_rgb_a_hsv(*args.destino),
+        "tolerancia": args.tolerancia,
+        "suavizado": args.suavizado,
+        "morph": args.morph,
+        "fuerza": args.fuerza,
+        "mantener_brillo": args.mantener_brillo,
+        "tesela": args.tesela,
+        "paralelo": args.paralelo,
+        "medir": args.medir or bool(args.medir_json),
+        "cache": args.cache,
+        "cache_max_bytes": args.cache_max_mb * 2 ** 20,
+    }
+
+    if args.lut:
+        # Se construye una sola vez en el proceso principal, en memoria compartida: a los hijos
+        # solo les llega el nombre del bloque (ver `ejecutar_lote`).
+        lut = paralelo.crear_lut_compartida(
+            receta["origen_hsv"],
+            receta["tolerancia"],
+            receta["destino_hsv"],
+            receta["fuerza"],
+            receta["mantener_brillo"],
+        )
+        receta["lut"] = lut
+        print(f"LUT construida en {lut['segundos_construccion']:.2f} s")
+
+    tareas = []
+    for ruta in rutas:
+        relativa = os.path.relpath(os.path.abspath(ruta), os.path.abspath(raiz))
+        tareas.append((ruta, os.path.join(args.salida, relativa)))
+
+    total = len(tareas)
+    hechas = [0]
+
+    def progreso(resultado):
+        hechas[0] += 1
+        if resultado["error"] is not None:
+            print(f"[{hechas[0]}/{total}] ERROR {resultado['ruta']}: {resultado['error']}", file=sys.stderr)
+
+    print(f"Procesando {total} imágenes | Objetivo HSV: {receta['origen_hsv']} | Destino HSV: {receta['destino_hsv']}")
+    resumen = ejecutar_lote(tareas, receta, args.workers, args.en_vuelo, progreso)
+
+    print(
+        f"Procesadas {resumen['imagenes']} imágenes ({resumen['megapixeles']:.1f} MP) "
+        f"en {resumen['segundos']:.2f} s con {resumen['workers']} procesos | "
+        f"{resumen['imagenes_por_segundo']:.2f} img/s | {resumen['mp_por_segundo']:.2f} MP/s"
+    )
+    if args.cache:
+        print(f"Desde la caché: {resumen['desde_cache']} de {resumen['imagenes']} imágenes")
+    if args.lut and resumen["imagenes"]:
+        amortizado = receta["lut"]["segundos_construccion"] / resumen["imagenes"]
+        print(f"Coste de la LUT amortizado: {amortizado * 1000:.1f} ms/imagen")
+    if receta["medir"]:
+        print("Etapas:")
+        imprimir_etapas(resumen["etapas"])
+    if args.medir_json:
+        with open(args.medir_json, "w", encoding="utf-8") as f:
+            json.dump(resumen, f, indent=2, ensure_ascii=False)
+    if resumen["errores"]:
+        print(f"Errores: {len(resumen['errores'])}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
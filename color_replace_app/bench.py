@@ -0,0 +1,476 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+import logic
+import paralelo
+import tiles
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+logic.cv2 = cv2
+logic.np = np
+
+
+# Benchmark reproducible de las funciones de `logic.py`.
+#
+# ¿Por qué existe?
+# - Para ver si un cambio hace más lenta (o más glotona de memoria) alguna etapa antes de
+#   que llegue a los usuarios, hace falta medir siempre lo mismo y poder comparar.
+#
+# Qué mide:
+# - Imágenes sintéticas (deterministas, sin archivos) de 1 a 100 MP.
+# - Escenarios que recorren las ramas del código: wrap-around del tono por abajo
+#   (`hue_min < 0`) y por arriba (`hue_max > 179`), suavizado grande y nulo, morfología
+#   alta y los dos modos de “mantener brillo”.
+# - Por etapa: tiempo de pared (mediana de varias repeticiones), MP/s y pico de memoria.
+# - También el flujo completo repartido por bandas entre núcleos (`paralelo.py`), para ver
+#   cuánto escala con la máquina.
+#
+# El pico de memoria se mide con `tracemalloc` en una pasada aparte (que sirve también de
+# calentamiento), para no mezclar su sobrecoste con los tiempos. Cuenta los arrays que
+# crean NumPy y OpenCV (los devuelve como arrays de NumPy), no los temporales internos de OpenCV.
+#
+# Con `--verificar` no mide nada: comprueba que las rutas rápidas (bandas, teselas, ROI,
+# mezcla entera, tinte con tablas y LUT) dan lo mismo que la ruta en serie en float32 en
+# todos los escenarios (ver `verificar`).
+#
+# Uso:
+#   python bench.py --json resultados.json
+#   python bench.py --mp 1,10 --comparar resultados.json
+#   python bench.py --verificar
+
+RESOLUCIONES_DEFECTO = (1, 10, 100)
+
+# `--verificar` compara imágenes completas; con 1 MP basta para pasar por todas las ramas.
+RESOLUCIONES_VERIFICAR = (1,)
+
+# Lados de tesela de `--verificar`: uno potencia de dos y otro que no divide a la imagen.
+TESELAS_VERIFICAR = (256, 300)
+
+# Escenarios: parámetros de máscara y reemplazo. El color destino es siempre el mismo.
+ESCENARIOS = {
+    "base": {"color_hsv": (60, 200, 200), "tolerancia": 20, "suavizado": 7, "morph": 1, "mantener_brillo": True},
+    "wrap_abajo": {"color_hsv": (5, 200, 200), "tolerancia": 20, "suavizado": 7, "morph": 1, "mantener_brillo": True},
+    "wrap_arriba": {"color_hsv": (175, 200, 200), "tolerancia": 20, "suavizado": 7, "morph": 1, "mantener_brillo": True},
+    "suavizado_grande": {"color_hsv": (60, 200, 200), "tolerancia": 20, "suavizado": 31, "morph": 1, "mantener_brillo": True},
+    "sin_suavizado": {"color_hsv": (60, 200, 200), "tolerancia": 20, "suavizado": 1, "morph": 0, "mantener_brillo": True},
+    "morph_alto": {"color_hsv": (60, 200, 200), "tolerancia": 20, "suavizado": 7, "morph": 8, "mantener_brillo": True},
+    "sin_mantener_brillo": {"color_hsv": (60, 200, 200), "tolerancia": 20, "suavizado": 7, "morph": 1, "mantener_brillo": False},
+}
+
+COLOR_DESTINO_HSV = (120, 180, 180)
+FUERZA = 80
+
+# Lado mayor de la vista previa de selección a resolución de pantalla (`vista_previa_seleccion`).
+LADO_VISTA_PREVIA = 1600
+
+# Una regresión es un tiempo (o pico de memoria) mayor que el anterior en más de este porcentaje.
+UMBRAL_DEFECTO = 10.0
+
+
+# Imagen sintética BGR de unos `megapixeles` MP (4:3), siempre la misma para el mismo tamaño.
+#
+# - El tono recorre 0..179 a lo ancho (así todos los escenarios seleccionan algo,
+#   también los de wrap-around), con un poco de ruido para que la máscara tenga bordes.
+# - Saturación y brillo varían en diagonal.
+# Se genera por bloques de filas para no crear planos int64 del tamaño de la imagen.
+def imagen_sintetica(megapixeles):
+    ancho = max(1, int(round((megapixeles * 1e6 * 4 / 3) ** 0.5)))
+    alto = max(1, int(round(ancho * 3 / 4)))
+
+    x = np.arange(ancho)[None, :]
+    tono = x * 180 // ancho
+    image_bgr = np.empty((alto, ancho, 3), np.uint8)
+    hsv = np.empty((0, ancho, 3), np.uint8)
+    for y0 in range(0, alto, 256):
+        y = np.arange(y0, min(alto, y0 + 256))[:, None]
+        if hsv.shape[0] != len(y):
+            hsv = np.empty((len(y), ancho, 3), np.uint8)
+        hsv[..., 0] = (tono + (y * 7 + x * 13) % 5 - 2) % 180
+        hsv[..., 1] = (y * 3 + x) % 96 + 160
+        hsv[..., 2] = (y * 5 + x * 3) % 128 + 128
+        cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=image_bgr[y0:y0 + len(y)])
+    return image_bgr
+
+
+# Ejecuta `funcion()` una vez con `tracemalloc` (pico de memoria) y `repeticiones` veces sin él.
+#
+# Devuelve:
+# - (resultado de la última llamada, dict con segundos (mediana), segundos_min y pico_bytes)
+def medir(funcion, repeticiones):
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        resultado = funcion()
+        pico = tracemalloc.get_traced_memory()[1] - base
+    finally:
+        tracemalloc.stop()
+    del resultado
+
+    tiempos = []
+    for _ in range(max(1, repeticiones)):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+
+    return resultado, {
+        "segundos": statistics.median(tiempos),
+        "segundos_min": min(tiempos),
+        "pico_bytes": pico,
+    }
+
+
+# Corre todas las etapas de todos los escenarios para cada resolución.
+#
+# Devuelve:
+# - lista de dicts {megapixeles, escenario, etapa, segundos, segundos_min, mp_por_segundo, pico_bytes}
+def ejecutar_benchmark(resoluciones, escenarios, repeticiones, progreso=None):
+    resultados = []
+
+    def anotar(megapixeles, escenario, etapa, medida):
+        medida.update({"megapixeles": megapixeles, "escenario": escenario, "etapa": etapa})
+        medida["mp_por_segundo"] = megapixeles / medida["segundos"] if megapixeles and medida["segundos"] > 0 else None
+        resultados.append(medida)
+        if progreso is not None:
+            progreso(medida)
+
+    # `convertir_rgb_a_hsv` convierte un solo color: se mide por llamada, sin MP/s.
+    llamadas = 1000
+    _, medida = medir(lambda: [logic.convertir_rgb_a_hsv(i % 256, 128, 255 - i % 256) for i in range(llamadas)], repeticiones)
+    medida["segundos"] /= llamadas
+    medida["segundos_min"] /= llamadas
+    anotar(0, "todos", "convertir_rgb_a_hsv", medida)
+
+    for megapixeles in resoluciones:
+        image_bgr = imagen_sintetica(megapixeles)
+        mp = image_bgr.shape[0] * image_bgr.shape[1] / 1e6
+
+        image_hsv, medida = medir(lambda: cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV), repeticiones)
+        anotar(mp, "todos", "bgr_a_hsv", medida)
+
+        for nombre in escenarios:
+            e = ESCENARIOS[nombre]
+            mask, medida = medir(
+                lambda: logic.crear_mascara_hsv(image_hsv, e["color_hsv"], e["tolerancia"], e["suavizado"], e["morph"]),
+                repeticiones,
+            )
+            anotar(mp, nombre, "crear_mascara_hsv", medida)
+
+            _, medida = medir(
+                lambda: logic.reemplazar_color(image_hsv, mask, COLOR_DESTINO_HSV, FUERZA, e["mantener_brillo"]),
+                repeticiones,
+            )
+            anotar(mp, nombre, "reemplazar_color", medida)
+
+            # Buffers creados en la pasada con tracemalloc y reutilizados en las repeticiones,
+            # como en el modo por lotes.
+            trabajo = {}
+            out = np.empty_like(image_bgr)
+            _, medida = medir(
+                lambda: logic.reemplazar_color_entero(
+                    image_hsv, mask, COLOR_DESTINO_HSV, FUERZA, e["mantener_brillo"], out=out, trabajo=trabajo
+                ),
+                repeticiones,
+            )
+            anotar(mp, nombre, "reemplazar_color_entero", medida)
+
+            _, medida = medir(lambda: logic.crear_vista_previa(image_bgr, mask, out=out, trabajo=trabajo), repeticiones)
+            anotar(mp, nombre, "crear_vista_previa", medida)
+
+            # Vista previa de selección a resolución de pantalla (máscara + tinte de una vez).
+            alto, ancho = image_bgr.shape[:2]
+            escala = min(1.0, LADO_VISTA_PREVIA / max(alto, ancho))
+            tamano = (max(1, round(ancho * escala)), max(1, round(alto * escala)))
+            vista = np.empty((tamano[1], tamano[0], 3), np.uint8)
+            _, medida = medir(
+                lambda: logic.vista_previa_seleccion(
+                    image_bgr, image_hsv, e["color_hsv"], e["tolerancia"], e["suavizado"], e["morph"],
+                    out=vista, trabajo=trabajo, tamano=tamano,
+                ),
+                repeticiones,
+            )
+            anotar(mp, nombre, "vista_previa_seleccion", medida)
+
+            # Flujo completo (BGR -> máscara -> reemplazo) por bandas, un hilo por núcleo.
+            _, medida = medir(
+                lambda: paralelo.reemplazar_color_en_paralelo(
+                    image_bgr, e["color_hsv"], e["tolerancia"], e["suavizado"], e["morph"],
+                    COLOR_DESTINO_HSV, FUERZA, e["mantener_brillo"],
+                ),
+                repeticiones,
+            )
+            anotar(mp, nombre, "reemplazar_en_paralelo", medida)
+
+            del mask, trabajo, out, vista
+
+        del image_bgr, image_hsv
+
+    return resultados
+
+
+# Comprueba que las rutas rápidas dan exactamente lo mismo que la ruta en serie en float32.
+#
+# Referencias, por escenario:
+# - `reemplazar_color` (float32) sobre la máscara de `crear_mascara_hsv`.
+# - La misma, pero con los píxeles de máscara 0 copiados del original: es lo que hacen
+#   `reemplazar_color_roi`, las bandas de `paralelo.py`, las teselas y el modo por lotes.
+# - El tinte de la vista previa con la mezcla float32 original (`base * (1 - alpha) + rojo * alpha`).
+#
+# La única excepción es `logic.aplicar_lut`: su máscara y los píxeles con máscara 0 o 255 deben
+# ser idénticos, pero en el borde (máscara intermedia) se admite ±1 (ver su comentario).
+#
+# Devuelve:
+# - lista de dicts {megapixeles, escenario, comprobacion, diferencia_max, pixeles_distintos}
+#   (`pixeles_distintos` cuenta solo los que pasan de la diferencia admitida)
+def verificar(resoluciones, escenarios, progreso=None):
+    resultados = []
+
+    # margen: diferencia admitida por píxel (array alto x ancho), o None para exigir igualdad.
+    def anotar(megapixeles, escenario, comprobacion, obtenido, esperado, margen=None):
+        diferencia = np.abs(obtenido.astype(np.int16) - esperado.astype(np.int16))
+        if diferencia.ndim == 3:
+            diferencia = diferencia.max(axis=-1)
+        distintos = diferencia > (0 if margen is None else margen)
+        r = {
+            "megapixeles": megapixeles,
+            "escenario": escenario,
+            "comprobacion": comprobacion,
+            "diferencia_max": int(diferencia.max()) if diferencia.size else 0,
+            "pixeles_distintos": int(np.count_nonzero(distintos)),
+        }
+        resultados.append(r)
+        if progreso is not None:
+            progreso(r)
+
+    for megapixeles in resoluciones:
+        image_bgr = imagen_sintetica(megapixeles)
+        image_hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+        mp = image_bgr.shape[0] * image_bgr.shape[1] / 1e6
+
+        for nombre in escenarios:
+            e = ESCENARIOS[nombre]
+            mascara = (e["color_hsv"], e["tolerancia"], e["suavizado"], e["morph"])
+            reemplazo = (COLOR_DESTINO_HSV, FUERZA, e["mantener_brillo"])
+            mask = logic.crear_mascara_hsv(image_hsv, *mascara)
+            flotante = logic.reemplazar_color(image_hsv, mask, *reemplazo)
+            esperado = np.where(mask[:, :, None] > 0, flotante, image_bgr)
+
+            anotar(mp, nombre, "reemplazar_color_entero", logic.reemplazar_color_entero(image_hsv, mask, *reemplazo), flotante)
+            anotar(mp, nombre, "reemplazar_color_roi", logic.reemplazar_color_roi(image_bgr, image_hsv, mask, *reemplazo), esperado)
+            anotar(
+                mp, nombre, "paralelo_hilos",
+                paralelo.reemplazar_color_en_paralelo(image_bgr, *mascara, *reemplazo, hilos=4), esperado,
+            )
+            anotar(
+                mp, nombre, "paralelo_procesos",
+                paralelo.reemplazar_color_en_paralelo(image_bgr, *mascara, *reemplazo, hilos=2, procesos=True), esperado,
+            )
+            for tesela in TESELAS_VERIFICAR:
+                anotar(
+                    mp, nombre, f"teselas_{tesela}",
+                    tiles.reemplazar_color_por_teselas(image_bgr, *mascara, *reemplazo, tesela=tesela), esperado,
+                )
+
+            alpha = (mask.astype(np.float32) / 255.0 * 0.45)[:, :, None]
+            tinte = np.zeros_like(image_bgr)
+            tinte[:, :] = (0, 0, 255)
+            tintada = (image_bgr.astype(np.float32) * (1.0 - alpha) + tinte.astype(np.float32) * alpha).astype(np.uint8)
+            anotar(mp, nombre, "crear_vista_previa", logic.crear_vista_previa(image_bgr, mask), tintada)
+
+            lut = logic.obtener_lut(e["color_hsv"], e["tolerancia"], *reemplazo)
+            mask_lut, con_lut = logic.aplicar_lut(image_bgr, lut, e["suavizado"], e["morph"])
+            anotar(mp, nombre, "aplicar_lut_mascara", mask_lut, mask)
+            borde = ((mask > 0) & (mask < 255)).astype(np.uint8)
+            anotar(mp, nombre, "aplicar_lut", con_lut, esperado, margen=borde)
+
+            del mask, flotante, esperado, alpha, tinte, tintada, mask_lut, con_lut, borde
+
+        del image_bgr, image_hsv
+
+    return resultados
+
+
+# Versiones y máquina, para saber si dos ficheros de resultados son comparables.
+def describir_entorno():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "plataforma": platform.platform(),
+        "procesador": platform.processor() or platform.machine(),
+        "cpus": os.cpu_count(),
+        "hilos_opencv": cv2.getNumThreads(),
+    }
+
+
+# Compara dos listas de resultados (de `ejecutar_benchmark` o de un JSON anterior).
+#
+# Se emparejan por (megapixeles redondeados, escenario, etapa). El tiempo se compara con
+# el mínimo de las repeticiones, que es lo menos sensible al ruido de la máquina.
+#
+# Devuelve:
+# - lista de dicts {clave, campo, antes, ahora, cambio_pct, regresion}
+def comparar_resultados(anteriores, actuales, umbral=UMBRAL_DEFECTO):
+    def clave(r):
+        return (round(r["megapixeles"], 1), r["escenario"], r["etapa"])
+
+    previos = {clave(r): r for r in anteriores}
+    cambios = []
+    for r in actuales:
+        previo = previos.get(clave(r))
+        if previo is None:
+            continue
+        for campo in ("segundos_min", "pico_bytes"):
+            antes, ahora = previo[campo], r[campo]
+            if not antes:
+                continue
+            cambio = (ahora - antes) / antes * 100
+            cambios.append({
+                "clave": clave(r),
+                "campo": campo,
+                "antes": antes,
+                "ahora": ahora,
+                "cambio_pct": cambio,
+                "regresion": cambio > umbral,
+            })
+    return cambios
+
+
+# Lista de MP separados por comas ("1,10,100"). Se usa como `type=` de argparse.
+def parsear_resoluciones(texto):
+    try:
+        valores = [float(v) for v in texto.split(",") if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Resoluciones no válidas: {texto!r} (usa MP separados por comas)")
+    if not valores or any(v <= 0 for v in valores):
+        raise argparse.ArgumentTypeError(f"Resoluciones no válidas: {texto!r} (usa MP separados por comas)")
+    return valores
+
+
+def _crear_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de las etapas de logic.py con imágenes sintéticas.",
+    )
+    parser.add_argument(
+        "--mp",
+        type=parsear_resoluciones,
+        default=None,
+        help="Tamaños de imagen en megapíxeles, separados por comas. Por defecto 1,10,100 (1 con --verificar).",
+    )
+    parser.add_argument(
+        "--escenario",
+        action="append",
+        choices=sorted(ESCENARIOS),
+        help="Escenario a medir (se puede repetir). Por defecto, todos.",
+    )
+    parser.add_argument("--repeticiones", type=int, default=3, help="Repeticiones por etapa (se usa la mediana). Por defecto 3.")
+    parser.add_argument("--hilos", type=int, default=None, help="Hilos de OpenCV (cv2.setNumThreads). Por defecto, los de OpenCV.")
+    parser.add_argument("--json", dest="salida_json", default=None, help="Guardar los resultados en este fichero JSON.")
+    parser.add_argument("--comparar", default=None, help="JSON de una ejecución anterior con el que comparar.")
+    parser.add_argument(
+        "--umbral",
+        type=float,
+        default=UMBRAL_DEFECTO,
+        help="Porcentaje de empeoramiento a partir del cual se marca una regresión. Por defecto 10.",
+    )
+    parser.add_argument(
+        "--verificar",
+        action="store_true",
+        help="No medir: comprobar que bandas, teselas, ROI, mezcla entera, tinte y LUT dan lo mismo que la ruta en float32.",
+    )
+    return parser
+
+
+# Punto de entrada del benchmark.
+#
+# Devuelve el código de salida del proceso (0 = todo bien, 1 = hay regresiones o, con
+# `--verificar`, diferencias, 2 = error).
+def main(argv=None):
+    args = _crear_parser().parse_args(argv)
+
+    if cv2 is None or np is None:
+        print("Error: faltan dependencias: cv2 o numpy.", file=sys.stderr)
+        return 2
+
+    if args.hilos is not None:
+        cv2.setNumThreads(args.hilos)
+
+    escenarios = args.escenario or list(ESCENARIOS)
+
+    if args.verificar:
+        def mostrar(r):
+            estado = "ok" if r["pixeles_distintos"] == 0 else f"DISTINTO ({r['pixeles_distintos']} píxeles)"
+            if r["diferencia_max"]:
+                estado += f" (diferencia máxima {r['diferencia_max']})"
+            print(f"{r['megapixeles']:6.1f} MP | {r['escenario']:<20} | {r['comprobacion']:<24} | {estado}")
+
+        resultados = verificar(args.mp or list(RESOLUCIONES_VERIFICAR), escenarios, mostrar)
+        fallos = [r for r in resultados if r["pixeles_distintos"]]
+        print(f"Verificadas {len(resultados)} comprobaciones: {len(fallos)} con diferencias")
+        return 1 if fallos else 0
+
+    anteriores = None
+    if args.comparar:
+        try:
+            with open(args.comparar, encoding="utf-8") as f:
+                anteriores = json.load(f)["resultados"]
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"Error: no se pudo leer {args.comparar!r}: {exc}", file=sys.stderr)
+            return 2
+
+    def progreso(r):
+        mp_s = f"{r['mp_por_segundo']:8.1f} MP/s" if r["mp_por_segundo"] is not None else " " * 13
+        print(
+            f"{r['megapixeles']:6.1f} MP | {r['escenario']:<20} | {r['etapa']:<24} | "
+            f"{r['segundos'] * 1000:10.3f} ms | {mp_s} | pico {r['pico_bytes'] / 2 ** 20:8.1f} MB"
+        )
+
+    resoluciones = args.mp or list(RESOLUCIONES_DEFECTO)
+    resultados = ejecutar_benchmark(resoluciones, escenarios, args.repeticiones, progreso)
+
+    if args.salida_json:
+        documento = {
+            "version": 1,
+            "fecha": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "entorno": describir_entorno(),
+            "parametros": {
+                "megapixeles": resoluciones,
+                "escenarios": escenarios,
+                "repeticiones": args.repeticiones,
+            },
+            "resultados": resultados,
+        }
+        with open(args.salida_json, "w", encoding="utf-8") as f:
+            json.dump(documento, f, indent=2, ensure_ascii=False)
+        print(f"Resultados guardados en {args.salida_json}")
+
+    if anteriores is None:
+        return 0
+
+    cambios = comparar_resultados(anteriores, resultados, args.umbral)
+    regresiones = [c for c in cambios if c["regresion"]]
+    for c in regresiones:
+        mp, escenario, etapa = c["clave"]
+        print(
+            f"REGRESIÓN {mp} MP | {escenario} | {etapa} | {c['campo']}: "
+            f"{c['antes']:.6g} -> {c['ahora']:.6g} ({c['cambio_pct']:+.1f}%)",
+            file=sys.stderr,
+        )
+    print(f"Comparadas {len(cambios)} medidas con {args.comparar}: {len(regresiones)} regresiones (umbral {args.umbral:.0f}%)")
+    return 1 if regresiones else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
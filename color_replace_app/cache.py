@@ -0,0 +1,146 @@
+import threading
+import weakref
+from collections import OrderedDict
+
+import logic
+
+
+# Caché incremental de máscaras por etapas.
+#
+# ¿Por qué existe?
+# - `logic.crear_mascara_hsv` siempre recalcula toda la cadena:
+#   inRange -> GaussianBlur -> MORPH_OPEN -> MORPH_CLOSE.
+# - Al mover un slider solo cambia un parámetro, así que casi todo ese trabajo se repite.
+#
+# Cómo funciona:
+# - Guarda el resultado de cada etapa con una clave que incluye la imagen y SOLO los
+#   parámetros que afectan a esa etapa (y a las anteriores):
+#   - rango:     (imagen, color, tolerancia)
+#   - suavizado: (imagen, color, tolerancia, suavizado)
+#   - morph:     (imagen, color, tolerancia, suavizado, morph)
+# - Si solo cambia `morph`, se reutiliza la máscara ya suavizada.
+# - Si no cambia nada de la máscara (por ejemplo, solo la fuerza o “mantener brillo”),
+#   la máscara final sale directamente de la caché.
+# - La memoria está acotada: cuando se supera `max_bytes` se descartan las entradas
+#   usadas hace más tiempo (LRU).
+#
+# Las máscaras devueltas son de solo lectura (se comparten entre llamadas).
+#
+# Se puede usar desde varios hilos (la app calcula las vistas previas en segundo plano):
+# el candado protege solo las lecturas/escrituras de la caché, no el cálculo de cada etapa.
+class CacheMascara:
+
+    ETAPAS = ("rango", "suavizado", "morph")
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self._entradas = OrderedDict()
+        self._imagenes = {}
+        self.aciertos = {etapa: 0 for etapa in self.ETAPAS}
+        self.fallos = {etapa: 0 for etapa in self.ETAPAS}
+        # RLock: `_olvidar_imagen` puede ejecutarse (desde el recolector) con el candado ya tomado.
+        self._candado = threading.RLock()
+
+    # Igual que `logic.crear_mascara_hsv`, pero reutilizando las etapas ya calculadas.
+    def mascara(self, image_hsv, color_hsv, tolerancia, suavizado, morph):
+        if image_hsv is None or color_hsv is None or logic.np is None or logic.cv2 is None:
+            return None
+
+        imagen = self._clave_imagen(image_hsv)
+        color = tuple(int(c) for c in color_hsv)
+        # Valores equivalentes comparten entrada (por ejemplo, suavizado 6 y 7).
+        suavizado = _normalizar_suavizado(suavizado)
+        morph = max(0, int(morph))
+
+        clave_rango = ("rango", imagen, color, tolerancia)
+        clave_suavizado = ("suavizado", imagen, color, tolerancia, suavizado)
+        clave_morph = ("morph", imagen, color, tolerancia, suavizado, morph)
+
+        # Las etapas que no hacen nada (suavizado 1, morph 0) no se guardan aparte:
+        # su resultado es el de la etapa anterior.
+        if morph > 0:
+            mask = self._obtener(clave_morph)
+            if mask is not None:
+                return mask
+
+        blurred = self._obtener(clave_suavizado) if suavizado > 1 else None
+        if blurred is None:
+            blurred = self._obtener(clave_rango)
+            if blurred is None:
+                blurred = self._guardar(clave_rango, logic._mascara_rango(image_hsv, color, tolerancia))
+            if suavizado > 1:
+                blurred = self._guardar(clave_suavizado, logic._desenfocar_mascara(blurred, suavizado))
+
+        if morph == 0:
+            return blurred
+        return self._guardar(clave_morph, logic._limpiar_mascara(blurred, morph))
+
+    # Vacía la caché (por ejemplo, al cargar otra imagen).
+    def limpiar(self):
+        with self._candado:
+            self._entradas.clear()
+            self.bytes_usados = 0
+
+    # Resumen para mostrar o exportar: entradas, bytes usados y aciertos/fallos por etapa.
+    def estadisticas(self):
+        with self._candado:
+            return {
+                "entradas": len(self._entradas),
+                "bytes_usados": self.bytes_usados,
+                "max_bytes": self.max_bytes,
+                "aciertos": dict(self.aciertos),
+                "fallos": dict(self.fallos),
+            }
+
+    # Identidad de la imagen.
+    #
+    # Usamos id() del array, que es estable mientras el array exista. Para que un id
+    # reutilizado por otro array no devuelva máscaras ajenas, registramos un
+    # `weakref.finalize` que borra sus entradas cuando la imagen se libera.
+    def _clave_imagen(self, image_hsv):
+        clave = id(image_hsv)
+        with self._candado:
+            if clave not in self._imagenes:
+                self._imagenes[clave] = weakref.finalize(image_hsv, self._olvidar_imagen, clave)
+        return clave
+
+    def _olvidar_imagen(self, clave):
+        with self._candado:
+            self._imagenes.pop(clave, None)
+            for entrada in [k for k in self._entradas if k[1] == clave]:
+                self.bytes_usados -= self._entradas.pop(entrada).nbytes
+
+    def _obtener(self, clave):
+        with self._candado:
+            mask = self._entradas.get(clave)
+            if mask is None:
+                self.fallos[clave[0]] += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos[clave[0]] += 1
+            return mask
+
+    def _guardar(self, clave, mask):
+        mask.flags.writeable = False
+        if mask.nbytes > self.max_bytes:
+            return mask
+
+        with self._candado:
+            viejo = self._entradas.pop(clave, None)
+            if viejo is not None:
+                self.bytes_usados -= viejo.nbytes
+            self._entradas[clave] = mask
+            self.bytes_usados += mask.nbytes
+            while self.bytes_usados > self.max_bytes:
+                _, viejo = self._entradas.popitem(last=False)
+                self.bytes_usados -= viejo.nbytes
+        return mask
+
+
+# El kernel del blur siempre es impar y <= 1 significa “sin blur”.
+def _normalizar_suavizado(suavizado):
+    suavizado = int(suavizado)
+    if suavizado % 2 == 0:
+        suavizado = suavizado + 1
+    return max(1, suavizado)
@@ -0,0 +1,252 @@
+import hashlib
+import os
+import tempfile
+import time
+
+import ediciones
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Caché persistente en disco, direccionada por contenido, para el modo por lotes.
+#
+# ¿Por qué existe?
+# - Los lotes nocturnos repiten las mismas recetas sobre un catálogo en el que casi ninguna
+#   imagen cambia de un día a otro, y cada ejecución vuelve a convertir a HSV, calcular la
+#   máscara y mezclar todas las imágenes.
+# - Aquí se guarda, por la huella del contenido del archivo (no por su ruta ni su fecha),
+#   la salida ya codificada y la máscara. Una imagen sin cambios con la misma receta ni
+#   siquiera se decodifica: se copian los bytes guardados al archivo de salida.
+#
+# Qué se guarda:
+# - Salida: los bytes que escribiría `cv2.imwrite` (ya comprimidos en el formato de salida).
+#   Clave: huella del archivo + receta completa + formato.
+# - Máscara: PNG de un canal (las máscaras son casi todo 0/255 y comprimen mucho).
+#   Clave: huella del archivo + color origen, tolerancia, suavizado y morph. Sirve cuando
+#   solo cambian el destino, la fuerza o “mantener brillo”.
+# - El HSV no se guarda: convertirlo cuesta menos que leerlo y descomprimirlo.
+#
+# Varios procesos a la vez (los workers de `batch.py`):
+# - Cada entrada se escribe en un fichero temporal de la misma carpeta y se renombra
+#   (`os.replace`, atómico): nadie lee nunca una entrada a medias. Si dos procesos escriben
+#   la misma clave, el contenido es el mismo y gana cualquiera.
+# - El LRU usa la fecha de modificación: cada acierto la actualiza (`os.utime`).
+# - Al pasar de `max_bytes`, un solo proceso a la vez (fichero de candado) borra las
+#   entradas usadas hace más tiempo hasta bajar a `FRACCION_TRAS_LIMPIEZA`. Borrar una
+#   entrada que otro está leyendo es seguro: se lee entera o cuenta como fallo.
+
+# Se incluye en todas las claves: subirla invalida la caché si cambia el cálculo.
+VERSION = 2
+
+MAX_BYTES_DEFECTO = 2 * 1024 ** 3
+
+# Tras limpiar, la caché queda en esta fracción de `max_bytes` (para no limpiar en cada escritura).
+FRACCION_TRAS_LIMPIEZA = 0.9
+
+# Cada cuántas escrituras se vuelve a medir la carpeta (lo que escriben los otros procesos
+# solo se ve al medirla).
+REVISAR_CADA = 64
+
+# Un candado de limpieza más antiguo que esto se da por abandonado (proceso muerto).
+CANDADO_CADUCA_S = 60.0
+
+# Ficheros temporales más antiguos que esto son restos de un proceso que murió escribiendo.
+TEMPORAL_CADUCA_S = 3600.0
+
+_EXTENSIONES = {"salida": ".bin", "mascara": ".png"}
+_CANDADO = "limpieza.lock"
+
+
+# Huella del contenido de un archivo ya leído (bytes), como `ediciones.huella_imagen`.
+def huella_datos(datos):
+    return hashlib.blake2b(datos, digest_size=16).hexdigest()
+
+
+# Clave de la salida de una receta (dict con las claves de `ediciones.CLAVES_PASO`).
+#
+# - extension: formato de salida (".jpg", ".png"...), porque los bytes guardados ya van codificados.
+# - lut: con LUT el color puede diferir en ±1 (ver `logic.aplicar_lut`), así que es otra entrada.
+# - tesela: lado de tesela (`--tesela`) o 0. Cada modo de proceso tiene su propia entrada,
+#   así un cambio en uno de ellos nunca devuelve bytes calculados por otro.
+def clave_salida(huella, receta, extension, lut=False, tesela=0):
+    modo = (bool(lut), int(tesela or 0))
+    return _huella(ediciones.huella_paso(huella, receta), ("salida", extension.lower(), modo, VERSION))
+
+
+# Clave de una máscara: solo los parámetros que la cambian.
+def clave_mascara(huella, color_hsv, tolerancia, suavizado, morph):
+    parametros = (tuple(int(c) for c in color_hsv), int(tolerancia), int(suavizado), int(morph))
+    return _huella(huella, ("mascara", parametros, VERSION))
+
+
+def _huella(anterior, parametros):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(anterior.encode())
+    h.update(repr(parametros).encode())
+    return h.hexdigest()
+
+
+class CacheDisco:
+
+    # Entrada:
+    # - carpeta: dónde guardar la caché (se crea si no existe). Varios procesos pueden usar
+    #   la misma carpeta a la vez.
+    # - max_bytes: tamaño máximo aproximado de la carpeta.
+    def __init__(self, carpeta, max_bytes=MAX_BYTES_DEFECTO):
+        self.carpeta = carpeta
+        self.max_bytes = max_bytes
+        os.makedirs(carpeta, exist_ok=True)
+        self.aciertos = {tipo: 0 for tipo in _EXTENSIONES}
+        self.fallos = {tipo: 0 for tipo in _EXTENSIONES}
+        self._escrituras = 0
+        # Tamaño de la carpeta según la última medición más lo que ha escrito este proceso.
+        self._estimado = sum(tamano for _, tamano, _ in self._entradas())
+
+    # Bytes guardados de una salida, o None si no están.
+    def obtener_salida(self, clave):
+        return self._leer("salida", clave)
+
+    def guardar_salida(self, clave, datos):
+        self._escribir("salida", clave, datos)
+
+    # Máscara guardada (uint8, un canal), o None si no está.
+    def obtener_mascara(self, clave):
+        datos = self._leer("mascara", clave)
+        if datos is None:
+            return None
+        mask = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_UNCHANGED)
+        if mask is None:
+            self.aciertos["mascara"] -= 1
+            self.fallos["mascara"] += 1
+        return mask
+
+    def guardar_mascara(self, clave, mask):
+        # Compresión 1: casi lo mismo de pequeña que la máxima y mucho más rápida.
+        codificada, datos = cv2.imencode(".png", mask, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        if codificada:
+            self._escribir("mascara", clave, datos.tobytes())
+
+    # Aciertos y fallos de este proceso, y el tamaño estimado de la carpeta.
+    def estadisticas(self):
+        return {
+            "aciertos": dict(self.aciertos),
+            "fallos": dict(self.fallos),
+            "bytes_estimados": self._estimado,
+            "max_bytes": self.max_bytes,
+        }
+
+    # Ruta de una entrada: repartidas en 256 subcarpetas por los dos primeros caracteres.
+    def _ruta(self, tipo, clave):
+        return os.path.join(self.carpeta, clave[:2], clave + _EXTENSIONES[tipo])
+
+    def _leer(self, tipo, clave):
+        ruta = self._ruta(tipo, clave)
+        try:
+            with open(ruta, "rb") as f:
+                datos = f.read()
+        except OSError:
+            self.fallos[tipo] += 1
+            return None
+        # Usada ahora: pasa al final del orden LRU.
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        self.aciertos[tipo] += 1
+        return datos
+
+    def _escribir(self, tipo, clave, datos):
+        ruta = self._ruta(tipo, clave)
+        carpeta = os.path.dirname(ruta)
+        os.makedirs(carpeta, exist_ok=True)
+        descriptor, temporal = tempfile.mkstemp(dir=carpeta, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(datos)
+            os.replace(temporal, ruta)
+        except OSError:
+            # Por ejemplo, en Windows si otro proceso tiene abierta la misma entrada: ya la
+            # ha escrito él, con el mismo contenido.
+            try:
+                os.remove(temporal)
+            except OSError:
+                pass
+            return
+
+        self._estimado += len(datos)
+        self._escrituras += 1
+        if self._estimado > self.max_bytes or self._escrituras % REVISAR_CADA == 0:
+            self._limpiar()
+
+    # Mide la carpeta y, si pasa de `max_bytes`, borra las entradas usadas hace más tiempo.
+    # Si otro proceso ya está limpiando, no hace nada.
+    def _limpiar(self):
+        candado = os.path.join(self.carpeta, _CANDADO)
+        if not _tomar_candado(candado):
+            return
+        try:
+            entradas = sorted(self._entradas())
+            total = sum(tamano for _, tamano, _ in entradas)
+            if total > self.max_bytes:
+                objetivo = self.max_bytes * FRACCION_TRAS_LIMPIEZA
+                for _, tamano, ruta in entradas:
+                    if total <= objetivo:
+                        break
+                    try:
+                        os.remove(ruta)
+                    except OSError:
+                        continue
+                    total -= tamano
+            self._estimado = total
+        finally:
+            try:
+                os.remove(candado)
+            except OSError:
+                pass
+
+    # Entradas de la caché: (fecha de modificación, tamaño, ruta). De paso borra los
+    # temporales abandonados.
+    def _entradas(self):
+        entradas = []
+        ahora = time.time()
+        for sub in os.scandir(self.carpeta):
+            if not sub.is_dir():
+                continue
+            for entrada in os.scandir(sub.path):
+                try:
+                    info = entrada.stat()
+                except OSError:
+                    continue
+                if entrada.name.endswith(".tmp"):
+                    if ahora - info.st_mtime > TEMPORAL_CADUCA_S:
+                        try:
+                            os.remove(entrada.path)
+                        except OSError:
+                            pass
+                    continue
+                entradas.append((info.st_mtime, info.st_size, entrada.path))
+        return entradas
+
+
+# Crea el fichero de candado (falla si ya existe: solo un proceso lo consigue). Un candado
+# más antiguo que `CANDADO_CADUCA_S` se considera abandonado y se sustituye.
+def _tomar_candado(ruta):
+    for _ in range(2):
+        try:
+            os.close(os.open(ruta, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(ruta) < CANDADO_CADUCA_S:
+                    return False
+                os.remove(ruta)
+            except OSError:
+                return False
+        except OSError:
+            return False
+    return False
@@ -0,0 +1,185 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import bench
+import paralelo
+import servicio
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Cliente de prueba de carga para `servicio.py`.
+#
+# ¿Por qué existe?
+# - Para ver cómo se comporta el servicio con muchas peticiones a la vez (latencia, cuántas
+#   se agrupan por lote, cuándo empieza a rechazar con 503) sin depender de otra herramienta.
+#
+# Qué hace:
+# - Envía `--peticiones` reemplazos con `--concurrencia` hilos, todos con la misma imagen y
+#   receta (así el servicio los puede agrupar).
+# - La imagen es `--imagen` o una sintética de `bench.imagen_sintetica` (`--mp`).
+# - Con `--compartida`, cada hilo deja la imagen en un bloque de memoria compartida
+#   (`paralelo.crear_compartida`) y solo envía su nombre; si no, envía la imagen codificada.
+# - Al terminar muestra peticiones por segundo, percentiles de latencia, rechazos y errores,
+#   y las métricas del propio servicio (GET /metricas).
+#
+# Uso:
+#   python servicio.py --workers 4 &
+#   python carga.py --peticiones 500 --concurrencia 16
+#   python carga.py --imagen foto.jpg --compartida
+
+URL_DEFECTO = f"http://{servicio.HOST_DEFECTO}:{servicio.PUERTO_DEFECTO}"
+
+
+# Envía una petición y devuelve (segundos, código HTTP). Código 0 si no hubo respuesta.
+def enviar(url, cuerpo=None):
+    peticion = urllib.request.Request(url, data=cuerpo or b"", method="POST")
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(peticion) as respuesta:
+            respuesta.read()
+            estado = respuesta.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        estado = exc.code
+    except (urllib.error.URLError, OSError):
+        estado = 0
+    return time.perf_counter() - inicio, estado
+
+
+# Lanza la prueba de carga.
+#
+# Entrada:
+# - url: base del servicio (sin ruta)
+# - image_bgr: imagen a enviar en cada petición
+# - consulta: dict con la receta (origen, destino, tolerancia...)
+# - peticiones, concurrencia: total de peticiones e hilos enviándolas a la vez
+# - compartida: usar memoria compartida en lugar de bytes codificados
+#
+# Devuelve:
+# - dict con peticiones, correctas, rechazadas (503), errores, segundos, peticiones/s y latencia_ms.
+def ejecutar_carga(url, image_bgr, consulta, peticiones, concurrencia, compartida=False):
+    alto, ancho = image_bgr.shape[:2]
+    cuerpo = None
+    if not compartida:
+        _, codificada = cv2.imencode(".png", image_bgr)
+        cuerpo = codificada.tobytes()
+
+    # Con memoria compartida, cada hilo tiene sus propios bloques de entrada y salida.
+    locales = threading.local()
+    bloques = []
+
+    def una(_):
+        if not compartida:
+            return enviar(f"{url}/reemplazar?{urlencode(consulta)}", cuerpo)
+        if not hasattr(locales, "entrada"):
+            locales.entrada = paralelo.crear_compartida(image_bgr.shape)
+            locales.salida = paralelo.crear_compartida(image_bgr.shape)
+            np.copyto(locales.entrada, image_bgr)
+            bloques.append((locales.entrada, locales.salida))
+        parametros = dict(
+            consulta,
+            compartida=paralelo.nombre_compartida(locales.entrada),
+            salida=paralelo.nombre_compartida(locales.salida),
+            alto=alto,
+            ancho=ancho,
+        )
+        return enviar(f"{url}/reemplazar?{urlencode(parametros)}")
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as pool:
+        resultados = list(pool.map(una, range(peticiones)))
+    segundos = time.perf_counter() - inicio
+    bloques.clear()
+
+    latencias = sorted(s for s, estado in resultados if estado == 200)
+    return {
+        "peticiones": peticiones,
+        "correctas": len(latencias),
+        "rechazadas": sum(1 for _, estado in resultados if estado == 503),
+        "errores": sum(1 for _, estado in resultados if estado not in (200, 503)),
+        "segundos": segundos,
+        "peticiones_por_segundo": len(latencias) / segundos if segundos > 0 else 0.0,
+        "latencia_ms": {
+            "p50": servicio.percentil(latencias, 50) * 1000,
+            "p90": servicio.percentil(latencias, 90) * 1000,
+            "p99": servicio.percentil(latencias, 99) * 1000,
+        },
+    }
+
+
+def _crear_parser():
+    parser = argparse.ArgumentParser(
+        description="Prueba de carga del servicio de reemplazo de color (servicio.py).",
+    )
+    parser.add_argument("--url", default=URL_DEFECTO, help=f"Dirección del servicio. Por defecto {URL_DEFECTO}.")
+    parser.add_argument("--imagen", default=None, help="Imagen a enviar (por defecto, una sintética de --mp megapíxeles).")
+    parser.add_argument("--mp", type=float, default=0.1, help="Tamaño de la imagen sintética en megapíxeles. Por defecto 0.1.")
+    parser.add_argument("--peticiones", type=int, default=200, help="Número de peticiones. Por defecto 200.")
+    parser.add_argument("--concurrencia", type=int, default=8, help="Peticiones a la vez. Por defecto 8.")
+    parser.add_argument("--origen", default="20c020", help="Color a cambiar (RRGGBB o r,g,b). Por defecto 20c020.")
+    parser.add_argument("--destino", default="2040c0", help="Color nuevo (RRGGBB o r,g,b). Por defecto 2040c0.")
+    parser.add_argument("--tolerancia", default=None, help="Tolerancia (por defecto, la del servicio).")
+    parser.add_argument("--compartida", action="store_true", help="Enviar la imagen por memoria compartida.")
+    parser.add_argument("--lut", action="store_true", help="Pedir la LUT precargada del servicio (?lut=1).")
+    return parser
+
+
+# Punto de entrada del cliente. Devuelve 0 si todas las peticiones fueron bien, 1 si no.
+def main(argv=None):
+    args = _crear_parser().parse_args(argv)
+
+    if cv2 is None or np is None:
+        print("Error: faltan dependencias: cv2 o numpy.", file=sys.stderr)
+        return 2
+
+    if args.imagen:
+        image_bgr = cv2.imread(args.imagen)
+        if image_bgr is None:
+            print(f"Error: no se pudo cargar {args.imagen!r}.", file=sys.stderr)
+            return 2
+    else:
+        image_bgr = bench.imagen_sintetica(args.mp)
+
+    consulta = {"origen": args.origen.lstrip("#"), "destino": args.destino.lstrip("#")}
+    if args.tolerancia:
+        consulta["tolerancia"] = args.tolerancia
+    if args.lut:
+        consulta["lut"] = 1
+
+    alto, ancho = image_bgr.shape[:2]
+    modo = "memoria compartida" if args.compartida else "bytes"
+    print(f"{args.peticiones} peticiones ({ancho}x{alto}, {modo}) con concurrencia {args.concurrencia} a {args.url}")
+    resumen = ejecutar_carga(args.url, image_bgr, consulta, args.peticiones, args.concurrencia, args.compartida)
+
+    latencia = resumen["latencia_ms"]
+    print(
+        f"Correctas {resumen['correctas']} | rechazadas (503) {resumen['rechazadas']} | errores {resumen['errores']} | "
+        f"{resumen['segundos']:.2f} s | {resumen['peticiones_por_segundo']:.1f} pet/s"
+    )
+    print(f"Latencia: p50 {latencia['p50']:.1f} ms | p90 {latencia['p90']:.1f} ms | p99 {latencia['p99']:.1f} ms")
+
+    try:
+        with urllib.request.urlopen(f"{args.url}/metricas") as respuesta:
+            print("Métricas del servicio:")
+            print(json.dumps(json.load(respuesta), indent=2, ensure_ascii=False))
+    except (urllib.error.URLError, OSError, ValueError) as exc:
+        print(f"No se pudieron leer las métricas: {exc}", file=sys.stderr)
+
+    return 0 if resumen["correctas"] == args.peticiones else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
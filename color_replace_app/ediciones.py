@@ -0,0 +1,268 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import logic
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Pila de ediciones encadenadas (un reemplazo detrás de otro) con deshacer/rehacer.
+#
+# ¿Por qué existe?
+# - `process()` siempre parte de la imagen original, así que no se pueden encadenar
+#   reemplazos (por ejemplo, rojo -> azul y luego el azul resultante -> verde).
+# - Encadenarlos a mano obliga a rehacerlo todo cada vez que se retoca un paso.
+#
+# Cómo funciona:
+# - `pasos` es una lista ordenada de recetas (ver `crear_paso`); cada paso trabaja sobre la
+#   salida del anterior con `logic.crear_mascara_hsv` + `logic.reemplazar_color_roi`.
+# - La salida de cada paso se guarda con una huella (hash) que encadena la de la imagen de
+#   entrada con los parámetros de todos los pasos hasta él. Si se cambia el paso k, las
+#   huellas de 0..k-1 no cambian: se reutilizan sus salidas y solo se recalcula de k en adelante.
+# - La memoria está acotada: cuando se supera `max_bytes` se descartan las salidas usadas
+#   hace más tiempo (LRU), igual que en `cache.py`.
+# - Cada cambio en `pasos` (añadir, cambiar, quitar) guarda el estado anterior para
+#   `deshacer`; `rehacer` vuelve a aplicarlo.
+#
+# Las salidas devueltas son de solo lectura (se comparten entre llamadas).
+#
+# `aplicar` se puede llamar desde varios hilos a la vez (vista previa y Procesar en la app);
+# los cambios en `pasos` se hacen desde el hilo de Tk, y `aplicar` recibe su propia copia.
+
+# Parámetros de un paso (los mismos que la receta de `batch.py`).
+CLAVES_PASO = ("origen_hsv", "tolerancia", "suavizado", "morph", "destino_hsv", "fuerza", "mantener_brillo")
+
+# Estados que recuerda `deshacer`.
+MAX_DESHACER = 100
+
+
+# Crea un paso con los valores normalizados (colores como tuplas de int), así dos pasos
+# iguales tienen siempre la misma huella.
+def crear_paso(origen_hsv, tolerancia, suavizado, morph, destino_hsv, fuerza, mantener_brillo):
+    return {
+        "origen_hsv": tuple(int(c) for c in origen_hsv),
+        "tolerancia": int(tolerancia),
+        "suavizado": int(suavizado),
+        "morph": int(morph),
+        "destino_hsv": tuple(int(c) for c in destino_hsv),
+        "fuerza": int(fuerza),
+        "mantener_brillo": bool(mantener_brillo),
+    }
+
+
+# Texto corto de un paso para listas y barras de estado.
+def describir_paso(paso):
+    return f"{paso['origen_hsv']} -> {paso['destino_hsv']} | tol {paso['tolerancia']} | fuerza {paso['fuerza']}"
+
+
+# Huella del contenido de una imagen (forma, tipo y píxeles).
+def huella_imagen(image):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr((image.shape, image.dtype.str)).encode())
+    h.update(np.ascontiguousarray(image).data)
+    return h.hexdigest()
+
+
+# Huella de una imagen de la que solo se cambia una zona (y0, y1, x0, x1): la de la imagen
+# más la zona, porque con otra zona las salidas de los pasos son otras.
+def huella_zona(anterior, zona):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(anterior.encode())
+    h.update(repr(("zona", tuple(int(c) for c in zona))).encode())
+    return h.hexdigest()
+
+
+# Huella de la salida de un paso: la de su entrada más los parámetros con que se aplicó.
+def huella_paso(anterior, paso):
+    h = hashlib.blake2b(digest_size=16)
+    h.update(anterior.encode())
+    h.update(repr(tuple(paso[clave] for clave in CLAVES_PASO)).encode())
+    return h.hexdigest()
+
+
+class PilaEdiciones:
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.pasos = []
+        self._deshacer = []
+        self._rehacer = []
+        self.max_bytes = max_bytes
+        self.bytes_usados = 0
+        self._salidas = OrderedDict()
+        self._huellas = {}
+        self.aciertos = 0
+        self.fallos = 0
+        # RLock: `_olvidar_imagen` puede ejecutarse (desde el recolector) con el candado ya tomado.
+        self._candado = threading.RLock()
+
+    # Añade un paso al final.
+    def anadir(self, paso):
+        self._recordar()
+        self.pasos.append(paso)
+
+    # Sustituye el paso `indice`. Los anteriores conservan sus salidas en la caché.
+    def cambiar(self, indice, paso):
+        self._recordar()
+        self.pasos[indice] = paso
+
+    # Quita el paso `indice`.
+    def quitar(self, indice):
+        self._recordar()
+        del self.pasos[indice]
+
+    # Vuelve al estado anterior al último cambio. Devuelve False si no había nada que deshacer.
+    def deshacer(self):
+        if not self._deshacer:
+            return False
+        self._rehacer.append(list(self.pasos))
+        self.pasos = self._deshacer.pop()
+        return True
+
+    # Repite el último cambio deshecho. Devuelve False si no había nada que rehacer.
+    def rehacer(self):
+        if not self._rehacer:
+            return False
+        self._deshacer.append(list(self.pasos))
+        self.pasos = self._rehacer.pop()
+        return True
+
+    # Vacía los pasos, el historial y la caché (por ejemplo, al cargar otra imagen).
+    def limpiar(self):
+        self.pasos = []
+        self._deshacer.clear()
+        self._rehacer.clear()
+        with self._candado:
+            self._salidas.clear()
+            self.bytes_usados = 0
+
+    # Aplica los pasos uno detrás de otro sobre `image_bgr`.
+    #
+    # Entrada:
+    # - image_bgr: imagen de partida (la completa o la proxy).
+    # - pasos: lista de pasos (por defecto, una copia de `self.pasos`).
+    # - escala: tamaño de `image_bgr` respecto a la imagen completa; el suavizado y la
+    #   morfología se escalan con `logic.escalar_parametros_mascara`.
+    # - image_hsv: HSV de `image_bgr`, si ya se tiene (si no, se calcula cuando haga falta).
+    # - token: opcional (ver `worker.py`); si queda cancelado se deja de calcular.
+    # - zona: opcional, (y0, y1, x0, x1) en píxeles de `image_bgr`. La máscara de cada paso
+    #   se pone a 0 fuera de ella, así fuera de la zona la salida es `image_bgr`.
+    #
+    # Devuelve:
+    # - (resultado BGR, pasos reutilizados de la caché). El resultado es None si se canceló.
+    def aplicar(self, image_bgr, pasos=None, escala=1.0, image_hsv=None, token=None, zona=None):
+        if image_bgr is None or np is None or cv2 is None:
+            return None, 0
+        if pasos is None:
+            pasos = list(self.pasos)
+
+        aplicados = []
+        huellas = []
+        huella = self._huella_imagen(image_bgr)
+        if zona is not None:
+            huella = huella_zona(huella, zona)
+        for paso in pasos:
+            suavizado, morph = logic.escalar_parametros_mascara(paso["suavizado"], paso["morph"], escala)
+            paso = dict(paso, suavizado=suavizado, morph=morph)
+            huella = huella_paso(huella, paso)
+            aplicados.append(paso)
+            huellas.append(huella)
+
+        # Se parte de la salida guardada más avanzada.
+        inicio = 0
+        bgr, hsv = image_bgr, image_hsv
+        for i in range(len(huellas) - 1, -1, -1):
+            guardada = self._obtener(huellas[i])
+            if guardada is not None:
+                inicio = i + 1
+                bgr, hsv = guardada, None
+                break
+
+        for paso, huella in zip(aplicados[inicio:], huellas[inicio:]):
+            if token is not None and token.cancelado():
+                return None, inicio
+            if hsv is None:
+                with logic.medir_etapa("bgr_a_hsv", bgr.shape[0] * bgr.shape[1]):
+                    hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+            mask = logic.crear_mascara_hsv(hsv, paso["origen_hsv"], paso["tolerancia"], paso["suavizado"], paso["morph"])
+            if zona is not None:
+                mask = _limitar_mascara(mask, zona)
+            bgr = logic.reemplazar_color_roi(bgr, hsv, mask, paso["destino_hsv"], paso["fuerza"], paso["mantener_brillo"])
+            hsv = None
+            self._guardar(huella, bgr)
+        return bgr, inicio
+
+    # Resumen para mostrar o exportar: salidas guardadas, bytes usados y aciertos/fallos.
+    def estadisticas(self):
+        with self._candado:
+            return {
+                "salidas": len(self._salidas),
+                "bytes_usados": self.bytes_usados,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+            }
+
+    def _recordar(self):
+        self._deshacer.append(list(self.pasos))
+        del self._deshacer[:-MAX_DESHACER]
+        self._rehacer.clear()
+
+    # Huella de una imagen, calculada una sola vez mientras el array exista (igual que
+    # `cache.CacheMascara._clave_imagen`, el id se olvida cuando la imagen se libera).
+    def _huella_imagen(self, image):
+        clave = id(image)
+        with self._candado:
+            huella = self._huellas.get(clave)
+        if huella is not None:
+            return huella
+        huella = huella_imagen(image)
+        with self._candado:
+            if clave not in self._huellas:
+                weakref.finalize(image, self._olvidar_imagen, clave)
+            self._huellas[clave] = huella
+        return huella
+
+    def _olvidar_imagen(self, clave):
+        with self._candado:
+            self._huellas.pop(clave, None)
+
+    def _obtener(self, huella):
+        with self._candado:
+            salida = self._salidas.get(huella)
+            if salida is None:
+                self.fallos += 1
+                return None
+            self._salidas.move_to_end(huella)
+            self.aciertos += 1
+            return salida
+
+    def _guardar(self, huella, salida):
+        salida.flags.writeable = False
+        if salida.nbytes > self.max_bytes:
+            return salida
+
+        with self._candado:
+            vieja = self._salidas.pop(huella, None)
+            if vieja is not None:
+                self.bytes_usados -= vieja.nbytes
+            self._salidas[huella] = salida
+            self.bytes_usados += salida.nbytes
+            while self.bytes_usados > self.max_bytes:
+                _, vieja = self._salidas.popitem(last=False)
+                self.bytes_usados -= vieja.nbytes
+        return salida
+
+
+# Copia de `mask` con 0 fuera de la zona (y0, y1, x0, x1).
+def _limitar_mascara(mask, zona):
+    y0, y1, x0, x1 = zona
+    limitada = np.zeros_like(mask)
+    limitada[y0:y1, x0:x1] = mask[y0:y1, x0:x1]
+    return limitada
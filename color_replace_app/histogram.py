@@ -0,0 +1,176 @@
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Índice de histograma HSV para estadísticas instantáneas de selección.
+#
+# ¿Por qué existe?
+# - Para saber cuántos píxeles selecciona una tolerancia hay que generar la máscara
+#   completa con `logic.crear_mascara_hsv`. Probar 60 tolerancias = 60 pasadas por la imagen.
+# - Pero el número de píxeles seleccionados (antes del blur/morph) solo depende de
+#   cuántos píxeles hay de cada color HSV: un histograma 3D (180 x 256 x 256).
+#
+# Cómo funciona:
+# - Al cargar la imagen se calcula el histograma (una sola pasada, con cv2.calcHist). Se
+#   puede hacer por bandas de filas (`indice_por_filas`), sin tener el HSV completo.
+# - Para cada tono (H) se guardan sumas acumuladas 2D en (S, V). Con ellas, contar los
+#   píxeles dentro de un rectángulo de S y V cuesta 4 lecturas, sin recorrer la imagen.
+# - Contar una tolerancia = sumar esos rectángulos para los tonos que entran en el rango,
+#   incluido el wrap-around de H exactamente como lo hace `crear_mascara_hsv`.
+# - La curva completa (tolerancia 0..60) se calcula de una vez, en microsegundos.
+#
+# Memoria (independiente del tamaño de la imagen): el índice ocupa ~45 MB (int32). Al
+# construirlo, el pico es de ~90 MB: el índice más el histograma parcial float32 de
+# `cv2.calcHist` de cada bloque.
+TOLERANCIA_MAX = 60
+
+# cv2.calcHist acumula en float32, que es exacto solo hasta 2^24 por celda. Procesando la
+# imagen por bloques de menos píxeles y sumando en enteros, el conteo es siempre exacto.
+_PIXELES_POR_BLOQUE = 1 << 23
+
+# Caída de la derivada (respecto a su pico) a partir de la cual consideramos que la curva
+# de selección empieza a aplanarse (ver `sugerir_tolerancia`).
+_CAIDA_CODO = 0.75
+
+# La zona plana debe añadir como mucho esta fracción de píxeles del pico para aceptar el codo.
+_PLANO_CODO = 0.6
+
+
+# Construye el índice sin el HSV completo de la imagen.
+#
+# Entrada:
+# - hsv_filas(y0, y1): devuelve el HSV de las filas y0..y1 (por ejemplo, con
+#   `sesion.SesionImagen.hsv_region`). Se pide por bandas de `_PIXELES_POR_BLOQUE` píxeles.
+# - alto, ancho: tamaño de la imagen.
+# - cancelado: opcional, función sin argumentos; si devuelve True entre bandas, se abandona.
+#
+# Devuelve:
+# - IndiceHistogramaHSV, o None si se canceló.
+def indice_por_filas(hsv_filas, alto, ancho, cancelado=None):
+    indice = IndiceHistogramaHSV.__new__(IndiceHistogramaHSV)
+    if not indice._construir(hsv_filas, alto, ancho, cancelado):
+        return None
+    return indice
+
+
+class IndiceHistogramaHSV:
+
+    # Construye el índice a partir de una imagen HSV (OpenCV).
+    def __init__(self, image_hsv):
+        alto, ancho = image_hsv.shape[:2]
+        self._construir(lambda y0, y1: image_hsv[y0:y1], alto, ancho)
+
+    # Devuelve False si `cancelado()` lo interrumpió.
+    def _construir(self, hsv_filas, alto, ancho, cancelado=None):
+        self.total = alto * ancho
+        dtype = np.int32 if self.total < 2 ** 31 else np.int64
+
+        # acumulado[h, i, j] = píxeles con tono h, S < i y V < j.
+        # El histograma se suma directamente dentro de `acumulado` y las sumas acumuladas se
+        # hacen en el sitio: no hay un segundo array del tamaño del índice.
+        self.acumulado = np.zeros((180, 257, 257), dtype)
+        hist = self.acumulado[:, 1:, 1:]
+        filas_bloque = max(1, _PIXELES_POR_BLOQUE // max(1, ancho))
+        for y in range(0, alto, filas_bloque):
+            if cancelado is not None and cancelado():
+                return False
+            bloque = hsv_filas(y, min(alto, y + filas_bloque))
+            parcial = cv2.calcHist([bloque], [0, 1, 2], None, [180, 256, 256], [0, 180, 0, 256, 0, 256])
+            np.add(hist, parcial, out=hist, casting="unsafe")
+            del bloque, parcial
+
+        np.cumsum(hist, axis=1, out=hist)
+        np.cumsum(hist, axis=2, out=hist)
+        return True
+
+    # Número de píxeles que seleccionaría `crear_mascara_hsv` (antes del suavizado y la
+    # morfología) alrededor de `color_hsv` con la tolerancia dada.
+    def contar(self, color_hsv, tolerancia):
+        return int(self.curva(color_hsv, tolerancia)[tolerancia])
+
+    # Igual que `contar`, pero como fracción de la imagen (0..1).
+    def fraccion(self, color_hsv, tolerancia):
+        return self.contar(color_hsv, tolerancia) / self.total if self.total else 0.0
+
+    # Curva de selección: píxeles seleccionados para cada tolerancia 0..tolerancia_max.
+    #
+    # Devuelve:
+    # - array int64 de longitud tolerancia_max + 1.
+    def curva(self, color_hsv, tolerancia_max=TOLERANCIA_MAX):
+        hue, sat, val = (int(c) for c in color_hsv)
+        tol = np.arange(tolerancia_max + 1)
+
+        # Mismos límites que `logic._mascara_rango`.
+        s0 = np.maximum(sat - tol, 0)
+        s1 = np.minimum(sat + tol, 255) + 1
+        v0 = np.maximum(val - tol, 0)
+        v1 = np.minimum(val + tol, 255) + 1
+
+        # cajas[t, h] = píxeles con tono h dentro del rectángulo S/V de la tolerancia t.
+        a = self.acumulado
+        cajas = (
+            a[:, s1, v1].astype(np.int64)
+            - a[:, s0, v1]
+            - a[:, s1, v0]
+            + a[:, s0, v0]
+        ).T
+
+        return (cajas * _tonos_seleccionados(hue, tol)).sum(axis=1)
+
+    # Sugiere una tolerancia a partir del “codo” de la curva de selección.
+    #
+    # Idea:
+    # - Miramos cuántos píxeles añade cada punto extra de tolerancia (la derivada de la curva).
+    # - Mientras se va capturando el objeto del color elegido, la derivada crece; cuando el
+    #   objeto ya está completo, cae (la curva se aplana); si seguimos subiendo, vuelve a
+    #   crecer porque empiezan a entrar colores del fondo.
+    # - La tolerancia sugerida es el mínimo de la derivada en esa zona plana, es decir,
+    #   después de la primera caída clara y antes de que vuelva a superar su pico.
+    #
+    # Devuelve:
+    # - tolerancia sugerida (int), o None si la curva no tiene codo (por ejemplo, si el
+    #   color elegido no forma una zona diferenciada del resto de la imagen).
+    def sugerir_tolerancia(self, color_hsv, tolerancia_max=TOLERANCIA_MAX):
+        curva = self.curva(color_hsv, tolerancia_max).astype(np.float64)
+        if tolerancia_max < 2 or curva[-1] <= 0:
+            return None
+
+        # derivada[t] = píxeles que se añaden al pasar de t a t + 1 (suavizada para ignorar ruido).
+        derivada = np.convolve(np.pad(np.diff(curva), 1, mode="edge"), np.ones(3) / 3.0, mode="valid")
+
+        pico = 0.0
+        mejor = None
+        for t, valor in enumerate(derivada):
+            if mejor is None:
+                pico = max(pico, valor)
+                if pico > 0 and valor < _CAIDA_CODO * pico:
+                    mejor = t
+            elif valor > pico:
+                break
+            elif valor < derivada[mejor]:
+                mejor = t
+
+        # Una caída pequeña es ruido, no un objeto diferenciado.
+        if mejor is None or derivada[mejor] > _PLANO_CODO * pico:
+            return None
+        return mejor
+
+
+# Matriz (len(tol), 180) con 1 en los tonos que selecciona cada tolerancia.
+#
+# Replica el wrap-around de `crear_mascara_hsv`, que para tolerancias que se salen por
+# abajo usa el rango [179 + hue_min, 179] y por arriba [0, hue_max - 179].
+def _tonos_seleccionados(hue, tol):
+    tonos = np.arange(180)[None, :]
+    hue_min = (hue - tol)[:, None]
+    hue_max = (hue + tol)[:, None]
+
+    normal = (tonos >= hue_min) & (tonos <= hue_max)
+    por_abajo = (tonos <= hue_max) | (tonos >= 179 + hue_min)
+    por_arriba = (tonos <= hue_max - 179) | (tonos >= hue_min)
+
+    return np.where(hue_min < 0, por_abajo, np.where(hue_max > 179, por_arriba, normal))
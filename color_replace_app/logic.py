@@ -6,6 +6,21 @@ except Exception:
     np = None
 
 import colorsys
+import contextlib
+import threading
+import time
+import tracemalloc
+
+if np is not None:
+    # Tablas de división de OpenCV para RGB -> HSV en 8 bits (ver `_rgb_a_hsv_numpy`).
+    _HSV_SHIFT = 12
+    _TABLA_DIV_S = np.zeros(256, np.int32)
+    _TABLA_DIV_S[1:] = np.rint((255 << _HSV_SHIFT) / np.arange(1, 256))
+    _TABLA_DIV_H = np.zeros(256, np.int32)
+    _TABLA_DIV_H[1:] = np.rint((180 << _HSV_SHIFT) / (6.0 * np.arange(1, 256)))
+
+    # Orden (R, G, B) de las entradas de la tabla v, p, q, t para cada sector de H.
+    _SECTORES_HSV = np.array([[0, 3, 1], [2, 0, 1], [1, 0, 3], [1, 2, 0], [3, 1, 0], [0, 1, 2]])
 
 
 # Convierte un color RGB (0..255) al formato HSV que usa OpenCV.
@@ -21,7 +36,8 @@ import colorsys
 # 1) Asegura que r, g, b estén dentro de 0..255 (_clamp).
 # 2) Si OpenCV está disponible, usa cv2.cvtColor para que el HSV calculado
 #    coincida exactamente con el HSV que usa la imagen (evita desviaciones de tono).
-# 3) Si OpenCV NO está disponible, usa colorsys (normaliza a 0..1 y reescala).
+# 3) Si OpenCV NO está disponible, usa la misma aritmética entera de OpenCV con NumPy
+#    (`_rgb_a_hsv_numpy`), y si tampoco hay NumPy, colorsys (normaliza a 0..1 y reescala).
 #
 # Devuelve:
 # - (h, s, v) en rangos OpenCV, listos para usarse en el resto del proyecto.
@@ -38,6 +54,9 @@ def convertir_rgb_a_hsv(r, g, b):
         hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)[0, 0]
         return int(hsv[0]), int(hsv[1]), int(hsv[2])
 
+    if np is not None:
+        return tuple(int(c) for c in _rgb_a_hsv_numpy(np.uint8([[r_ok, g_ok, b_ok]]))[0])
+
     r_norm = r_ok / 255.0
     g_norm = g_ok / 255.0
     b_norm = b_ok / 255.0
@@ -49,6 +68,104 @@ def convertir_rgb_a_hsv(r, g, b):
     return h_out, s_out, v_out
 
 
+# Versión por lotes de `convertir_rgb_a_hsv`: convierte N colores en una sola llamada.
+#
+# ¿Por qué existe?
+# - Las paletas de marca tienen miles de muestras; llamar a `convertir_rgb_a_hsv` por cada
+#   una cuesta una imagen 1x1 y una llamada a OpenCV por color.
+#
+# Entrada:
+# - colores_rgb: array (o lista) de N colores RGB 0..255, forma (N, 3). Se recortan a 0..255.
+#
+# Devuelve:
+# - array (N, 3) uint8 con (h, s, v) en rangos OpenCV, o None si falta NumPy.
+#   Sin OpenCV se usa `_rgb_a_hsv_numpy`, que da exactamente el mismo resultado.
+def convertir_rgb_a_hsv_lote(colores_rgb):
+    if np is None:
+        return None
+    rgb = _colores_uint8(colores_rgb)
+    if cv2 is None or len(rgb) == 0:
+        return _rgb_a_hsv_numpy(rgb)
+    return cv2.cvtColor(rgb.reshape(-1, 1, 3), cv2.COLOR_RGB2HSV).reshape(-1, 3)
+
+
+# Conversión inversa por lotes: N colores HSV (rangos OpenCV) a RGB 0..255.
+#
+# Nota sobre el redondeo:
+# - cv2.cvtColor(HSV -> RGB) redondea los píxeles que procesa uno a uno, pero trunca los
+#   que procesa en bloques SIMD, así que el resultado de un color depende de cuántos
+#   colores haya a su lado en la fila.
+# - Aquí cada color va en su propia fila (forma (N, 1, 3)), así que siempre se redondea y
+#   el resultado es el mismo que convirtiendo los colores de uno en uno, sea cual sea N.
+#
+# Devuelve:
+# - array (N, 3) uint8 RGB, o None si falta NumPy.
+#   Sin OpenCV se usa `_hsv_a_rgb_numpy`, que da exactamente el mismo resultado.
+def convertir_hsv_a_rgb_lote(colores_hsv):
+    if np is None:
+        return None
+    hsv = _colores_uint8(colores_hsv)
+    if cv2 is None or len(hsv) == 0:
+        return _hsv_a_rgb_numpy(hsv)
+    return cv2.cvtColor(hsv.reshape(-1, 1, 3), cv2.COLOR_HSV2RGB).reshape(-1, 3)
+
+
+# Colores de entrada como array (N, 3) uint8 contiguo (igual que `_clamp`, pero por lotes).
+def _colores_uint8(colores):
+    colores = np.asarray(colores)
+    if colores.dtype != np.uint8:
+        colores = np.clip(colores.astype(np.int64), 0, 255).astype(np.uint8)
+    return np.ascontiguousarray(colores.reshape(-1, 3))
+
+
+# RGB -> HSV con la aritmética entera de OpenCV (RGB2HSV_b, desplazamiento de 12 bits).
+#
+# Da exactamente lo mismo que cv2.cvtColor para los 16.7M colores posibles.
+def _rgb_a_hsv_numpy(rgb):
+    r, g, b = (rgb[:, c].astype(np.int32) for c in range(3))
+    v = np.maximum(np.maximum(r, g), b)
+    diff = v - np.minimum(np.minimum(r, g), b)
+
+    s = (diff * _TABLA_DIV_S[v] + (1 << (_HSV_SHIFT - 1))) >> _HSV_SHIFT
+    h = np.where(v == r, g - b, np.where(v == g, b - r + 2 * diff, r - g + 4 * diff))
+    h = (h * _TABLA_DIV_H[diff] + (1 << (_HSV_SHIFT - 1))) >> _HSV_SHIFT
+    h = np.where(h < 0, h + 180, h)
+
+    return np.stack([h, s, v], axis=1).astype(np.uint8)
+
+
+# HSV -> RGB como el camino escalar de OpenCV (HSV2RGB_b): float32, con las dos restas
+# `1 - s * f` como multiplicación-suma fusionada (FMA, aquí emulada en float64, exacta
+# para estos valores) y redondeo al entero más cercano.
+#
+# Da exactamente lo mismo que `convertir_hsv_a_rgb_lote` con OpenCV (compilado para x86-64
+# con AVX2, la compilación habitual de opencv-python) para los 65536 x 256 colores posibles.
+def _hsv_a_rgb_numpy(hsv):
+    uno = np.float32(1.0)
+    h = hsv[:, 0].astype(np.float32) * np.float32(6.0 / 180.0)
+    s = hsv[:, 1].astype(np.float32) * np.float32(1.0 / 255.0)
+    v = hsv[:, 2].astype(np.float32) * np.float32(1.0 / 255.0)
+
+    # H fuera de 0..179 da la vuelta, como en OpenCV.
+    h = np.where(h >= 6, h - np.float32(6.0), h)
+    sector = np.floor(h).astype(np.intp)
+    f = h - sector.astype(np.float32)
+
+    s64 = s.astype(np.float64)
+    tabla = np.stack([
+        v,
+        v * (uno - s),
+        v * (1.0 - s64 * f).astype(np.float32),
+        v * (1.0 - s64 * (uno - f)).astype(np.float32),
+    ], axis=1)
+
+    # Para cada sector, qué entrada de `tabla` va a R, G y B.
+    orden = _SECTORES_HSV[sector]
+    filas = np.arange(len(tabla))[:, None]
+    rgb = tabla[filas, orden] * np.float32(255.0)
+    return np.clip(np.rint(rgb), 0, 255).astype(np.uint8)
+
+
 # Crea una máscara (0..255) que marca los píxeles similares a un color HSV objetivo.
 #
 # Entrada:
@@ -74,62 +191,118 @@ def crear_mascara_hsv(image_hsv, color_hsv, tolerancia, suavizado, morph):
     if image_hsv is None or color_hsv is None or np is None or cv2 is None:
         return None
 
-    hue, sat, val = color_hsv
-
-    sat_min = max(sat - tolerancia, 0)#Saturación va de 0 a 255.
-
-# No puede ser negativa.
-    sat_max = min(sat + tolerancia, 255)#Saturación no puede superar 255.
-    val_min = max(val - tolerancia, 0)
-    val_max = min(val + tolerancia, 255)
-
-    hue_min = hue - tolerancia
-    hue_max = hue + tolerancia
-
-    # Manejar el wrap-around del canal H (0-179).
-    # El canal H (Hue) en OpenCV va de 0 a 179 y es circular (0 y 179 están “pegados”).
-    # Si al aplicar la tolerancia nos salimos por debajo de 0 o por encima de 179,
-    # dividimos el rango en dos partes y combinamos ambas máscaras con OR.
-    # Así evitamos perder colores cercanos a los extremos (por ejemplo, rojos).
-    # Después aplicamos un suavizado (GaussianBlur) con kernel impar para
-    # suavizar los bordes de la máscara y evitar recortes bruscos.
-
-    if hue_min < 0:
-        lower1 = np.array([0, sat_min, val_min])
-        upper1 = np.array([hue_max, sat_max, val_max])
-        lower2 = np.array([179 + hue_min, sat_min, val_min])
-        upper2 = np.array([179, sat_max, val_max])
-        mask1 = cv2.inRange(image_hsv, lower1, upper1)
-        mask2 = cv2.inRange(image_hsv, lower2, upper2)
-        mask = mask1 | mask2
-    elif hue_max > 179:
-        lower1 = np.array([0, sat_min, val_min])
-        upper1 = np.array([hue_max - 179, sat_max, val_max])
-        lower2 = np.array([hue_min, sat_min, val_min])
-        upper2 = np.array([179, sat_max, val_max])
-        mask1 = cv2.inRange(image_hsv, lower1, upper1)
-        mask2 = cv2.inRange(image_hsv, lower2, upper2)
-        mask = mask1 | mask2
-    else:
-        lower = np.array([hue_min, sat_min, val_min])
-        upper = np.array([hue_max, sat_max, val_max])
-        mask = cv2.inRange(image_hsv, lower, upper)
+    mask = _mascara_rango(image_hsv, color_hsv, tolerancia)
+    return _suavizar_mascara(mask, suavizado, morph)
+
+
+# Pasos 1-3 de `crear_mascara_hsv`: máscara binaria (0 o 255) por rango HSV, sin suavizar.
+#
+# Está separada para poder reutilizarla (por ejemplo, al construir una LUT) y
+# garantizar que todas las rutas seleccionan exactamente los mismos píxeles.
+def _mascara_rango(image_hsv, color_hsv, tolerancia):
+    with medir_etapa("rango", image_hsv.shape[0] * image_hsv.shape[1]):
+        hue, sat, val = color_hsv
+
+        sat_min = max(sat - tolerancia, 0)#Saturación va de 0 a 255.
+
+        # No puede ser negativa.
+        sat_max = min(sat + tolerancia, 255)#Saturación no puede superar 255.
+        val_min = max(val - tolerancia, 0)
+        val_max = min(val + tolerancia, 255)
+
+        hue_min = hue - tolerancia
+        hue_max = hue + tolerancia
+
+        # Manejar el wrap-around del canal H (0-179).
+        # El canal H (Hue) en OpenCV va de 0 a 179 y es circular (0 y 179 están “pegados”).
+        # Si al aplicar la tolerancia nos salimos por debajo de 0 o por encima de 179,
+        # dividimos el rango en dos partes y combinamos ambas máscaras con OR.
+        # Así evitamos perder colores cercanos a los extremos (por ejemplo, rojos).
+        # Después aplicamos un suavizado (GaussianBlur) con kernel impar para
+        # suavizar los bordes de la máscara y evitar recortes bruscos.
+
+        if hue_min < 0:
+            lower1 = np.array([0, sat_min, val_min])
+            upper1 = np.array([hue_max, sat_max, val_max])
+            lower2 = np.array([179 + hue_min, sat_min, val_min])
+            upper2 = np.array([179, sat_max, val_max])
+            mask1 = cv2.inRange(image_hsv, lower1, upper1)
+            mask2 = cv2.inRange(image_hsv, lower2, upper2)
+            mask = mask1 | mask2
+        elif hue_max > 179:
+            lower1 = np.array([0, sat_min, val_min])
+            upper1 = np.array([hue_max - 179, sat_max, val_max])
+            lower2 = np.array([hue_min, sat_min, val_min])
+            upper2 = np.array([179, sat_max, val_max])
+            mask1 = cv2.inRange(image_hsv, lower1, upper1)
+            mask2 = cv2.inRange(image_hsv, lower2, upper2)
+            mask = mask1 | mask2
+        else:
+            lower = np.array([hue_min, sat_min, val_min])
+            upper = np.array([hue_max, sat_max, val_max])
+            mask = cv2.inRange(image_hsv, lower, upper)
+
+    return mask
+
+
+# Pasos 4-5 de `crear_mascara_hsv`: suavizado (feather) y limpieza morfológica.
+def _suavizar_mascara(mask, suavizado, morph):
+    mask = _desenfocar_mascara(mask, suavizado)
+    return _limpiar_mascara(mask, morph)
 
+
+# Paso 4: suavizado (feather) con GaussianBlur.
+def _desenfocar_mascara(mask, suavizado):
     # Suavizado: kernel impar.
     if suavizado % 2 == 0:
         suavizado = suavizado + 1
     if suavizado > 1:
-        mask = cv2.GaussianBlur(mask, (suavizado, suavizado), 0)
+        with medir_etapa("suavizado", mask.shape[0] * mask.shape[1]):
+            mask = cv2.GaussianBlur(mask, (suavizado, suavizado), 0)
+    return mask
 
+
+# Paso 5: morfología (open + close) para limpiar ruido.
+def _limpiar_mascara(mask, morph):
     # Morfologia para limpiar ruido.
     if morph > 0:
-        kernel = np.ones((3, 3), np.uint8)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=morph)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=morph)
-
+        with medir_etapa("morph", mask.shape[0] * mask.shape[1]):
+            kernel = np.ones((3, 3), np.uint8)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=morph)
+            mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=morph)
     return mask
 
 
+# Adapta los parámetros de la máscara a una copia reducida (proxy) de la imagen.
+#
+# ¿Por qué existe?
+# - El suavizado (tamaño del blur) y la morfología trabajan en píxeles.
+# - Si la vista previa se calcula sobre una copia a escala 0.25, un blur de 21 px
+#   equivale a 21 / 0.25 = 84 px de la imagen original: el borde se vería mucho más suave
+#   que en el resultado final.
+# - Escalando ambos parámetros, la proxy se ve igual que el resultado a resolución completa.
+#
+# Entrada:
+# - suavizado, morph: valores de los sliders (pensados para resolución completa)
+# - escala: tamaño_proxy / tamaño_original (0..1]
+#
+# Devuelve:
+# - (suavizado, morph) equivalentes para la proxy.
+def escalar_parametros_mascara(suavizado, morph, escala):
+    if escala >= 1.0:
+        return suavizado, morph
+
+    # Kernel impar, como en `crear_mascara_hsv`.
+    if suavizado % 2 == 0:
+        suavizado = suavizado + 1
+    suavizado_proxy = max(1, int(round(suavizado * escala)))
+    if suavizado_proxy % 2 == 0:
+        suavizado_proxy = suavizado_proxy + 1
+
+    morph_proxy = int(round(morph * escala))
+    return suavizado_proxy, morph_proxy
+
+
 # Reemplaza el color en una imagen HSV usando una máscara como guía de “cuánto aplicar”.
 #
 # Entrada:
@@ -152,63 +325,618 @@ def reemplazar_color(image_hsv, mask, color_hsv, fuerza, mantener_brillo):
     if image_hsv is None or mask is None or np is None or cv2 is None:
         return None
 
-    alpha = mask.astype(np.float32) / 255.0
+    pixeles = mask.shape[0] * mask.shape[1]
+    with medir_etapa("mezcla", pixeles):
+        alpha = mask.astype(np.float32) / 255.0
+        alpha = alpha * (fuerza / 100.0)
+        alpha = np.clip(alpha, 0.0, 1.0)
+
+        hsv = image_hsv.astype(np.float32)
+        hue_ch, sat_ch, val_ch = cv2.split(hsv)
+
+        hue_t, sat_t, val_t = color_hsv
+
+        hue_new = (1.0 - alpha) * hue_ch + alpha * hue_t
+        sat_new = (1.0 - alpha) * sat_ch + alpha * sat_t
+
+        if mantener_brillo:
+            val_new = val_ch
+        else:
+            val_new = (1.0 - alpha) * val_ch + alpha * val_t
+
+        # Aseguramos que los nuevos valores estén dentro del rango válido:
+        # H debe estar entre 0 y 179, y S y V entre 0 y 255.
+        # np.clip evita que se pasen del límite,
+        # y astype(np.uint8) los convierte al formato correcto de imagen.
+        hue_new = np.clip(hue_new, 0, 179).astype(np.uint8)
+        sat_new = np.clip(sat_new, 0, 255).astype(np.uint8)
+        val_new = np.clip(val_new, 0, 255).astype(np.uint8)
+
+        hsv_new = cv2.merge([hue_new, sat_new, val_new])
+    with medir_etapa("hsv_a_bgr", pixeles):
+        return cv2.cvtColor(hsv_new, cv2.COLOR_HSV2BGR)
+
+
+# Igual que `reemplazar_color`, pero con aritmética entera y sin reservar memoria
+# en cada llamada (pensado para lotes y bucles donde se llama miles de veces).
+#
+# ¿Por qué existe?
+# - `reemplazar_color` pasa toda la imagen a float32 y crea unas diez copias temporales
+#   (alpha, productos, split, clip, astype, merge). En el modo por lotes eso domina
+#   tanto el tiempo como el consumo de memoria.
+#
+# Idea:
+# - Para cada canal, el valor nuevo solo depende de (valor de la máscara, valor del canal):
+#   256 x 256 combinaciones. Las calculamos una vez con exactamente la misma fórmula
+#   float32 de `reemplazar_color` y las guardamos en una tabla uint8 de 64 KB por canal.
+# - Luego cada píxel es un índice entero (mask << 8 | canal) y una búsqueda en la tabla:
+#   el resultado es idéntico al de la ruta float.
+#
+# Entrada (además de las de `reemplazar_color`):
+# - out: array (alto, ancho, 3) uint8 donde escribir el BGR resultante (opcional).
+# - trabajo: dict donde se guardan los buffers intermedios y las tablas entre llamadas.
+#   Si se pasa el mismo dict en cada llamada (y el tamaño no cambia), no se reserva memoria.
+#
+# Devuelve:
+# - Imagen BGR (`out` si se pasó).
+def reemplazar_color_entero(image_hsv, mask, color_hsv, fuerza, mantener_brillo, out=None, trabajo=None):
+    if image_hsv is None or mask is None or np is None or cv2 is None:
+        return None
+
+    if trabajo is None:
+        trabajo = {}
+    forma = image_hsv.shape
+    if out is None:
+        out = np.empty(forma, np.uint8)
+
+    pixeles = forma[0] * forma[1]
+    with medir_etapa("mezcla", pixeles):
+        tablas = _tablas_mezcla(trabajo, color_hsv, fuerza)
+        # np.take solo evita copias internas con índices intp y salida contiguos, así que
+        # escribimos cada canal en su propio plano y usamos un único plano de índices.
+        planos = _buffer(trabajo, "planos", (3,) + forma[:2], np.uint8)
+        indices = _buffer(trabajo, "indices", forma[:2], np.intp)
+        hsv_new = _buffer(trabajo, "hsv", forma, np.uint8)
+
+        # indices = mask << 8 | canal
+        indices[...] = mask
+        np.left_shift(indices, 8, out=indices)
+
+        canales = 2 if mantener_brillo else 3
+        for c in range(canales):
+            np.bitwise_or(indices, image_hsv[:, :, c], out=indices)
+            np.take(tablas[c], indices, out=planos[c], mode="clip")
+            np.bitwise_and(indices, ~255, out=indices)
+        if mantener_brillo:
+            planos[2] = image_hsv[:, :, 2]
+
+        cv2.merge(list(planos), dst=hsv_new)
+    with medir_etapa("hsv_a_bgr", pixeles):
+        return cv2.cvtColor(hsv_new, cv2.COLOR_HSV2BGR, dst=out)
+
+
+# Tablas (3, 65536) uint8 de `reemplazar_color_entero` para un color destino y una fuerza.
+# Se guardan en `trabajo` para no recalcularlas si la receta no cambia.
+def _tablas_mezcla(trabajo, color_hsv, fuerza):
+    clave = (tuple(int(c) for c in color_hsv), fuerza)
+    if trabajo.get("clave_tablas") == clave:
+        return trabajo["tablas"]
+
+    # Misma fórmula (y mismos tipos float32) que `reemplazar_color`.
+    alpha = np.arange(256, dtype=np.float32)[:, None] / 255.0
     alpha = alpha * (fuerza / 100.0)
     alpha = np.clip(alpha, 0.0, 1.0)
+    canal = np.arange(256, dtype=np.float32)[None, :]
+
+    tablas = np.empty((3, 65536), np.uint8)
+    for c, (objetivo, maximo) in enumerate(zip(color_hsv, (179, 255, 255))):
+        nuevo = (1.0 - alpha) * canal + alpha * objetivo
+        tablas[c] = np.clip(nuevo, 0, maximo).astype(np.uint8).reshape(-1)
 
-    hsv = image_hsv.astype(np.float32)
-    hue_ch, sat_ch, val_ch = cv2.split(hsv)
+    trabajo["clave_tablas"] = clave
+    trabajo["tablas"] = tablas
+    return tablas
 
-    hue_t, sat_t, val_t = color_hsv
 
-    hue_new = (1.0 - alpha) * hue_ch + alpha * hue_t
-    sat_new = (1.0 - alpha) * sat_ch + alpha * sat_t
+# Devuelve el buffer `nombre` de `trabajo`, creándolo solo si no existe o cambió de forma.
+def _buffer(trabajo, nombre, forma, dtype):
+    buf = trabajo.get(nombre)
+    if buf is None or buf.shape != forma or buf.dtype != dtype:
+        buf = np.empty(forma, dtype)
+        trabajo[nombre] = buf
+    return buf
 
-    if mantener_brillo:
-        val_new = val_ch
-    else:
-        val_new = (1.0 - alpha) * val_ch + alpha * val_t
-        
-# Aseguramos que los nuevos valores estén dentro del rango válido:
-# H debe estar entre 0 y 179, y S y V entre 0 y 255.
-# np.clip evita que se pasen del límite,
-# y astype(np.uint8) los convierte al formato correcto de imagen.
-    hue_new = np.clip(hue_new, 0, 179).astype(np.uint8)
-    sat_new = np.clip(sat_new, 0, 255).astype(np.uint8)
-    val_new = np.clip(val_new, 0, 255).astype(np.uint8)
 
-    hsv_new = cv2.merge([hue_new, sat_new, val_new])
-    return cv2.cvtColor(hsv_new, cv2.COLOR_HSV2BGR)
+# Reemplaza varios colores a la vez (por ejemplo, las tres variantes de color de un producto).
+#
+# ¿Por qué existe?
+# - Con `reemplazar_color` cada color necesita una pasada completa: float32, mezcla y
+#   conversión HSV -> BGR. Con tres colores, tres veces.
+# - Aquí todas las reglas se mezclan sobre los mismos planos float32 y se convierte
+#   a BGR una sola vez.
+#
+# Entrada:
+# - image_hsv: imagen HSV (OpenCV)
+# - masks: una máscara por regla, cada una de `crear_mascara_hsv` con su color y tolerancia
+# - reglas: lista de (color_origen_hsv, tolerancia, color_destino_hsv, fuerza)
+# - mantener_brillo: si True, conserva el canal V original (para todas las reglas)
+#
+# Prioridad cuando las máscaras se solapan:
+# - Las reglas se aplican en orden y la primera tiene prioridad: cada regla solo puede
+#   usar la parte de la máscara (0..255) que las anteriores dejaron libre.
+# - Así la suma de todas las alphas nunca pasa de 1 y el resultado no depende de cuántas
+#   reglas coincidan en un píxel.
+#
+# Con una sola regla el resultado es idéntico a `reemplazar_color`.
+#
+# Devuelve:
+# - Imagen BGR.
+def reemplazar_colores(image_hsv, masks, reglas, mantener_brillo):
+    if image_hsv is None or masks is None or reglas is None or np is None or cv2 is None:
+        return None
+
+    pixeles = image_hsv.shape[0] * image_hsv.shape[1]
+    with medir_etapa("mezcla", pixeles):
+        hsv = image_hsv.astype(np.float32)
+        hue_ch, sat_ch, val_ch = cv2.split(hsv)
+
+        libre = None
+        peso = None
+        hue_mix = sat_mix = val_mix = None
+        for mask, (_, _, color_hsv, fuerza) in zip(masks, reglas):
+            # Parte de la máscara que las reglas anteriores no han usado.
+            if libre is None:
+                usada = mask
+                libre = 255 - mask
+            else:
+                usada = np.minimum(mask, libre)
+                libre = libre - usada
+
+            alpha = usada.astype(np.float32) / 255.0
+            alpha = alpha * (fuerza / 100.0)
+            alpha = np.clip(alpha, 0.0, 1.0)
+
+            hue_t, sat_t, val_t = color_hsv
+            if peso is None:
+                peso = alpha
+                hue_mix = alpha * hue_t
+                sat_mix = alpha * sat_t
+                val_mix = alpha * val_t
+            else:
+                peso = peso + alpha
+                hue_mix = hue_mix + alpha * hue_t
+                sat_mix = sat_mix + alpha * sat_t
+                val_mix = val_mix + alpha * val_t
+
+        if peso is None:
+            return cv2.cvtColor(image_hsv, cv2.COLOR_HSV2BGR)
+
+        hue_new = (1.0 - peso) * hue_ch + hue_mix
+        sat_new = (1.0 - peso) * sat_ch + sat_mix
+        if mantener_brillo:
+            val_new = val_ch
+        else:
+            val_new = (1.0 - peso) * val_ch + val_mix
+
+        hue_new = np.clip(hue_new, 0, 179).astype(np.uint8)
+        sat_new = np.clip(sat_new, 0, 255).astype(np.uint8)
+        val_new = np.clip(val_new, 0, 255).astype(np.uint8)
+
+        hsv_new = cv2.merge([hue_new, sat_new, val_new])
+    with medir_etapa("hsv_a_bgr", pixeles):
+        return cv2.cvtColor(hsv_new, cv2.COLOR_HSV2BGR)
+
+
+# Regiones de interés (ROI) de una máscara poco densa.
+#
+# ¿Por qué existe?
+# - Muchas veces el color elegido solo aparece en una zona pequeña (un logo, una prenda),
+#   pero la mezcla y la conversión HSV -> BGR recorren la imagen entera.
+# - Con las cajas donde la máscara no es 0 se puede trabajar solo ahí y copiar el
+#   original en el resto.
+#
+# Cómo se calculan (sin recorrer la imagen más de una vez):
+# - Se divide la imagen en celdas de `CELDA_REGION` px y se marca cada celda con algún
+#   píxel de máscara > 0 (un máximo por bloques).
+# - Las celdas marcadas que se tocan forman una región (componentes conexas sobre la
+#   rejilla de celdas, que es diminuta) y cada región da una caja.
+# - Las cajas que se solapan se fusionan. Si salen demasiadas, o cubren más de
+#   `FRACCION_REGIONES_MAX` de la imagen, se usa una única caja que las englobe a todas.
+#
+# Las cajas empiezan en columnas múltiplo de `CELDA_REGION` y terminan en otro múltiplo o en
+# el borde de la imagen. Igual que las teselas de `tiles.py`, así cv2.cvtColor (HSV -> BGR)
+# redondea cada píxel igual que sobre la imagen completa.
+CELDA_REGION = 64
+
+_REGIONES_MAX = 32
+
+FRACCION_REGIONES_MAX = 0.5
+
+
+# Devuelve:
+# - lista de cajas (y0, y1, x0, x1); vacía si la máscara es toda 0.
+def regiones_mascara(mask, max_regiones=_REGIONES_MAX):
+    if mask is None or np is None or cv2 is None:
+        return []
+    alto, ancho = mask.shape[:2]
+    if alto == 0 or ancho == 0:
+        return []
+
+    celdas = np.maximum.reduceat(mask, np.arange(0, alto, CELDA_REGION), axis=0)
+    celdas = np.maximum.reduceat(celdas, np.arange(0, ancho, CELDA_REGION), axis=1)
+    ocupadas = (celdas > 0).astype(np.uint8)
+    if not ocupadas.any():
+        return []
+
+    n, _, stats, _ = cv2.connectedComponentsWithStats(ocupadas, connectivity=8)
+    cajas = [
+        (y * CELDA_REGION, min(alto, (y + h) * CELDA_REGION), x * CELDA_REGION, min(ancho, (x + w) * CELDA_REGION))
+        for x, y, w, h, _ in stats[1:n]
+    ]
+    if len(cajas) <= 4 * max_regiones:
+        cajas = _fusionar_cajas(cajas)
+
+    area = sum((y1 - y0) * (x1 - x0) for y0, y1, x0, x1 in cajas)
+    if len(cajas) > max_regiones or area > FRACCION_REGIONES_MAX * alto * ancho:
+        return [(
+            min(c[0] for c in cajas),
+            max(c[1] for c in cajas),
+            min(c[2] for c in cajas),
+            max(c[3] for c in cajas),
+        )]
+    return cajas
+
+
+# Fusiona las cajas que se solapan hasta que no quede ningún solape.
+def _fusionar_cajas(cajas):
+    cajas = list(cajas)
+    fusionada = True
+    while fusionada:
+        fusionada = False
+        for i in range(len(cajas)):
+            for j in range(i + 1, len(cajas)):
+                a, b = cajas[i], cajas[j]
+                if a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]:
+                    cajas[i] = (min(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3]))
+                    del cajas[j]
+                    fusionada = True
+                    break
+            if fusionada:
+                break
+    return cajas
+
+
+# Como `reemplazar_color`, pero solo dentro de las regiones de la máscara.
+#
+# Entrada (además de las de `reemplazar_color`):
+# - image_bgr: la imagen original, de la que se copian los píxeles no seleccionados.
+# - out: array (alto, ancho, 3) uint8 donde escribir el resultado (opcional).
+# - trabajo: buffers de `reemplazar_color_entero`, reutilizables entre llamadas.
+#
+# Diferencia con `reemplazar_color`:
+# - Donde la máscara es > 0 el resultado es idéntico.
+# - Donde la máscara es 0 se deja el píxel original tal cual, en lugar del ida y vuelta
+#   BGR -> HSV -> BGR (que puede mover algún canal ±1).
+#
+# Devuelve:
+# - Imagen BGR (`out` si se pasó).
+def reemplazar_color_roi(image_bgr, image_hsv, mask, color_hsv, fuerza, mantener_brillo, out=None, trabajo=None):
+    if image_bgr is None or image_hsv is None or mask is None or np is None or cv2 is None:
+        return None
+    if trabajo is None:
+        trabajo = {}
+
+    def mezclar(caja):
+        return reemplazar_color_entero(image_hsv[caja], mask[caja], color_hsv, fuerza, mantener_brillo, trabajo=trabajo)
+
+    return _reemplazar_en_regiones(image_bgr, mask, mezclar, out)
+
+
+# Como `reemplazar_colores` (varias reglas), pero solo dentro de las regiones donde alguna
+# máscara es > 0. Fuera de ellas (y donde todas las máscaras son 0) se copia el original.
+def reemplazar_colores_roi(image_bgr, image_hsv, masks, reglas, mantener_brillo, out=None):
+    if image_bgr is None or image_hsv is None or masks is None or reglas is None or np is None or cv2 is None:
+        return None
+    if not masks:
+        return image_bgr.copy() if out is None else _copiar(image_bgr, out)
+
+    union = masks[0] if len(masks) == 1 else np.maximum.reduce(masks)
+
+    def mezclar(caja):
+        return reemplazar_colores(image_hsv[caja], [mask[caja] for mask in masks], reglas, mantener_brillo)
+
+    return _reemplazar_en_regiones(image_bgr, union, mezclar, out)
+
+
+# Copia `image_bgr` en `out` y sustituye cada región de `mask` por `mezclar(caja)`,
+# dejando el original en los píxeles con máscara 0.
+def _reemplazar_en_regiones(image_bgr, mask, mezclar, out=None):
+    if out is None:
+        out = np.empty_like(image_bgr)
+    _copiar(image_bgr, out)
+    for y0, y1, x0, x1 in regiones_mascara(mask):
+        caja = (slice(y0, y1), slice(x0, x1))
+        bloque = mezclar(caja)
+        np.copyto(bloque, image_bgr[caja], where=(mask[caja] == 0)[:, :, None])
+        out[caja] = bloque
+    return out
+
+
+def _copiar(image_bgr, out):
+    with medir_etapa("copia", image_bgr.shape[0] * image_bgr.shape[1]):
+        np.copyto(out, image_bgr)
+    return out
 
 
 # Genera una vista previa para ver la selección de la máscara (sin “procesar” definitivo).
 #
 # Qué hace:
-# - Copia la imagen original.
-# - Crea una imagen roja del mismo tamaño.
-# - Convierte la máscara a alpha (0..1) y la hace más suave (multiplica por 0.45).
-# - Mezcla base + rojo para resaltar la zona seleccionada.
+# - Marca en rojo la zona seleccionada: cada píxel se mezcla con rojo puro con
+#   alpha = (máscara / 255) * 0.45. Con máscara 0 el píxel queda igual.
+# - Solo se tintan las regiones de la máscara (ver `regiones_mascara`); el resto se copia.
+# - La mezcla es una búsqueda por canal en tablas enteras (`_tablas_tinte`), en una sola
+#   pasada y sin planos float32 ni imágenes temporales del tamaño de la imagen. El resultado
+#   es idéntico al de la mezcla en float32 `base * (1 - alpha) + rojo * alpha`.
+#
+# Entrada:
+# - out: array (alto, ancho, 3) uint8 donde escribir la vista previa (opcional). Puede ser
+#   la propia `image_bgr` (se tinta en el sitio, sin copiar).
+# - trabajo: dict de buffers reutilizables entre llamadas (como en `reemplazar_color_entero`).
 #
 # Devuelve:
-# - Imagen BGR con la zona seleccionada marcada en rojo.
-def crear_vista_previa(image_bgr, mask):
+# - Imagen BGR con la zona seleccionada marcada en rojo (`out` si se pasó).
+def crear_vista_previa(image_bgr, mask, out=None, trabajo=None):
     # Generar una vista previa tintada para visualizar la seleccion.
     if image_bgr is None or mask is None or np is None:
         return None
+    if trabajo is None:
+        trabajo = {}
+    if out is None:
+        out = np.empty_like(image_bgr)
+    if out is not image_bgr:
+        _copiar(image_bgr, out)
+
+    tablas = _tablas_tinte()
+    cajas = regiones_mascara(mask) if cv2 is not None else [(0, mask.shape[0], 0, mask.shape[1])]
+    for y0, y1, x0, x1 in cajas:
+        caja = (slice(y0, y1), slice(x0, x1))
+        _tintar(image_bgr[caja], mask[caja], out[caja], tablas, trabajo)
+    return out
+
+
+# Vista previa de la selección de un color, de una vez: máscara + tinte.
+#
+# Con `tamano` = (ancho, alto), la imagen se reduce primero a ese tamaño (INTER_AREA) y la
+# máscara se calcula ya a esa resolución, con el suavizado y la morfología escalados
+# (`escalar_parametros_mascara`). Así la vista previa sale directamente a resolución de
+# pantalla y cuesta una fracción de `crear_mascara_hsv` + `reemplazar_color` completos.
+#
+# Es para scripts y para `bench.py`, sin caché de máscaras ni zona. La interfaz no la usa:
+# ya tiene los niveles reducidos (`niveles_vista`) y pasa por `cache_mascara` y la zona
+# dibujada (ver `App._show_selection_preview`), y luego llama a `crear_vista_previa`.
+#
+# Entrada:
+# - image_bgr, image_hsv: la imagen (image_hsv puede ser None si se pasa `tamano`)
+# - color_hsv, tolerancia, suavizado, morph: igual que `crear_mascara_hsv`
+# - out, trabajo: igual que `crear_vista_previa` (`out` del tamaño de la vista previa)
+#
+# Devuelve:
+# - Imagen BGR de la vista previa (`out` si se pasó).
+def vista_previa_seleccion(image_bgr, image_hsv, color_hsv, tolerancia, suavizado, morph, out=None, trabajo=None, tamano=None):
+    if image_bgr is None or color_hsv is None or np is None or cv2 is None:
+        return None
+
+    alto, ancho = image_bgr.shape[:2]
+    if tamano is not None and tuple(tamano) != (ancho, alto):
+        with medir_etapa("redimensionar", tamano[0] * tamano[1]):
+            image_bgr = cv2.resize(image_bgr, tuple(tamano), interpolation=cv2.INTER_AREA)
+        with medir_etapa("bgr_a_hsv", tamano[0] * tamano[1]):
+            image_hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+        suavizado, morph = escalar_parametros_mascara(suavizado, morph, tamano[0] / ancho)
+    elif image_hsv is None:
+        with medir_etapa("bgr_a_hsv", alto * ancho):
+            image_hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+
+    mask = crear_mascara_hsv(image_hsv, color_hsv, tolerancia, suavizado, morph)
+    return crear_vista_previa(image_bgr, mask, out=out, trabajo=trabajo)
+
+
+# Tinte rojo de `crear_vista_previa` sobre un bloque de la imagen, escrito en `out`.
+#
+# Igual que en `reemplazar_color_entero`: un único plano de índices (mask << 8 | canal)
+# y una búsqueda en la tabla por canal. Azul y verde comparten tabla (el rojo puro no
+# tiene de esos canales); el rojo tiene la suya.
+def _tintar(image_bgr, mask, out, tablas, trabajo):
+    with medir_etapa("vista_previa", mask.shape[0] * mask.shape[1]):
+        indices = _buffer_minimo(trabajo, "indices_tinte", mask.shape, np.intp)
+        plano = _buffer_minimo(trabajo, "plano_tinte", mask.shape, np.uint8)
+
+        indices[...] = mask
+        np.left_shift(indices, 8, out=indices)
+        for c, tabla in enumerate((tablas[0], tablas[0], tablas[1])):
+            np.bitwise_or(indices, image_bgr[:, :, c], out=indices)
+            np.take(tabla, indices, out=plano, mode="clip")
+            out[:, :, c] = plano
+            np.bitwise_and(indices, ~255, out=indices)
+    return out
+
+
+# Tablas (2, 65536) uint8 del tinte: [0] azul/verde, [1] rojo; índice = máscara << 8 | canal.
+# No dependen de nada, así que se calculan una sola vez por proceso.
+_tablas_tinte_cache = None
+
+
+def _tablas_tinte():
+    global _tablas_tinte_cache
+    if _tablas_tinte_cache is None:
+        # Misma fórmula (y mismos tipos float32) que la mezcla original de la vista previa.
+        alpha = np.arange(256, dtype=np.float32)[:, None] / 255.0
+        alpha = alpha * 0.45
+        base = np.arange(256, dtype=np.float32)[None, :]
+        tablas = np.empty((2, 65536), np.uint8)
+        for i, rojo in enumerate((0.0, 255.0)):
+            tablas[i] = (base * (1.0 - alpha) + np.float32(rojo) * alpha).astype(np.uint8).reshape(-1)
+        _tablas_tinte_cache = tablas
+    return _tablas_tinte_cache
+
+
+# Como `_buffer`, pero el buffer se reutiliza mientras tenga sitio, aunque cambie la forma
+# (las regiones de una máscara tienen cada una su tamaño). Devuelve una vista contigua.
+def _buffer_minimo(trabajo, nombre, forma, dtype):
+    elementos = forma[0] * forma[1]
+    buf = trabajo.get(nombre)
+    if buf is None or buf.size < elementos or buf.dtype != dtype:
+        buf = np.empty(elementos, dtype)
+        trabajo[nombre] = buf
+    return buf[:elementos].reshape(forma)
+
+
+# Motor LUT (tabla de búsqueda) para aplicar la misma receta a muchas imágenes.
+#
+# ¿Por qué existe?
+# - Con parámetros fijos, el camino BGR -> HSV -> inRange -> mezcla -> BGR es una función
+#   pura de cada píxel (solo el blur y la morfología miran a los vecinos).
+# - Hay 256^3 = 16.7M colores BGR posibles, así que podemos calcular esa función una sola vez
+#   para todos y luego aplicarla a cada imagen con una única búsqueda por píxel, sin
+#   cvtColor, inRange ni planos float32.
+#
+# Cada fila de la tabla (4 bytes, índice = B*65536 + G*256 + R) guarda:
+# - [0..2] BGR resultante con la máscara al máximo (alpha = fuerza)
+# - [3]    máscara sin suavizar (0 o 255), igual que `_mascara_rango`
+# Así la fila se lee como un único uint32. Donde la máscara final es 0 no hace falta tabla:
+# el píxel se deja como está en la imagen original (igual que `reemplazar_color_roi`).
+#
+# Construirla cuesta del orden de un segundo y ocupa 64 MB, así que solo compensa cuando
+# la receta se repite en muchas imágenes (modo por lotes).
+LUT_COLORES = 256 ** 3
+LUT_FORMA = (LUT_COLORES, 4)
+
+# Filas de la imagen sintética 4096x4096 que se procesan a la vez al construir la tabla.
+# Limita la memoria temporal (float32) de `reemplazar_color` durante la construcción.
+_LUT_BLOQUE_FILAS = 256
+
+# Últimas LUT construidas por `obtener_lut`, indexadas por su receta.
+_cache_lut = {}
+_CACHE_LUT_MAX = 2
+
+
+# Construye la LUT para una receta.
+#
+# Entrada:
+# - color_hsv: color objetivo (el que se quiere cambiar)
+# - tolerancia: igual que en `crear_mascara_hsv`
+# - color_destino_hsv, fuerza, mantener_brillo: igual que en `reemplazar_color`
+# - tabla: array `LUT_FORMA` uint8 donde construirla (opcional; por ejemplo un bloque
+#   de memoria compartida, ver `paralelo.crear_lut_compartida`).
+#
+# Devuelve:
+# - dict con:
+#   - "clave": la receta (para saber si la LUT sirve para otros parámetros)
+#   - "tabla": array uint8 `LUT_FORMA` (16.7M, 4)
+#   - "segundos_construccion": tiempo que costó construirla
+def crear_lut(color_hsv, tolerancia, color_destino_hsv, fuerza, mantener_brillo, tabla=None):
+    if color_hsv is None or color_destino_hsv is None or np is None or cv2 is None:
+        return None
+
+    inicio = time.perf_counter()
+    if tabla is None:
+        tabla = np.zeros(LUT_FORMA, np.uint8)
+
+    # Todos los colores BGR como una imagen 4096x4096: fila = B*16 + G//16, columna = (G%16)*256 + R.
+    # Así el índice lineal de cada píxel coincide con el índice de la tabla.
+    codigos = np.arange(_LUT_BLOQUE_FILAS * 4096, dtype=np.uint32)
+    for fila in range(0, 4096, _LUT_BLOQUE_FILAS):
+        base = fila * 4096
+        bloque = codigos + base
+        bgr = np.empty((_LUT_BLOQUE_FILAS, 4096, 3), np.uint8)
+        bgr[:, :, 0] = (bloque >> 16).reshape(_LUT_BLOQUE_FILAS, 4096)
+        bgr[:, :, 1] = ((bloque >> 8) & 255).reshape(_LUT_BLOQUE_FILAS, 4096)
+        bgr[:, :, 2] = (bloque & 255).reshape(_LUT_BLOQUE_FILAS, 4096)
+
+        hsv = cv2.cvtColor(bgr, cv2.COLOR_BGR2HSV)
+        mask = _mascara_rango(hsv, color_hsv, tolerancia)
+        lleno = np.full(mask.shape, 255, np.uint8)
+        con_mascara = reemplazar_color(hsv, lleno, color_destino_hsv, fuerza, mantener_brillo)
+
+        filas = tabla[base:base + bloque.size]
+        filas[:, 0:3] = con_mascara.reshape(-1, 3)
+        filas[:, 3] = mask.reshape(-1)
+
+    return {
+        "clave": (tuple(color_hsv), tolerancia, tuple(color_destino_hsv), fuerza, bool(mantener_brillo)),
+        "tabla": tabla,
+        "segundos_construccion": time.perf_counter() - inicio,
+    }
+
+
+# Igual que `crear_lut`, pero reutiliza una LUT ya construida con la misma receta.
+#
+# Útil cuando se llama repetidamente con los mismos parámetros (por ejemplo, en cada
+# proceso hijo del modo por lotes): solo la primera llamada paga la construcción.
+def obtener_lut(color_hsv, tolerancia, color_destino_hsv, fuerza, mantener_brillo):
+    clave = (tuple(color_hsv), tolerancia, tuple(color_destino_hsv), fuerza, bool(mantener_brillo))
+    lut = _cache_lut.get(clave)
+    if lut is not None:
+        return lut
+
+    lut = crear_lut(color_hsv, tolerancia, color_destino_hsv, fuerza, mantener_brillo)
+    if lut is None:
+        return None
+    if len(_cache_lut) >= _CACHE_LUT_MAX:
+        _cache_lut.pop(next(iter(_cache_lut)))
+    _cache_lut[clave] = lut
+    return lut
+
+
+# Aplica una LUT a una imagen BGR (equivalente a crear_mascara_hsv + reemplazar_color_roi).
+#
+# Entrada:
+# - image_bgr: imagen original en BGR (no hace falta convertirla a HSV)
+# - lut: resultado de `crear_lut` / `obtener_lut`
+# - suavizado, morph: igual que en `crear_mascara_hsv` (se aplican sobre la máscara)
+#
+# Pasos:
+# 1) Una sola búsqueda en la tabla por píxel: máscara + color con la máscara al máximo.
+# 2) Suaviza y limpia la máscara como siempre.
+# 3) Píxeles con máscara 255 -> color de la tabla; con máscara 0 -> el original, sin tocar.
+# 4) Solo los píxeles del borde (máscara intermedia) se mezclan con la ruta normal.
+#
+# Devuelve:
+# - (mask, result_bgr): la máscara es idéntica a la de la ruta normal, y los píxeles no
+#   seleccionados también. En los seleccionados el color puede diferir en ±1 por el
+#   redondeo interno de cv2.cvtColor (depende del tamaño de la imagen).
+def aplicar_lut(image_bgr, lut, suavizado, morph):
+    if image_bgr is None or lut is None or np is None or cv2 is None:
+        return None, None
+
+    h, w = image_bgr.shape[:2]
+
+    with medir_etapa("lut_busqueda", h * w):
+        indices = image_bgr[:, :, 0].astype(np.int32)
+        indices <<= 8
+        indices |= image_bgr[:, :, 1]
+        indices <<= 8
+        indices |= image_bgr[:, :, 2]
+
+        # Una sola búsqueda: cada píxel recibe su fila completa de 4 bytes.
+        datos = lut["tabla"].view(np.uint32).reshape(-1).take(indices)
 
-    base = image_bgr.copy()
-    tint = np.zeros_like(base)
-    tint[:, :] = (0, 0, 255)
+        mask = np.ascontiguousarray(datos.view(np.uint8).reshape(h, w, 4)[:, :, 3])
+    mask = _suavizar_mascara(mask, suavizado, morph)
 
-    alpha = mask.astype(np.float32) / 255.0
-    alpha = alpha * 0.45
-    alpha = alpha[:, :, None]
+    # Color de la tabla donde hay máscara y el original donde no.
+    with medir_etapa("lut_seleccion", h * w):
+        result_bgr = cv2.cvtColor(datos.view(np.uint8).reshape(h, w, 4), cv2.COLOR_BGRA2BGR)
+        np.copyto(result_bgr, image_bgr, where=(mask == 0)[:, :, None])
 
-    base = base.astype(np.float32)
-    tint = tint.astype(np.float32)
+    borde = (mask > 0) & (mask < 255)
+    if borde.any():
+        _, _, color_destino_hsv, fuerza, mantener_brillo = lut["clave"]
+        hsv_borde = cv2.cvtColor(image_bgr[borde].reshape(-1, 1, 3), cv2.COLOR_BGR2HSV)
+        mezcla = reemplazar_color(hsv_borde, mask[borde].reshape(-1, 1), color_destino_hsv, fuerza, mantener_brillo)
+        result_bgr[borde] = mezcla.reshape(-1, 3)
 
-    preview = base * (1.0 - alpha) + tint * alpha
-    return preview.astype(np.uint8)
+    return mask, result_bgr
 
 
 # Helper: limita un valor al rango 0..255 y lo convierte a int.
@@ -216,3 +944,126 @@ def crear_vista_previa(image_bgr, mask):
 # Se usa para evitar valores inválidos de canales de color.
 def _clamp(value):
     return max(0, min(int(value), 255))
+
+
+# Instrumentación opcional por etapas (tiempo, memoria y píxeles).
+#
+# ¿Por qué existe?
+# - Cuando una imagen tarda mucho no se sabe qué etapa es la culpable: BGR -> HSV,
+#   inRange, GaussianBlur, morfología, la mezcla o HSV -> BGR.
+#
+# Cómo se usa:
+#
+#   with logic.Medidor() as medidor:
+#       mask = logic.crear_mascara_hsv(...)
+#       result = logic.reemplazar_color(...)
+#   print(medidor.texto())
+#
+# - Las funciones de este módulo marcan sus etapas con `medir_etapa(nombre, pixeles)`.
+#   Otros módulos pueden marcar las suyas igual (por ejemplo, leer/escribir en `batch.py`).
+# - Sin ningún `Medidor` activo, `medir_etapa` solo consulta una variable del hilo y
+#   devuelve un contexto vacío: no mide nada ni reserva memoria.
+# - El medidor activo es por hilo, así que dos hilos (vista previa y procesado en la app)
+#   no mezclan sus medidas.
+# - Con `memoria=True` también se mide el pico de memoria reservada en cada etapa
+#   (con `tracemalloc`: arrays de NumPy y los que devuelve OpenCV). Ralentiza un poco,
+#   por eso es opcional.
+_hilo_medidor = threading.local()
+
+# Contexto vacío que devuelve `medir_etapa` cuando no hay medidor (se reutiliza siempre).
+_SIN_MEDIR = contextlib.nullcontext()
+
+
+# Marca una etapa del procesamiento.
+#
+# Entrada:
+# - nombre: nombre corto de la etapa ("rango", "suavizado", ...)
+# - pixeles: píxeles que recorre la etapa
+#
+# Devuelve:
+# - un context manager (vacío si no hay medidor activo en este hilo).
+def medir_etapa(nombre, pixeles):
+    medidor = getattr(_hilo_medidor, "medidor", None)
+    if medidor is None:
+        return _SIN_MEDIR
+    return medidor.etapa(nombre, pixeles)
+
+
+# Medidor activo en este hilo (o None).
+#
+# Sirve para que quien reparte trabajo en otros hilos o procesos (ver `paralelo.py`) mida
+# allí con un medidor propio y luego sume sus etapas a este.
+def medidor_activo():
+    return getattr(_hilo_medidor, "medidor", None)
+
+
+# Acumula las medidas de las etapas ejecutadas mientras está activo (`with`).
+#
+# `etapas` es un dict {nombre: {"llamadas", "segundos", "bytes", "pixeles"}} en el orden
+# en que se ejecutó cada etapa por primera vez. "bytes" es la suma de los picos de memoria
+# de cada llamada (0 si `memoria=False`).
+class Medidor:
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.etapas = {}
+        self._candado = threading.Lock()
+        self._anteriores = []
+        self._tracemalloc_propio = []
+
+    def __enter__(self):
+        self._anteriores.append(getattr(_hilo_medidor, "medidor", None))
+        _hilo_medidor.medidor = self
+        propio = self.memoria and not tracemalloc.is_tracing()
+        if propio:
+            tracemalloc.start()
+        self._tracemalloc_propio.append(propio)
+        return self
+
+    def __exit__(self, *exc):
+        _hilo_medidor.medidor = self._anteriores.pop()
+        if self._tracemalloc_propio.pop():
+            tracemalloc.stop()
+        return False
+
+    # Context manager que mide una etapa (ver `medir_etapa`).
+    @contextlib.contextmanager
+    def etapa(self, nombre, pixeles):
+        memoria = self.memoria and tracemalloc.is_tracing()
+        if memoria:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            pico = tracemalloc.get_traced_memory()[1] - base if memoria else 0
+            self.anotar(nombre, segundos, pico, pixeles)
+
+    # Suma una medida a la etapa `nombre`.
+    def anotar(self, nombre, segundos, bytes_, pixeles, llamadas=1):
+        with self._candado:
+            valores = self.etapas.get(nombre)
+            if valores is None:
+                valores = self.etapas[nombre] = {"llamadas": 0, "segundos": 0.0, "bytes": 0, "pixeles": 0}
+            valores["llamadas"] += llamadas
+            valores["segundos"] += segundos
+            valores["bytes"] += max(0, bytes_)
+            valores["pixeles"] += pixeles
+
+    # Suma las etapas de otro resumen (por ejemplo, el de un proceso hijo en `batch.py`).
+    def sumar(self, etapas):
+        for nombre, valores in etapas.items():
+            self.anotar(nombre, valores["segundos"], valores["bytes"], valores["pixeles"], valores["llamadas"])
+
+    # Copia de `etapas` lista para exportar (JSON) o enviar a otro proceso.
+    def resumen(self):
+        with self._candado:
+            return {nombre: dict(valores) for nombre, valores in self.etapas.items()}
+
+    # Texto corto para la barra de estado: "rango 3 ms · suavizado 12 ms · ...".
+    def texto(self):
+        return " · ".join(
+            f"{nombre} {valores['segundos'] * 1000:.0f} ms" for nombre, valores in self.resumen().items()
+        )
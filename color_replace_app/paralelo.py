@@ -0,0 +1,281 @@
+import os
+import tracemalloc
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import logic
+import tiles
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Procesamiento en paralelo de UNA imagen grande, por bandas de filas.
+#
+# ¿Por qué existe?
+# - `batch.py` reparte imágenes entre procesos, pero con una sola imagen enorme todo va en
+#   un hilo (salvo lo que OpenCV paraleliza por dentro): la mezcla con NumPy, por ejemplo,
+#   usa un único núcleo.
+# - Aquí la imagen se parte en bandas horizontales y cada banda se procesa en un núcleo.
+#
+# Cómo se evita que se noten las “costuras” (igual que en `tiles.py`):
+# - Cada banda lee `tiles.margen_mascara` filas de más arriba y abajo (halo) para el blur y
+#   la morfología, y solo escribe su parte central.
+# - Las bandas ocupan el ancho completo, así que cada fila pasa por cv2.cvtColor igual que en
+#   la imagen entera y las regiones de `logic.regiones_mascara` siguen alineadas a 64 columnas.
+# - El resultado es idéntico (bit a bit) al de `batch.procesar_imagen` sin `--tesela` ni `--lut`.
+#
+# Sin copiar píxeles:
+# - Con hilos (por defecto): cada banda es una vista de la imagen y escribe directamente en su
+#   trozo de `out`. OpenCV y NumPy sueltan el GIL mientras calculan, así que los hilos
+#   trabajan a la vez.
+# - Con procesos (`procesos=True`): la entrada y la salida viven en bloques de
+#   `multiprocessing.shared_memory`; cada proceso abre el bloque por su nombre y lee/escribe
+#   su banda en el sitio. Solo viajan (pickle) nombres, formas y la receta.
+
+# Filas mínimas por banda: con menos, el halo (que se calcula dos veces) pesa más que lo que
+# se gana repartiendo.
+BANDA_MIN_FILAS = 64
+
+# Bloques de memoria compartida de los arrays creados con `crear_compartida`: id(array) -> nombre.
+_bloques = {}
+
+# En cada proceso hijo: bloques ya abiertos (nombre -> SharedMemory) y buffers de
+# `logic.reemplazar_color_entero`, reutilizados entre bandas.
+_abiertos = {}
+_trabajo_proceso = {}
+
+
+# Genera las bandas de una imagen de `alto` filas.
+#
+# Devuelve (iterador) tuplas:
+# - (y0, y1): filas que se escriben en la salida
+# - (hy0, hy1): filas que se leen, es decir, la banda más su halo
+def recorrer_bandas(alto, bandas, margen):
+    bandas = max(1, min(int(bandas), -(-alto // BANDA_MIN_FILAS)))
+    filas = -(-alto // bandas)
+    for y0 in range(0, alto, filas):
+        y1 = min(alto, y0 + filas)
+        yield (y0, y1), (max(0, y0 - margen), min(alto, y1 + margen))
+
+
+# Crea un array uint8 respaldado por un bloque de `multiprocessing.shared_memory`.
+#
+# - Se puede usar como imagen de entrada de `reemplazar_color_en_paralelo(procesos=True)`
+#   para que ni siquiera se copie la entrada al bloque compartido.
+# - El bloque se libera (close + unlink) cuando el array deja de existir.
+def crear_compartida(forma):
+    tamano = max(1, int(np.prod(forma)))
+    bloque = shared_memory.SharedMemory(create=True, size=tamano)
+    array = np.ndarray(forma, dtype=np.uint8, buffer=bloque.buf)
+    _bloques[id(array)] = bloque.name
+    weakref.finalize(array, _liberar, id(array), bloque)
+    return array
+
+
+# Nombre del bloque compartido de un array de `crear_compartida` (None si no es uno de ellos).
+# Con él, otro proceso puede abrir el mismo bloque (por ejemplo, `servicio.py`).
+def nombre_compartida(array):
+    return _bloques.get(id(array))
+
+
+def _liberar(clave, bloque):
+    _bloques.pop(clave, None)
+    bloque.close()
+    bloque.unlink()
+
+
+# La LUT de `logic.crear_lut` (64 MB) en un bloque compartido, para un pool de procesos.
+#
+# - `crear_lut_compartida` la construye una sola vez, ya dentro de un bloque de `crear_compartida`
+#   (que vive mientras viva la LUT devuelta).
+# - `referencia_lut` es lo que viaja a los hijos (por ejemplo en `initargs`): la LUT sin la
+#   tabla, con el nombre del bloque. Así no se copia en cada hijo ni con spawn ni con fork.
+# - En cada hijo, `abrir_lut` abre el bloque por su nombre: todos leen la misma tabla.
+def crear_lut_compartida(color_hsv, tolerancia, color_destino_hsv, fuerza, mantener_brillo):
+    tabla = crear_compartida(logic.LUT_FORMA)
+    return logic.crear_lut(color_hsv, tolerancia, color_destino_hsv, fuerza, mantener_brillo, tabla=tabla)
+
+
+# Si la tabla de `lut` no está en un bloque compartido, devuelve la LUT tal cual.
+def referencia_lut(lut):
+    nombre = nombre_compartida(lut["tabla"])
+    if nombre is None:
+        return lut
+    return dict(lut, tabla=None, compartida=nombre)
+
+
+def abrir_lut(lut):
+    if lut.get("tabla") is not None:
+        return lut
+    return dict(lut, tabla=_abrir(lut["compartida"], logic.LUT_FORMA))
+
+
+# Máscara + reemplazo de una imagen completa repartida por bandas entre varios núcleos.
+#
+# Entrada:
+# - image_bgr: imagen BGR (alto, ancho, 3) uint8.
+# - color_hsv, tolerancia, suavizado, morph: igual que `logic.crear_mascara_hsv`
+# - color_destino_hsv, fuerza, mantener_brillo: igual que `logic.reemplazar_color`
+# - out: array (alto, ancho, 3) uint8 donde escribir el resultado (opcional). Con procesos,
+#   si no es de `crear_compartida`, el resultado se copia en él al terminar.
+# - hilos: número de bandas en paralelo (por defecto, uno por núcleo).
+# - procesos: usar procesos con memoria compartida en lugar de hilos.
+#
+# Con un `logic.Medidor` activo, las etapas de todas las bandas se suman a él. Con varios
+# hilos, la memoria no se mide por banda (tracemalloc es uno para todo el proceso y los picos
+# de unas bandas se mezclarían con los de otras): sus etapas solo llevan tiempo y el pico de
+# todas las bandas a la vez se anota una vez, como etapa "bandas" (sin tiempo, ya está en las
+# demás). Con procesos, cada uno mide su banda.
+#
+# Devuelve:
+# - Imagen BGR (`out` si se pasó), idéntica a la del camino en serie.
+def reemplazar_color_en_paralelo(
+    image_bgr,
+    color_hsv,
+    tolerancia,
+    suavizado,
+    morph,
+    color_destino_hsv,
+    fuerza,
+    mantener_brillo,
+    out=None,
+    hilos=None,
+    procesos=False,
+):
+    if image_bgr is None or color_hsv is None or np is None or cv2 is None:
+        return None
+
+    receta = {
+        "origen_hsv": color_hsv,
+        "tolerancia": tolerancia,
+        "suavizado": suavizado,
+        "morph": morph,
+        "destino_hsv": color_destino_hsv,
+        "fuerza": fuerza,
+        "mantener_brillo": mantener_brillo,
+    }
+    hilos = max(1, hilos or os.cpu_count() or 1)
+    bandas = list(recorrer_bandas(image_bgr.shape[0], hilos, tiles.margen_mascara(suavizado, morph)))
+    medidor = logic.medidor_activo()
+    # Cómo medir cada banda: None (sin medidor) o el `memoria` del medidor activo.
+    medir = None if medidor is None else medidor.memoria
+
+    if procesos:
+        return _en_procesos(image_bgr, out, bandas, receta, hilos, medidor, medir)
+
+    image_bgr = np.ascontiguousarray(image_bgr)
+    if out is None:
+        out = np.empty_like(image_bgr)
+    # Con una sola banda no hay nada a la vez: se mide como en serie.
+    memoria = bool(medir) and len(bandas) > 1 and tracemalloc.is_tracing()
+    medir_banda = False if memoria else medir
+    if memoria:
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+    with ThreadPoolExecutor(max_workers=hilos) as pool:
+        futuros = [
+            pool.submit(_banda_medida, image_bgr, out, banda, halo, receta, {}, medir_banda)
+            for banda, halo in bandas
+        ]
+        etapas = [futuro.result() for futuro in futuros]
+    _sumar_etapas(medidor, etapas)
+    if memoria:
+        pico = tracemalloc.get_traced_memory()[1] - base
+        medidor.anotar("bandas", 0.0, pico, image_bgr.shape[0] * image_bgr.shape[1])
+    return out
+
+
+def _en_procesos(image_bgr, out, bandas, receta, hilos, medidor, medir):
+    forma = image_bgr.shape
+    entrada = image_bgr
+    if id(entrada) not in _bloques:
+        entrada = crear_compartida(forma)
+        np.copyto(entrada, image_bgr)
+    salida = out if out is not None and id(out) in _bloques else crear_compartida(forma)
+
+    with ProcessPoolExecutor(max_workers=hilos, initializer=_iniciar_proceso) as pool:
+        futuros = [
+            pool.submit(
+                _banda_en_proceso, _bloques[id(entrada)], _bloques[id(salida)], forma, banda, halo, receta, medir
+            )
+            for banda, halo in bandas
+        ]
+        etapas = [futuro.result() for futuro in futuros]
+    _sumar_etapas(medidor, etapas)
+
+    if out is None or out is salida:
+        return salida
+    np.copyto(out, salida)
+    return out
+
+
+# Inicializador de cada proceso hijo: OpenCV a 1 hilo, el paralelismo ya lo dan las bandas
+# (igual que `batch._iniciar_worker`).
+def _iniciar_proceso():
+    if cv2 is not None:
+        cv2.setNumThreads(1)
+
+
+# Trabajo de un proceso hijo: abre los bloques compartidos por su nombre y procesa su banda.
+def _banda_en_proceso(entrada, salida, forma, banda, halo, receta, medir):
+    image_bgr = _abrir(entrada, forma)
+    out = _abrir(salida, forma)
+    return _banda_medida(image_bgr, out, banda, halo, receta, _trabajo_proceso, medir)
+
+
+def _abrir(nombre, forma):
+    bloque = _abiertos.get(nombre)
+    if bloque is None:
+        bloque = _abiertos[nombre] = shared_memory.SharedMemory(name=nombre)
+    return np.ndarray(forma, dtype=np.uint8, buffer=bloque.buf)
+
+
+# Procesa una banda, dentro de un `logic.Medidor(memoria=medir)` propio si `medir` no es
+# None (el medidor activo es por hilo, así que el de quien llama no ve lo que pasa aquí).
+#
+# Devuelve:
+# - el resumen de etapas de la banda ({} si no se mide).
+def _banda_medida(image_bgr, out, banda, halo, receta, trabajo, medir):
+    if medir is None:
+        _procesar_banda(image_bgr, out, banda, halo, receta, trabajo)
+        return {}
+    with logic.Medidor(memoria=medir) as medidor:
+        _procesar_banda(image_bgr, out, banda, halo, receta, trabajo)
+    return medidor.resumen()
+
+
+# BGR -> HSV -> máscara -> reemplazo de una banda, escribiendo solo sus filas de `out`.
+# Mismo flujo que `batch.procesar_imagen`.
+def _procesar_banda(image_bgr, out, banda, halo, receta, trabajo):
+    y0, y1 = banda
+    hy0, hy1 = halo
+    bloque = image_bgr[hy0:hy1]
+    with logic.medir_etapa("bgr_a_hsv", bloque.shape[0] * bloque.shape[1]):
+        hsv = cv2.cvtColor(bloque, cv2.COLOR_BGR2HSV)
+    mask = logic.crear_mascara_hsv(hsv, receta["origen_hsv"], receta["tolerancia"], receta["suavizado"], receta["morph"])
+
+    # Recortar el halo: solo el centro es correcto.
+    centro = slice(y0 - hy0, y1 - hy0)
+    logic.reemplazar_color_roi(
+        image_bgr[y0:y1],
+        hsv[centro],
+        mask[centro],
+        receta["destino_hsv"],
+        receta["fuerza"],
+        receta["mantener_brillo"],
+        out=out[y0:y1],
+        trabajo=trabajo,
+    )
+
+
+def _sumar_etapas(medidor, etapas):
+    if medidor is None:
+        return
+    for resumen in etapas:
+        medidor.sumar(resumen)
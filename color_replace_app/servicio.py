@@ -0,0 +1,746 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import resource_tracker, shared_memory
+from urllib.parse import parse_qs, urlsplit
+
+import batch
+import ediciones
+import logic
+import paralelo
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+logic.cv2 = cv2
+logic.np = np
+
+
+# Servicio HTTP local para que otras herramientas usen el reemplazo de color sin la interfaz.
+#
+# ¿Por qué existe?
+# - Hasta ahora solo se podía usar desde `app.py` (con clicks) o `batch.py` (arrancando un
+#   proceso por lote). Arrancar Python + OpenCV y, si hace falta, construir la LUT cuesta
+#   bastante más que procesar una imagen pequeña.
+# - Aquí hay un pool de procesos “calientes”: OpenCV ya importado, un primer reemplazo hecho
+#   para que sus tablas internas estén cargadas y, con `--lut`, la LUT de la receta por
+#   defecto construida antes de la primera petición.
+# - La LUT solo se usa en las peticiones que la piden (`?lut=1`) con esa misma receta: su
+#   color puede diferir en ±1 del cálculo exacto en el borde de la máscara (ver
+#   `logic.aplicar_lut`), y los mismos
+#   parámetros deben dar siempre los mismos bytes salvo que se pida lo contrario.
+#
+# Cómo se piden las imágenes (POST /reemplazar, receta en la URL):
+# - Bytes codificados (PNG, JPEG...) en el cuerpo; la respuesta es la imagen codificada.
+# - O un bloque de memoria compartida (`multiprocessing.shared_memory`, por ejemplo de
+#   `paralelo.crear_compartida`): `?compartida=<nombre>&alto=..&ancho=..[&salida=<nombre>]`
+#   sin cuerpo. El resultado se escribe en `salida` (o en el mismo bloque) y solo viaja JSON.
+#
+# Agrupación (`AgrupadorLotes`):
+# - Las imágenes pequeñas con la misma receta se juntan durante unos milisegundos y van a un
+#   proceso en un solo envío, así el coste de cada envío se reparte entre varias.
+# - Las grandes se envían solas en cuanto llegan: ya compensan el envío por sí mismas.
+#
+# Contrapresión:
+# - Como mucho `pendientes_max` peticiones aceptadas y sin terminar; las demás reciben un 503
+#   con `Retry-After` al momento, en lugar de acumularse en memoria.
+# - El hueco se reserva antes de leer el cuerpo: una petición rechazada no llega a leerse
+#   (se responde y se cierra la conexión), así con el servicio saturado la memoria no crece.
+#
+# Métricas (GET /metricas): peticiones, errores, rechazos, profundidad de la cola, tamaño medio
+# de los lotes y percentiles de latencia (p50/p90/p99).
+#
+# Uso:
+#   python servicio.py --workers 4
+#   python servicio.py --origen "#c01010" --destino "#1040c0" --lut
+#   curl --data-binary @foto.jpg "http://127.0.0.1:8765/reemplazar?origen=c01010&destino=1040c0" -o salida.png
+#   curl --data-binary @foto.jpg "http://127.0.0.1:8765/reemplazar?lut=1" -o salida.png
+
+HOST_DEFECTO = "127.0.0.1"
+PUERTO_DEFECTO = 8765
+
+# Imágenes por lote como máximo, y cuánto se espera a que lleguen más con la misma receta.
+LOTE_MAX = 8
+ESPERA_LOTE_MS = 5
+
+# Solo se agrupan las imágenes de hasta este tamaño (bytes del cuerpo, o del bloque compartido).
+LOTE_BYTES_MAX = 1024 * 1024
+
+# Peticiones aceptadas y sin terminar como máximo (las demás reciben 503).
+PENDIENTES_MAX = 64
+
+# Tamaño máximo del cuerpo de una petición.
+CUERPO_MAX = 256 * 1024 * 1024
+
+# Latencias que se guardan para calcular los percentiles (las más recientes).
+MUESTRAS_LATENCIA = 10000
+
+# Parámetros que se pueden omitir en la URL (los mismos valores por defecto que `batch.py`).
+PARAMETROS_DEFECTO = {
+    "tolerancia": batch.TOLERANCIA_DEFECTO,
+    "suavizado": 7,
+    "morph": 1,
+    "fuerza": 80,
+    "mantener_brillo": True,
+}
+
+# Formatos de salida aceptados en `?formato=`.
+FORMATOS = tuple(extension.lstrip(".") for extension in batch.EXTENSIONES)
+
+# En cada proceso hijo: la LUT precargada (o None) y los buffers de `logic.reemplazar_color_entero`.
+_lut_worker = None
+_trabajo_worker = {}
+
+
+# La petición no cabe: hay `pendientes_max` peticiones sin terminar.
+class ServicioSaturado(Exception):
+    pass
+
+
+# Construye la receta de una petición a partir de los parámetros de la URL.
+#
+# Entrada:
+# - parametros: dict de `urllib.parse.parse_qs` (nombre -> lista de valores)
+# - defecto: receta del servicio (`--origen`/`--destino`...) o None
+#
+# Colores como en `batch.py` ("c01010", "%23c01010" o "200,20,20"); `mantener_brillo=0`
+# para desactivarlo; `lut=1` para usar la LUT precargada si la receta es la suya.
+#
+# Devuelve:
+# - dict con las claves de `ediciones.CLAVES_PASO` (colores ya en HSV) y "usar_lut".
+# Lanza ValueError si falta algo o un valor no es válido.
+def receta_desde_consulta(parametros, defecto=None):
+    receta = dict(PARAMETROS_DEFECTO)
+    if defecto:
+        receta.update(defecto)
+
+    def valor(nombre):
+        valores = parametros.get(nombre)
+        return valores[-1] if valores else None
+
+    try:
+        for nombre, clave in (("origen", "origen_hsv"), ("destino", "destino_hsv")):
+            texto = valor(nombre)
+            if texto:
+                receta[clave] = logic.convertir_rgb_a_hsv(*batch.parsear_color(texto))
+        if valor("tolerancia"):
+            receta["tolerancia"] = batch.parsear_tolerancia(valor("tolerancia"))
+        for nombre in ("suavizado", "morph", "fuerza"):
+            if valor(nombre):
+                receta[nombre] = int(valor(nombre))
+    except (ValueError, argparse.ArgumentTypeError) as exc:
+        raise ValueError(str(exc))
+    if valor("mantener_brillo"):
+        receta["mantener_brillo"] = valor("mantener_brillo").lower() not in ("0", "false", "no")
+    usar_lut = bool(valor("lut")) and valor("lut").lower() not in ("0", "false", "no")
+
+    if "origen_hsv" not in receta or "destino_hsv" not in receta:
+        raise ValueError("Faltan los colores: usa ?origen=RRGGBB&destino=RRGGBB.")
+    receta["origen_hsv"] = tuple(int(c) for c in receta["origen_hsv"])
+    receta["destino_hsv"] = tuple(int(c) for c in receta["destino_hsv"])
+    receta = {clave: receta[clave] for clave in ediciones.CLAVES_PASO}
+    receta["usar_lut"] = usar_lut
+    return receta
+
+
+# Clave con la que se agrupan las peticiones: dos recetas iguales, la misma clave. Incluye
+# `usar_lut`, para no mezclar en un lote peticiones con LUT y sin ella.
+def clave_receta(receta):
+    return tuple(receta[clave] for clave in ediciones.CLAVES_PASO) + (receta.get("usar_lut", False),)
+
+
+# Percentil `p` (0..100) de una lista ya ordenada (0.0 si está vacía).
+def percentil(ordenados, p):
+    if not ordenados:
+        return 0.0
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+# Contadores y latencias del servicio. Se actualizan desde los hilos de las peticiones.
+class Metricas:
+
+    def __init__(self, muestras=MUESTRAS_LATENCIA):
+        self._candado = threading.Lock()
+        self._latencias = deque(maxlen=muestras)
+        self.inicio = time.monotonic()
+        self.peticiones = 0
+        self.errores = 0
+        self.rechazadas = 0
+        self.lotes = 0
+        self.imagenes_en_lotes = 0
+        self.segundos_calculo = 0.0
+
+    # Una petición terminada (bien o con error) y cuánto tardó de principio a fin.
+    def registrar(self, segundos, error=False):
+        with self._candado:
+            self.peticiones += 1
+            if error:
+                self.errores += 1
+            self._latencias.append(segundos)
+
+    def rechazar(self):
+        with self._candado:
+            self.rechazadas += 1
+
+    # Un lote que volvió de un proceso: cuántas imágenes llevaba y cuánto calculó el proceso.
+    def registrar_lote(self, imagenes, segundos):
+        with self._candado:
+            self.lotes += 1
+            self.imagenes_en_lotes += imagenes
+            self.segundos_calculo += segundos
+
+    # Resumen para GET /metricas. `cola` viene de `AgrupadorLotes.profundidad`.
+    def resumen(self, cola):
+        with self._candado:
+            latencias = sorted(self._latencias)
+            activo = time.monotonic() - self.inicio
+            return {
+                "peticiones": self.peticiones,
+                "errores": self.errores,
+                "rechazadas": self.rechazadas,
+                "peticiones_por_segundo": self.peticiones / activo if activo > 0 else 0.0,
+                "segundos_activo": activo,
+                "lotes": self.lotes,
+                "imagenes_por_lote": self.imagenes_en_lotes / self.lotes if self.lotes else 0.0,
+                "ms_calculo_por_imagen": (
+                    self.segundos_calculo / self.imagenes_en_lotes * 1000 if self.imagenes_en_lotes else 0.0
+                ),
+                "latencia_ms": {
+                    "p50": percentil(latencias, 50) * 1000,
+                    "p90": percentil(latencias, 90) * 1000,
+                    "p99": percentil(latencias, 99) * 1000,
+                    "max": latencias[-1] * 1000 if latencias else 0.0,
+                    "muestras": len(latencias),
+                },
+                "cola": cola,
+            }
+
+
+# Junta las peticiones pequeñas con la misma receta y las envía al pool por lotes.
+#
+# - `enviar` devuelve un Future con el resultado de esa imagen (ver `_procesar_entrada`).
+# - Un hilo propio despacha cada grupo cuando llega a `lote_max` imágenes o cuando la más
+#   antigua lleva `espera` segundos esperando.
+# - Lleva la cuenta de las peticiones sin terminar para la contrapresión.
+class AgrupadorLotes:
+
+    def __init__(
+        self,
+        pool,
+        metricas,
+        lote_max=LOTE_MAX,
+        espera=ESPERA_LOTE_MS / 1000,
+        bytes_max=LOTE_BYTES_MAX,
+        pendientes_max=PENDIENTES_MAX,
+    ):
+        self._pool = pool
+        self._metricas = metricas
+        self.lote_max = max(1, lote_max)
+        self.espera = espera
+        self.bytes_max = bytes_max
+        self.pendientes_max = pendientes_max
+        self._condicion = threading.Condition()
+        # clave de receta -> {"receta", "entradas": [(entrada, futuro)], "limite"}; en orden de llegada.
+        self._grupos = OrderedDict()
+        self._pendientes = 0
+        self._en_vuelo = 0
+        self._cerrado = False
+        self._hilo = threading.Thread(target=self._despachar, name="agrupador", daemon=True)
+        self._hilo.start()
+
+    # Reserva el hueco de una petición, antes de leer su cuerpo.
+    #
+    # Lanza ServicioSaturado si ya hay `pendientes_max` peticiones sin terminar. Tras
+    # reservar hay que llamar a `enviar` o, si la petición no llega a enviarse, a `liberar`.
+    def reservar(self):
+        with self._condicion:
+            if self._pendientes >= self.pendientes_max:
+                raise ServicioSaturado()
+            self._pendientes += 1
+
+    # Devuelve un hueco de `reservar` que no se usó (cuerpo ilegible, petición no válida...).
+    def liberar(self):
+        with self._condicion:
+            self._pendientes -= 1
+
+    # Encola una imagen, en el hueco ya reservado con `reservar`.
+    #
+    # Entrada:
+    # - receta: de `receta_desde_consulta`
+    # - entrada: tupla de `_procesar_entrada` ("bytes", ...) o ("compartida", ...)
+    # - tamano: bytes de la imagen (decide si se agrupa o se envía sola)
+    def enviar(self, receta, entrada, tamano):
+        futuro = Future()
+        futuro.add_done_callback(self._terminada)
+        with self._condicion:
+            if self.lote_max > 1 and tamano <= self.bytes_max:
+                clave = clave_receta(receta)
+                grupo = self._grupos.get(clave)
+                if grupo is None:
+                    grupo = self._grupos[clave] = {
+                        "receta": receta,
+                        "entradas": [],
+                        "limite": time.monotonic() + self.espera,
+                    }
+                grupo["entradas"].append((entrada, futuro))
+                self._condicion.notify()
+                return futuro
+
+        self._enviar_lote(receta, [(entrada, futuro)])
+        return futuro
+
+    # Profundidad de la cola: peticiones sin terminar, las que esperan a completar un lote
+    # y los lotes enviados al pool que aún no han vuelto.
+    def profundidad(self):
+        with self._condicion:
+            return {
+                "pendientes": self._pendientes,
+                "pendientes_max": self.pendientes_max,
+                "esperando_lote": sum(len(g["entradas"]) for g in self._grupos.values()),
+                "lotes_en_vuelo": self._en_vuelo,
+            }
+
+    # Envía lo que quede agrupado y para el hilo despachador.
+    def cerrar(self):
+        with self._condicion:
+            self._cerrado = True
+            self._condicion.notify()
+        self._hilo.join()
+
+    def _terminada(self, futuro):
+        self.liberar()
+
+    def _despachar(self):
+        while True:
+            with self._condicion:
+                listos = []
+                while not listos:
+                    ahora = time.monotonic()
+                    proximo = None
+                    for clave, grupo in list(self._grupos.items()):
+                        if self._cerrado or len(grupo["entradas"]) >= self.lote_max or grupo["limite"] <= ahora:
+                            listos.append(self._grupos.pop(clave))
+                        elif proximo is None or grupo["limite"] < proximo:
+                            proximo = grupo["limite"]
+                    if listos:
+                        break
+                    if self._cerrado:
+                        return
+                    self._condicion.wait(None if proximo is None else proximo - ahora)
+
+            for grupo in listos:
+                entradas = grupo["entradas"]
+                for i in range(0, len(entradas), self.lote_max):
+                    self._enviar_lote(grupo["receta"], entradas[i:i + self.lote_max])
+
+    def _enviar_lote(self, receta, entradas):
+        with self._condicion:
+            self._en_vuelo += 1
+        try:
+            lote = self._pool.submit(_procesar_lote, receta, [entrada for entrada, _ in entradas])
+        except Exception as exc:
+            lote = Future()
+            lote.set_exception(exc)
+        lote.add_done_callback(lambda lote: self._repartir(lote, entradas))
+
+    # Reparte los resultados de un lote entre los futuros de sus peticiones.
+    def _repartir(self, lote, entradas):
+        with self._condicion:
+            self._en_vuelo -= 1
+        try:
+            resultados, segundos = lote.result()
+        except Exception as exc:
+            for _, futuro in entradas:
+                futuro.set_exception(exc)
+            return
+        self._metricas.registrar_lote(len(entradas), segundos)
+        for (_, futuro), resultado in zip(entradas, resultados):
+            futuro.set_result(resultado)
+
+
+# Inicializador de cada proceso hijo: lo deja “caliente” antes de la primera petición.
+#
+# - OpenCV a 1 hilo (igual que `batch._iniciar_worker`): el paralelismo lo dan los procesos.
+# - Un reemplazo de prueba sobre una imagen pequeña, con codificación y decodificación, para
+#   que la primera petición real no pague la carga de las funciones de OpenCV.
+# - Con `lut` (de `paralelo.referencia_lut`), abre la LUT que el proceso principal construyó
+#   una sola vez en memoria compartida: todos los procesos leen la misma tabla.
+def _iniciar_worker(receta, lut):
+    global _lut_worker
+    if cv2 is None or np is None:
+        return
+    cv2.setNumThreads(1)
+
+    if lut is not None:
+        _lut_worker = paralelo.abrir_lut(lut)
+
+    prueba = np.zeros((64, 64, 3), np.uint8)
+    prueba[16:48, 16:48] = (20, 20, 200)
+    if receta is None:
+        receta = dict(PARAMETROS_DEFECTO, origen_hsv=(0, 200, 200), destino_hsv=(120, 200, 200))
+    _, codificada = cv2.imencode(".png", prueba)
+    _procesar_entrada(_receta_con_lut(dict(receta, usar_lut=True)), ("bytes", codificada.tobytes(), "png"))
+
+
+# Tarea vacía para esperar a que arranquen todos los procesos del pool.
+def _listo():
+    return os.getpid()
+
+
+# Si la petición pidió la LUT (`usar_lut`) y la receta es la de la LUT precargada, la añade
+# (`batch.procesar_imagen` la usará). Si no, se usa el cálculo exacto.
+def _receta_con_lut(receta):
+    if _lut_worker is None or not receta.get("usar_lut"):
+        return receta
+    clave = (receta["origen_hsv"], receta["tolerancia"], receta["destino_hsv"], receta["fuerza"], receta["mantener_brillo"])
+    if _lut_worker["clave"] != clave:
+        return receta
+    return dict(receta, lut=_lut_worker)
+
+
+# Trabajo de un proceso hijo: todas las imágenes de un lote con la misma receta.
+#
+# Devuelve:
+# - (lista de resultados de `_procesar_entrada`, segundos de cálculo del lote)
+def _procesar_lote(receta, entradas):
+    inicio = time.perf_counter()
+    receta = _receta_con_lut(receta)
+    resultados = [_procesar_entrada(receta, entrada) for entrada in entradas]
+    return resultados, time.perf_counter() - inicio
+
+
+# Procesa una imagen.
+#
+# Entrada:
+# - ("bytes", datos, formato): imagen codificada; el resultado se codifica en `formato`.
+# - ("compartida", nombre, forma, salida): imagen en un bloque de memoria compartida; el
+#   resultado se escribe en el bloque `salida` (puede ser el mismo).
+#
+# Devuelve:
+# - dict con "error" (None si fue bien) y, para bytes, "datos" con la imagen codificada.
+def _procesar_entrada(receta, entrada):
+    if entrada[0] == "bytes":
+        _, datos, formato = entrada
+        image_bgr = cv2.imdecode(np.frombuffer(datos, np.uint8), cv2.IMREAD_COLOR)
+        if image_bgr is None:
+            return {"error": "No se pudo decodificar la imagen."}
+        result_bgr = batch.procesar_imagen(image_bgr, receta, _trabajo_worker)
+        if result_bgr is None:
+            return {"error": "No se pudo procesar la imagen."}
+        escrita, codificada = cv2.imencode("." + formato, result_bgr)
+        if not escrita:
+            return {"error": f"No se pudo codificar la imagen como {formato}."}
+        return {"error": None, "datos": codificada.tobytes()}
+
+    _, nombre, forma, salida = entrada
+    try:
+        bloques = [_abrir_compartida(nombre)]
+        if salida != nombre:
+            bloques.append(_abrir_compartida(salida))
+    except (FileNotFoundError, ValueError):
+        return {"error": "No existe el bloque de memoria compartida."}
+    image_bgr = out = None
+    try:
+        if any(bloque.size < int(np.prod(forma)) for bloque in bloques):
+            return {"error": "El bloque de memoria compartida es más pequeño que la imagen."}
+        image_bgr = np.ndarray(forma, dtype=np.uint8, buffer=bloques[0].buf)
+        out = np.ndarray(forma, dtype=np.uint8, buffer=bloques[-1].buf)
+        result_bgr = batch.procesar_imagen(image_bgr, receta, _trabajo_worker)
+        if result_bgr is None:
+            return {"error": "No se pudo procesar la imagen."}
+        np.copyto(out, result_bgr)
+        return {"error": None}
+    finally:
+        # Sin vistas vivas del buffer, el bloque se puede cerrar.
+        image_bgr = out = result_bgr = None
+        for bloque in bloques:
+            bloque.close()
+
+
+# Abre un bloque de memoria compartida creado por otro proceso (el cliente).
+#
+# El bloque es del cliente: se quita del `resource_tracker` de este proceso para que no lo
+# borre (ni avise de una “fuga”) cuando el servicio termine.
+def _abrir_compartida(nombre):
+    bloque = shared_memory.SharedMemory(name=nombre)
+    try:
+        resource_tracker.unregister(bloque._name, "shared_memory")
+    except Exception:
+        pass
+    return bloque
+
+
+class _Manejador(BaseHTTPRequestHandler):
+    server_version = "ColorReplace/1.0"
+
+    def do_GET(self):
+        ruta = urlsplit(self.path).path
+        if ruta == "/salud":
+            self._responder_json(
+                200,
+                {
+                    "estado": "ok",
+                    "workers": self.server.workers,
+                    # Si hay LUT precargada: solo la usan las peticiones con ?lut=1 (±1 en el borde).
+                    "lut": self.server.lut,
+                },
+            )
+        elif ruta == "/metricas":
+            self._responder_json(200, self.server.metricas.resumen(self.server.agrupador.profundidad()))
+        else:
+            self._responder_json(404, {"error": "Ruta desconocida."})
+
+    def do_POST(self):
+        partes = urlsplit(self.path)
+        if partes.path != "/reemplazar":
+            self._responder_json(404, {"error": "Ruta desconocida."})
+            return
+
+        inicio = time.perf_counter()
+        try:
+            longitud = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            longitud = -1
+        if longitud < 0:
+            self._responder_sin_leer(400, {"error": "Content-Length no válido."})
+            return
+        if longitud > CUERPO_MAX:
+            self._responder_sin_leer(413, {"error": f"Imagen demasiado grande (máximo {CUERPO_MAX} bytes)."})
+            return
+
+        # El hueco se reserva antes de leer el cuerpo (ver “Contrapresión” arriba).
+        agrupador = self.server.agrupador
+        try:
+            agrupador.reservar()
+        except ServicioSaturado:
+            self.server.metricas.rechazar()
+            self._responder_sin_leer(503, {"error": "Servicio saturado, reintenta más tarde."}, {"Retry-After": "1"})
+            return
+
+        # Hasta `enviar`, cualquier salida devuelve el hueco antes de responder.
+        try:
+            cuerpo = self.rfile.read(longitud) if longitud else b""
+            if len(cuerpo) < longitud:
+                raise ConnectionResetError("Cuerpo incompleto.")
+            parametros = parse_qs(partes.query)
+            receta = receta_desde_consulta(parametros, self.server.receta_defecto)
+            entrada, tamano = self._entrada(parametros, cuerpo)
+        except ValueError as exc:
+            agrupador.liberar()
+            self._responder_json(400, {"error": str(exc)})
+            return
+        except OSError:
+            # El cliente cerró (o se cortó) antes de mandar todo el cuerpo: no hay a quién responder.
+            agrupador.liberar()
+            self.close_connection = True
+            return
+        except BaseException:
+            agrupador.liberar()
+            raise
+
+        futuro = agrupador.enviar(receta, entrada, tamano)
+
+        try:
+            resultado = futuro.result()
+        except Exception as exc:
+            self.server.metricas.registrar(time.perf_counter() - inicio, error=True)
+            self._responder_json(500, {"error": f"Fallo en el proceso de cálculo: {exc}"})
+            return
+
+        self.server.metricas.registrar(time.perf_counter() - inicio, error=resultado["error"] is not None)
+        if resultado["error"] is not None:
+            self._responder_json(400, {"error": resultado["error"]})
+        elif entrada[0] == "bytes":
+            self._responder(200, resultado["datos"], "image/" + entrada[2].replace("jpg", "jpeg"))
+        else:
+            self._responder_json(200, {"compartida": entrada[3], "forma": list(entrada[2])})
+
+    # Devuelve (entrada para `_procesar_entrada`, tamaño en bytes de la imagen).
+    def _entrada(self, parametros, cuerpo):
+        nombre = (parametros.get("compartida") or [None])[-1]
+        if nombre is None:
+            if not cuerpo:
+                raise ValueError("Falta la imagen: envíala en el cuerpo o usa ?compartida=<nombre>.")
+            formato = (parametros.get("formato") or ["png"])[-1].lower()
+            if formato not in FORMATOS:
+                raise ValueError(f"Formato no válido: {formato!r} (usa {', '.join(FORMATOS)}).")
+            return ("bytes", cuerpo, formato), len(cuerpo)
+
+        try:
+            forma = (int(parametros["alto"][-1]), int(parametros["ancho"][-1]), 3)
+        except (KeyError, ValueError):
+            raise ValueError("Con ?compartida hacen falta también ?alto y ?ancho.")
+        if forma[0] <= 0 or forma[1] <= 0:
+            raise ValueError("?alto y ?ancho deben ser positivos.")
+        salida = (parametros.get("salida") or [nombre])[-1]
+        return ("compartida", nombre, forma, salida), forma[0] * forma[1] * 3
+
+    # Responde sin haber leído el cuerpo: la conexión se cierra (el cuerpo sigue en ella).
+    def _responder_sin_leer(self, estado, datos, cabeceras=None):
+        self.close_connection = True
+        self._responder_json(estado, datos, dict(cabeceras or {}, Connection="close"))
+
+    def _responder_json(self, estado, datos, cabeceras=None):
+        cuerpo = json.dumps(datos, ensure_ascii=False).encode("utf-8")
+        self._responder(estado, cuerpo, "application/json; charset=utf-8", cabeceras)
+
+    def _responder(self, estado, cuerpo, tipo, cabeceras=None):
+        self.send_response(estado)
+        self.send_header("Content-Type", tipo)
+        self.send_header("Content-Length", str(len(cuerpo)))
+        for nombre, valor in (cabeceras or {}).items():
+            self.send_header(nombre, valor)
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    # Sin una línea por petición (con carga serían miles), salvo con --registro.
+    def log_message(self, formato, *args):
+        if self.server.registro:
+            super().log_message(formato, *args)
+
+
+# Servidor HTTP con lo que necesitan los manejadores: agrupador, métricas y receta por defecto.
+class ServidorRecolor(ThreadingHTTPServer):
+    daemon_threads = True
+    # Conexiones en espera de `accept`; con el valor por defecto (5), una ráfaga de clientes
+    # recibiría “connection refused” antes de llegar a la contrapresión.
+    request_queue_size = 128
+
+    def __init__(self, direccion, agrupador, metricas, workers, receta_defecto=None, registro=False, lut=False):
+        super().__init__(direccion, _Manejador)
+        self.agrupador = agrupador
+        self.metricas = metricas
+        self.workers = workers
+        self.receta_defecto = receta_defecto
+        self.registro = registro
+        self.lut = lut
+
+
+def _crear_parser():
+    parser = argparse.ArgumentParser(
+        description="Servicio HTTP local de reemplazo de color con procesos precalentados.",
+    )
+    parser.add_argument("--host", default=HOST_DEFECTO, help=f"Dirección donde escuchar. Por defecto {HOST_DEFECTO}.")
+    parser.add_argument("--puerto", type=int, default=PUERTO_DEFECTO, help=f"Puerto. Por defecto {PUERTO_DEFECTO}.")
+    parser.add_argument("--workers", type=int, default=None, help="Número de procesos (por defecto, uno por núcleo).")
+    parser.add_argument("--lote-max", type=int, default=LOTE_MAX, help=f"Imágenes por lote como máximo. Por defecto {LOTE_MAX}.")
+    parser.add_argument(
+        "--espera-lote-ms",
+        type=float,
+        default=ESPERA_LOTE_MS,
+        help=f"Milisegundos que se espera a completar un lote. Por defecto {ESPERA_LOTE_MS}.",
+    )
+    parser.add_argument(
+        "--pendientes-max",
+        type=int,
+        default=PENDIENTES_MAX,
+        help=f"Peticiones sin terminar como máximo; las demás reciben 503. Por defecto {PENDIENTES_MAX}.",
+    )
+    parser.add_argument("--origen", type=batch.parsear_color, default=None, help="Color a cambiar por defecto (#RRGGBB o r,g,b).")
+    parser.add_argument("--destino", type=batch.parsear_color, default=None, help="Color nuevo por defecto (#RRGGBB o r,g,b).")
+    parser.add_argument("--tolerancia", type=batch.parsear_tolerancia, default=batch.TOLERANCIA_DEFECTO, help="Tolerancia por defecto.")
+    parser.add_argument("--suavizado", type=int, default=PARAMETROS_DEFECTO["suavizado"], help="Suavizado por defecto.")
+    parser.add_argument("--morph", type=int, default=PARAMETROS_DEFECTO["morph"], help="Morfología por defecto.")
+    parser.add_argument("--fuerza", type=int, default=PARAMETROS_DEFECTO["fuerza"], help="Fuerza por defecto.")
+    parser.add_argument(
+        "--no-mantener-brillo",
+        dest="mantener_brillo",
+        action="store_false",
+        help="Por defecto, mezclar también el canal V.",
+    )
+    parser.add_argument(
+        "--lut",
+        action="store_true",
+        help="Precargar la LUT de la receta por defecto (necesita --origen y --destino): se construye una vez "
+        "y los procesos la comparten (64 MB en memoria compartida). Solo la usan las peticiones con ?lut=1.",
+    )
+    parser.add_argument("--registro", action="store_true", help="Escribir una línea por petición.")
+    return parser
+
+
+# Punto de entrada del servicio. Devuelve el código de salida del proceso.
+def main(argv=None):
+    args = _crear_parser().parse_args(argv)
+
+    if cv2 is None or np is None:
+        print("Error: faltan dependencias: cv2 o numpy.", file=sys.stderr)
+        return 2
+
+    receta_defecto = None
+    if args.origen is not None and args.destino is not None:
+        receta_defecto = {
+            "origen_hsv": logic.convertir_rgb_a_hsv(*args.origen),
+            "destino_hsv": logic.convertir_rgb_a_hsv(*args.destino),
+            "tolerancia": args.tolerancia,
+            "suavizado": args.suavizado,
+            "morph": args.morph,
+            "fuerza": args.fuerza,
+            "mantener_brillo": args.mantener_brillo,
+        }
+    elif args.origen is not None or args.destino is not None:
+        print("Error: --origen y --destino van juntos.", file=sys.stderr)
+        return 2
+    if args.lut and (receta_defecto is None or args.tolerancia == "auto"):
+        print("Error: --lut necesita --origen, --destino y una tolerancia numérica.", file=sys.stderr)
+        return 2
+
+    lut = None
+    if args.lut:
+        # Una sola vez, en memoria compartida (64 MB en total, no por proceso).
+        lut = paralelo.crear_lut_compartida(
+            receta_defecto["origen_hsv"],
+            receta_defecto["tolerancia"],
+            receta_defecto["destino_hsv"],
+            receta_defecto["fuerza"],
+            receta_defecto["mantener_brillo"],
+        )
+        print(f"LUT construida en {lut['segundos_construccion']:.2f} s")
+
+    workers = args.workers or os.cpu_count() or 1
+    inicio = time.perf_counter()
+    # El pool se crea (y sus procesos arrancan) antes que cualquier hilo del servidor.
+    pool = ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_iniciar_worker,
+        initargs=(receta_defecto, None if lut is None else paralelo.referencia_lut(lut)),
+    )
+    # Los procesos se crean a demanda: una tarea por proceso los arranca todos a la vez.
+    for futuro in [pool.submit(_listo) for _ in range(workers)]:
+        futuro.result()
+    print(f"{workers} procesos arrancados en {time.perf_counter() - inicio:.2f} s")
+
+    metricas = Metricas()
+    agrupador = AgrupadorLotes(
+        pool,
+        metricas,
+        lote_max=args.lote_max,
+        espera=args.espera_lote_ms / 1000,
+        pendientes_max=args.pendientes_max,
+    )
+    servidor = ServidorRecolor(
+        (args.host, args.puerto), agrupador, metricas, workers, receta_defecto, args.registro, args.lut
+    )
+    print(f"Escuchando en http://{args.host}:{servidor.server_address[1]} (POST /reemplazar, GET /metricas)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+        agrupador.cerrar()
+        pool.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
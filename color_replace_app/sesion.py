@@ -0,0 +1,257 @@
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Sesión de trabajo con una imagen y un presupuesto de memoria.
+#
+# ¿Por qué existe?
+# - La app guardaba la imagen BGR, su HSV y el resultado como arrays completos en RAM.
+#   Con varias imágenes grandes (o una de 100 MP) eso acaba en swap.
+# - La sesión guarda la imagen y sus “planos” (HSV, resultado) y controla cuánta RAM ocupan
+#   entre todos, con un presupuesto configurable.
+#
+# Reglas:
+# - La imagen base, si ocupa más de `FRACCION_MAPEO` del presupuesto, se guarda en un fichero
+#   temporal mapeado en memoria (`np.memmap`): el sistema la lee de disco según se usa y puede
+#   soltar sus páginas sin pasar por swap.
+# - El HSV no se calcula al cargar, sino la primera vez que se pide (`hsv`). Si no cabe en el
+#   presupuesto, se calcula por bloques de filas directamente en un fichero mapeado. Para una
+#   zona (un píxel, un recorte) no hace falta el HSV entero: `hsv_region` lo calcula solo ahí.
+# - Cuando los planos en RAM superan el presupuesto, se descartan los usados hace más tiempo
+#   (LRU). Un plano derivado (HSV) se vuelve a calcular si se pide; uno guardado (resultado)
+#   devuelve None y hay que recalcularlo.
+# - Lo que vive con la imagen pero no es un plano (por ejemplo, el índice de histograma o los
+#   recortes de la zona de la app) se registra con `fijar`: cuenta en el presupuesto y la
+#   sesión no lo descarta; quien lo registró lo quita con `soltar`.
+# - `uso` / `texto_uso` informan de lo que ocupa cada plano, en RAM y en disco.
+#
+# Es segura entre hilos: la usan a la vez el hilo de Tk y los de cálculo de la app.
+
+# Presupuesto de RAM por defecto para los planos de una imagen.
+PRESUPUESTO_DEFECTO = 1024 * 2 ** 20
+
+# La imagen base va a un fichero mapeado si ocupa más que esta fracción del presupuesto.
+FRACCION_MAPEO = 0.25
+
+# Filas por bloque al calcular un plano directamente en disco.
+FILAS_BLOQUE = 256
+
+
+# Carga una imagen en una sesión nueva.
+#
+# Devuelve:
+# - SesionImagen, o None si OpenCV no pudo leer el archivo.
+def abrir(ruta, presupuesto=PRESUPUESTO_DEFECTO, carpeta=None):
+    if cv2 is None or np is None:
+        return None
+    image_bgr = cv2.imread(ruta)
+    if image_bgr is None:
+        return None
+    return SesionImagen(image_bgr, presupuesto, carpeta)
+
+
+class SesionImagen:
+
+    # Entrada:
+    # - image_bgr: imagen BGR ya decodificada. Si se mapea a disco, la sesión no se queda con
+    #   ella y se puede liberar.
+    # - presupuesto: bytes de RAM para la imagen y sus planos.
+    # - carpeta: dónde crear los ficheros temporales (por defecto, la del sistema).
+    def __init__(self, image_bgr, presupuesto=PRESUPUESTO_DEFECTO, carpeta=None):
+        self.presupuesto = presupuesto
+        self._carpeta = carpeta
+        self._candado = threading.RLock()
+        # nombre -> array; el último usado va al final (orden LRU).
+        self._planos = OrderedDict()
+        # nombre -> array registrado con `fijar` (cuenta en el presupuesto, no se descarta).
+        self._fijos = {}
+        # Ficheros temporales que no se pudieron borrar al crearlos (Windows).
+        self._ficheros = []
+        weakref.finalize(self, _borrar_ficheros, self._ficheros)
+
+        if image_bgr.nbytes > FRACCION_MAPEO * presupuesto:
+            self.bgr = self._mapear(image_bgr.shape, image_bgr.dtype)
+            self.bgr[...] = image_bgr
+        else:
+            self.bgr = image_bgr
+        self.alto, self.ancho = self.bgr.shape[:2]
+
+    # HSV de la imagen completa (se calcula la primera vez, o tras descartarlo).
+    def hsv(self):
+        return self._derivar("hsv", self._calcular_hsv)
+
+    # HSV de una zona (y0, y1, x0, x1), contiguo.
+    # Si el HSV completo está calculado se recorta de él; si no, se convierte solo la zona.
+    def hsv_region(self, region):
+        y0, y1, x0, x1 = region
+        with self._candado:
+            hsv = self._planos.get("hsv")
+        if hsv is not None:
+            return np.ascontiguousarray(hsv[y0:y1, x0:x1])
+        return cv2.cvtColor(np.ascontiguousarray(self.bgr[y0:y1, x0:x1]), cv2.COLOR_BGR2HSV)
+
+    # Guarda un plano que no se puede recalcular desde la imagen (por ejemplo, el resultado).
+    # Si no cabe en el presupuesto, se copia a un fichero mapeado.
+    #
+    # Devuelve:
+    # - el array guardado (el mismo, o su copia en disco).
+    def guardar(self, nombre, array):
+        if array.nbytes > self._libre():
+            mapeado = self._mapear(array.shape, array.dtype)
+            mapeado[...] = array
+            array = mapeado
+        with self._candado:
+            self._planos.pop(nombre, None)
+            self._planos[nombre] = array
+            self._ajustar(nombre)
+        return array
+
+    # Cuenta `array` en el presupuesto de la sesión sin guardarlo como plano: no se
+    # descarta nunca (quien lo creó se queda con él). Si con él se pasa del presupuesto, se
+    # descartan planos como en `guardar`.
+    def fijar(self, nombre, array):
+        with self._candado:
+            self._fijos[nombre] = array
+            self._ajustar(None)
+
+    # Deja de contar lo registrado con `fijar` (si lo estaba).
+    def soltar(self, nombre):
+        with self._candado:
+            self._fijos.pop(nombre, None)
+
+    # Devuelve el plano `nombre`, o None si no existe o se descartó.
+    def obtener(self, nombre):
+        with self._candado:
+            array = self._planos.get(nombre)
+            if array is not None:
+                self._planos.move_to_end(nombre)
+            return array
+
+    # Descarta un plano (si existe).
+    def olvidar(self, nombre):
+        with self._candado:
+            self._planos.pop(nombre, None)
+
+    # Descarta todos los planos. La imagen base y lo registrado con `fijar` se mantienen.
+    def limpiar(self):
+        with self._candado:
+            self._planos.clear()
+
+    # Uso actual de memoria.
+    #
+    # Devuelve:
+    # - dict con "ram" y "disco" (bytes totales), "presupuesto" y "planos":
+    #   {nombre: {"bytes", "disco"}} incluyendo la imagen base ("bgr") y lo fijado.
+    def uso(self):
+        with self._candado:
+            planos = {"bgr": self.bgr}
+            planos.update(self._fijos)
+            planos.update(self._planos)
+            detalle = {
+                nombre: {"bytes": array.nbytes, "disco": isinstance(array, np.memmap)}
+                for nombre, array in planos.items()
+            }
+        return {
+            "ram": sum(p["bytes"] for p in detalle.values() if not p["disco"]),
+            "disco": sum(p["bytes"] for p in detalle.values() if p["disco"]),
+            "presupuesto": self.presupuesto,
+            "planos": detalle,
+        }
+
+    # Texto corto para la barra de estado: "Memoria: 412 / 1024 MB (+ 300 MB en disco)".
+    #
+    # - otros: bytes en RAM que se gestionan fuera de la sesión, con su propia parte del
+    #   presupuesto total (por ejemplo, las cachés de máscaras y de pasos de la app).
+    # - presupuesto: el total con esas partes (por defecto, el de la sesión).
+    def texto_uso(self, otros=0, presupuesto=None):
+        uso = self.uso()
+        presupuesto = uso["presupuesto"] if presupuesto is None else presupuesto
+        texto = f"Memoria: {(uso['ram'] + otros) / 2 ** 20:.0f} / {presupuesto / 2 ** 20:.0f} MB"
+        if uso["disco"]:
+            texto += f" (+ {uso['disco'] / 2 ** 20:.0f} MB en disco)"
+        return texto
+
+    # Devuelve el plano derivado `nombre`, calculándolo con `calcular(en_disco)` si no está.
+    #
+    # El cálculo se hace sin el candado, para no bloquear a otros hilos (por ejemplo, el de
+    # Tk pidiendo `hsv_region` mientras un hilo de cálculo genera el HSV completo).
+    def _derivar(self, nombre, calcular):
+        with self._candado:
+            array = self._planos.get(nombre)
+            if array is not None:
+                self._planos.move_to_end(nombre)
+                return array
+            en_disco = self.alto * self.ancho * 3 > self._libre()
+
+        array = calcular(en_disco)
+        with self._candado:
+            existente = self._planos.get(nombre)
+            if existente is not None:
+                return existente
+            self._planos[nombre] = array
+            self._ajustar(nombre)
+        return array
+
+    def _calcular_hsv(self, en_disco):
+        if not en_disco:
+            return cv2.cvtColor(np.asarray(self.bgr), cv2.COLOR_BGR2HSV)
+        # BGR -> HSV es píxel a píxel: por bloques de filas da lo mismo que de una vez.
+        hsv = self._mapear(self.bgr.shape, np.uint8)
+        for y in range(0, self.alto, FILAS_BLOQUE):
+            bloque = np.ascontiguousarray(self.bgr[y:y + FILAS_BLOQUE])
+            hsv[y:y + FILAS_BLOQUE] = cv2.cvtColor(bloque, cv2.COLOR_BGR2HSV)
+        return hsv
+
+    # Bytes de RAM que puede ocupar un plano descartando todos los demás.
+    def _libre(self):
+        base = 0 if isinstance(self.bgr, np.memmap) else self.bgr.nbytes
+        with self._candado:
+            base += sum(array.nbytes for array in self._fijos.values())
+        return self.presupuesto - base
+
+    # Descarta planos en RAM, del usado hace más tiempo al más reciente, hasta volver a
+    # estar dentro del presupuesto. `excepto` (el que se acaba de añadir) no se descarta.
+    # Los planos en disco no cuentan: su memoria la gestiona el sistema.
+    def _ajustar(self, excepto):
+        uso = self.uso()["ram"]
+        for nombre in list(self._planos):
+            if uso <= self.presupuesto:
+                return
+            array = self._planos[nombre]
+            if nombre == excepto or isinstance(array, np.memmap):
+                continue
+            del self._planos[nombre]
+            uso -= array.nbytes
+
+    # Array nuevo respaldado por un fichero temporal (`np.memmap`).
+    #
+    # En Linux/macOS el fichero se borra al momento: el mapeo sigue siendo válido y el
+    # espacio se libera cuando el array deja de existir. En Windows no se puede borrar un
+    # fichero abierto, así que se borra al cerrar la sesión.
+    def _mapear(self, forma, dtype):
+        descriptor, ruta = tempfile.mkstemp(prefix="color_replace_", suffix=".raw", dir=self._carpeta)
+        os.close(descriptor)
+        array = np.memmap(ruta, dtype=dtype, mode="w+", shape=forma)
+        try:
+            os.remove(ruta)
+        except OSError:
+            self._ficheros.append(ruta)
+        return array
+
+
+def _borrar_ficheros(rutas):
+    for ruta in rutas:
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Los módulos del proyecto son scripts sueltos en la carpeta padre (como al ejecutar `python app.py`).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
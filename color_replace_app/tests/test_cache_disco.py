@@ -0,0 +1,113 @@
+import os
+import time
+
+import cache_disco
+import ediciones
+
+
+def _receta():
+    return ediciones.crear_paso((10, 200, 200), 10, 3, 1, (120, 200, 200), 100, True)
+
+
+def test_clave_salida_distingue_el_modo_de_proceso():
+    receta = _receta()
+    base = cache_disco.clave_salida("huella", receta, ".png")
+
+    assert cache_disco.clave_salida("huella", receta, ".PNG") == base
+    assert cache_disco.clave_salida("huella", receta, ".png", lut=False, tesela=None) == base
+    claves = {
+        base,
+        cache_disco.clave_salida("huella", receta, ".png", lut=True),
+        cache_disco.clave_salida("huella", receta, ".png", tesela=256),
+        cache_disco.clave_salida("huella", receta, ".png", tesela=300),
+        cache_disco.clave_salida("huella", receta, ".png", lut=True, tesela=256),
+        cache_disco.clave_salida("huella", receta, ".jpg"),
+        cache_disco.clave_salida("otra", receta, ".png"),
+        cache_disco.clave_salida("huella", dict(receta, fuerza=99), ".png"),
+    }
+    assert len(claves) == 8
+
+
+def test_clave_mascara_solo_depende_de_la_mascara():
+    base = cache_disco.clave_mascara("huella", (10, 200, 200), 10, 3, 1)
+    assert cache_disco.clave_mascara("huella", [10.0, 200, 200], 10, 3, 1) == base
+    assert cache_disco.clave_mascara("huella", (10, 200, 200), 11, 3, 1) != base
+    assert cache_disco.clave_mascara("huella", (10, 200, 200), 10, 3, 2) != base
+
+
+# Escribe `n` salidas de `tamano` bytes, la i-ésima usada hace (n - i) minutos.
+def _llenar(cache, n, tamano):
+    ahora = time.time()
+    claves = []
+    for i in range(n):
+        clave = f"{i:02x}" + "0" * 30
+        cache.guardar_salida(clave, bytes(tamano))
+        fecha = ahora - (n - i) * 60
+        os.utime(cache._ruta("salida", clave), (fecha, fecha))
+        claves.append(clave)
+    return claves
+
+
+def _tamano_carpeta(cache):
+    return sum(tamano for _, tamano, _ in cache._entradas())
+
+
+def test_limpiar_borra_las_mas_antiguas(tmp_path):
+    cache = cache_disco.CacheDisco(str(tmp_path), max_bytes=10 ** 6)
+    claves = _llenar(cache, 10, 1000)
+
+    cache.max_bytes = 5000
+    cache._limpiar()
+
+    quedan = [clave for clave in claves if os.path.exists(cache._ruta("salida", clave))]
+    assert _tamano_carpeta(cache) <= cache.max_bytes * cache_disco.FRACCION_TRAS_LIMPIEZA
+    assert quedan == claves[-len(quedan):]
+    assert len(quedan) == 4
+    assert cache.estadisticas()["bytes_estimados"] == 4000
+    assert not os.path.exists(os.path.join(str(tmp_path), cache_disco._CANDADO))
+
+
+def test_limpiar_respeta_las_leidas_hace_poco(tmp_path):
+    cache = cache_disco.CacheDisco(str(tmp_path), max_bytes=10 ** 6)
+    claves = _llenar(cache, 10, 1000)
+    assert cache.obtener_salida(claves[0]) == bytes(1000)
+
+    cache.max_bytes = 5000
+    cache._limpiar()
+
+    assert cache.obtener_salida(claves[0]) is not None
+    assert cache.obtener_salida(claves[1]) is None
+
+
+def test_limpiar_no_hace_nada_por_debajo_del_limite(tmp_path):
+    cache = cache_disco.CacheDisco(str(tmp_path), max_bytes=10 ** 6)
+    _llenar(cache, 10, 1000)
+    cache._limpiar()
+    assert _tamano_carpeta(cache) == 10000
+
+
+def test_limpiar_no_entra_si_otro_proceso_tiene_el_candado(tmp_path):
+    cache = cache_disco.CacheDisco(str(tmp_path), max_bytes=10 ** 6)
+    _llenar(cache, 10, 1000)
+    candado = os.path.join(str(tmp_path), cache_disco._CANDADO)
+    open(candado, "wb").close()
+
+    cache.max_bytes = 5000
+    cache._limpiar()
+    assert _tamano_carpeta(cache) == 10000
+
+    # Un candado abandonado (más antiguo que CANDADO_CADUCA_S) no bloquea la limpieza.
+    fecha = time.time() - cache_disco.CANDADO_CADUCA_S - 1
+    os.utime(candado, (fecha, fecha))
+    cache._limpiar()
+    assert _tamano_carpeta(cache) <= 4500
+    assert not os.path.exists(candado)
+
+
+def test_escribir_por_encima_del_limite_limpia(tmp_path):
+    cache = cache_disco.CacheDisco(str(tmp_path), max_bytes=5000)
+    _llenar(cache, 5, 1000)
+    cache.guardar_salida("ff" + "0" * 30, bytes(1000))
+
+    assert _tamano_carpeta(cache) <= 4500
+    assert cache.obtener_salida("ff" + "0" * 30) is not None
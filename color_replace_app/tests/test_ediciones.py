@@ -0,0 +1,115 @@
+import pytest
+
+import ediciones
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+
+def _paso(tono, destino=120, fuerza=100):
+    return ediciones.crear_paso((tono, 200, 200), 10, 0, 0, (destino, 200, 200), fuerza, True)
+
+
+# Huellas encadenadas de cada paso, como las calcula `PilaEdiciones.aplicar` con escala 1.
+def _huellas(base, pasos):
+    huellas = []
+    huella = base
+    for paso in pasos:
+        huella = ediciones.huella_paso(huella, paso)
+        huellas.append(huella)
+    return huellas
+
+
+def _imagen():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, size=(32, 48, 3), dtype=np.uint8)
+
+
+def test_huella_paso_depende_de_todas_las_claves():
+    paso = _paso(10)
+    base = ediciones.huella_paso("base", paso)
+    for clave, valor in (
+        ("origen_hsv", (11, 200, 200)),
+        ("tolerancia", 11),
+        ("suavizado", 1),
+        ("morph", 1),
+        ("destino_hsv", (121, 200, 200)),
+        ("fuerza", 99),
+        ("mantener_brillo", False),
+    ):
+        assert ediciones.huella_paso("base", dict(paso, **{clave: valor})) != base, clave
+    assert ediciones.huella_paso("otra", paso) != base
+
+
+def test_deshacer_rehacer_devuelve_la_misma_huella():
+    pila = ediciones.PilaEdiciones()
+    pila.anadir(_paso(10))
+    pila.anadir(_paso(40))
+    pila.cambiar(1, _paso(70))
+    antes = _huellas("base", pila.pasos)
+
+    assert pila.deshacer()
+    assert _huellas("base", pila.pasos) != antes
+    assert pila.rehacer()
+    assert _huellas("base", pila.pasos) == antes
+
+    assert not pila.rehacer()
+    while pila.deshacer():
+        pass
+    assert pila.pasos == []
+
+
+def test_un_cambio_nuevo_vacia_rehacer():
+    pila = ediciones.PilaEdiciones()
+    pila.anadir(_paso(10))
+    pila.anadir(_paso(40))
+    assert pila.deshacer()
+    pila.anadir(_paso(70))
+    assert not pila.rehacer()
+    assert pila.pasos == [_paso(10), _paso(70)]
+
+
+def test_cambiar_un_paso_invalida_solo_los_siguientes():
+    pasos = [_paso(10), _paso(40), _paso(70), _paso(100)]
+    antes = _huellas("base", pasos)
+    despues = _huellas("base", pasos[:1] + [_paso(40, fuerza=50)] + pasos[2:])
+
+    assert despues[0] == antes[0]
+    for vieja, nueva in zip(antes[1:], despues[1:]):
+        assert vieja != nueva
+
+
+def test_aplicar_reutiliza_las_salidas_de_la_cache():
+    image = _imagen()
+    pila = ediciones.PilaEdiciones()
+    for tono in (10, 40, 70):
+        pila.anadir(_paso(tono))
+
+    primera, inicio = pila.aplicar(image)
+    assert inicio == 0
+
+    # Deshacer y rehacer: la cadena es la misma, todo sale de la caché.
+    pila.deshacer()
+    _, inicio = pila.aplicar(image)
+    assert inicio == 2
+    pila.rehacer()
+    segunda, inicio = pila.aplicar(image)
+    assert inicio == 3
+    assert np.array_equal(primera, segunda)
+
+    # Cambiar el segundo paso: solo se reutiliza el primero.
+    pila.cambiar(1, _paso(40, fuerza=50))
+    _, inicio = pila.aplicar(image)
+    assert inicio == 1
+
+
+def test_aplicar_con_otra_zona_no_reutiliza():
+    image = _imagen()
+    pila = ediciones.PilaEdiciones()
+    pila.anadir(_paso(10))
+
+    pila.aplicar(image, zona=(0, 16, 0, 24))
+    _, inicio = pila.aplicar(image, zona=(0, 16, 0, 24))
+    assert inicio == 1
+    _, inicio = pila.aplicar(image, zona=(16, 32, 0, 24))
+    assert inicio == 0
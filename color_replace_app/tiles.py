@@ -0,0 +1,145 @@
+import logic
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+
+# Procesamiento por teselas (tiles) para imágenes muy grandes.
+#
+# ¿Por qué existe?
+# - `logic.reemplazar_color` crea varios planos float32 del tamaño de la imagen
+#   (alpha, la copia float del HSV, 3 canales separados y 3 mezclados).
+#   Con un escaneo de 100 MP eso son más de 1 GB de memoria temporal.
+# - Procesando la imagen por bloques, la memoria temporal depende del tamaño del bloque,
+#   no del de la imagen.
+#
+# Cómo se evita que se noten las “costuras”:
+# - El blur y la morfología miran a los vecinos de cada píxel. Por eso cada tesela se
+#   procesa con un margen extra (halo) alrededor y luego solo se conserva el centro.
+# - Con el halo adecuado (ver `margen_mascara`) el centro es idéntico al de la imagen completa.
+# - cv2.cvtColor(HSV -> BGR) redondea distinto en los últimos píxeles de cada fila
+#   (los que no completan un bloque SIMD). Para que eso también coincida, las teselas
+#   empiezan en columnas múltiplo de `ALINEACION_COLUMNAS` y tienen ese ancho.
+
+# Tamaño de tesela por defecto (lado, en píxeles).
+TESELA_DEFECTO = 1024
+
+# Las columnas de cada tesela se alinean a este múltiplo (ver nota sobre cvtColor).
+ALINEACION_COLUMNAS = 64
+
+
+# Calcula cuántos píxeles de vecindad necesita la máscara.
+#
+# - GaussianBlur con kernel k mira k // 2 píxeles a cada lado.
+# - MORPH_OPEN con `morph` iteraciones = erosión + dilatación => 2 * morph píxeles.
+# - MORPH_CLOSE suma otros 2 * morph.
+#
+# Devuelve:
+# - margen (int) en píxeles.
+def margen_mascara(suavizado, morph):
+    if suavizado % 2 == 0:
+        suavizado = suavizado + 1
+    radio_blur = suavizado // 2 if suavizado > 1 else 0
+    return radio_blur + 4 * max(0, morph)
+
+
+# Genera las teselas de una imagen de alto x ancho.
+#
+# Devuelve (iterador) tuplas:
+# - (y0, y1, x0, x1): zona que se escribe en la salida
+# - (hy0, hy1, hx0, hx1): zona que se lee, es decir, la tesela más su halo
+def recorrer_teselas(alto, ancho, tesela, margen):
+    tesela = max(1, int(tesela))
+    ancho_tesela = max(ALINEACION_COLUMNAS, -(-tesela // ALINEACION_COLUMNAS) * ALINEACION_COLUMNAS)
+    for y0 in range(0, alto, tesela):
+        y1 = min(alto, y0 + tesela)
+        for x0 in range(0, ancho, ancho_tesela):
+            x1 = min(ancho, x0 + ancho_tesela)
+            yield (y0, y1, x0, x1), (
+                max(0, y0 - margen),
+                min(alto, y1 + margen),
+                max(0, x0 - margen),
+                min(ancho, x1 + margen),
+            )
+
+
+# Amplía una caja (y0, y1, x0, x1) con `margen` píxeles de halo para calcular la máscara
+# dentro de ella igual que sobre la imagen completa, con las columnas alineadas a
+# `ALINEACION_COLUMNAS` (ver nota sobre cvtColor).
+#
+# Devuelve:
+# - (y0, y1, x0, x1) ampliada y recortada a la imagen de alto x ancho.
+def ampliar_caja(caja, margen, alto, ancho):
+    y0, y1, x0, x1 = caja
+    return (
+        max(0, y0 - margen),
+        min(alto, y1 + margen),
+        max(0, x0 - margen) // ALINEACION_COLUMNAS * ALINEACION_COLUMNAS,
+        min(ancho, -(-(x1 + margen) // ALINEACION_COLUMNAS) * ALINEACION_COLUMNAS),
+    )
+
+
+# Máscara + reemplazo por teselas, escribiendo en un array de salida.
+#
+# Entrada:
+# - image_bgr: imagen BGR. Puede ser un np.memmap (no se lee entera a la vez).
+# - color_hsv, tolerancia, suavizado, morph: igual que `logic.crear_mascara_hsv`
+# - color_destino_hsv, fuerza, mantener_brillo: igual que `logic.reemplazar_color`
+# - out: array (alto, ancho, 3) uint8 donde escribir el resultado. Puede estar
+#   preasignado o ser un np.memmap; si es None se crea uno nuevo.
+# - mask_out: opcional, array (alto, ancho) uint8 donde escribir también la máscara.
+# - tesela: lado de la tesela en píxeles.
+#
+# Devuelve:
+# - `out`, con el mismo resultado que crear_mascara_hsv + reemplazar_color_roi sobre la imagen completa.
+def reemplazar_color_por_teselas(
+    image_bgr,
+    color_hsv,
+    tolerancia,
+    suavizado,
+    morph,
+    color_destino_hsv,
+    fuerza,
+    mantener_brillo,
+    out=None,
+    mask_out=None,
+    tesela=TESELA_DEFECTO,
+):
+    if image_bgr is None or color_hsv is None or np is None or cv2 is None:
+        return None
+
+    alto, ancho = image_bgr.shape[:2]
+    if out is None:
+        out = np.empty((alto, ancho, 3), np.uint8)
+
+    margen = margen_mascara(suavizado, morph)
+    # Buffers de `logic.reemplazar_color_entero`, reutilizados entre teselas del mismo tamaño.
+    trabajo = {}
+    for (y0, y1, x0, x1), (hy0, hy1, hx0, hx1) in recorrer_teselas(alto, ancho, tesela, margen):
+        bloque = np.ascontiguousarray(image_bgr[hy0:hy1, hx0:hx1])
+        with logic.medir_etapa("bgr_a_hsv", bloque.shape[0] * bloque.shape[1]):
+            hsv = cv2.cvtColor(bloque, cv2.COLOR_BGR2HSV)
+        mask = logic.crear_mascara_hsv(hsv, color_hsv, tolerancia, suavizado, morph)
+
+        # Recortar el halo: solo el centro es correcto. Como en el flujo normal
+        # (`logic.reemplazar_color_roi`), solo se mezclan las regiones de la máscara y el
+        # resto de píxeles se copia tal cual del original.
+        centro = (slice(y0 - hy0, y1 - hy0), slice(x0 - hx0, x1 - hx0))
+        logic.reemplazar_color_roi(
+            bloque[centro],
+            hsv[centro],
+            mask[centro],
+            color_destino_hsv,
+            fuerza,
+            mantener_brillo,
+            out=out[y0:y1, x0:x1],
+            trabajo=trabajo,
+        )
+        if mask_out is not None:
+            mask_out[y0:y1, x0:x1] = mask[centro]
+
+    return out
@@ -0,0 +1,442 @@
+import argparse
+import os
+import queue
+import sys
+import threading
+import time
+
+import batch
+import logic
+
+try:
+    import cv2
+    import numpy as np
+except Exception:
+    cv2 = None
+    np = None
+
+logic.cv2 = cv2
+logic.np = np
+
+
+# Reemplazo de color en vídeos y secuencias de imágenes (modo streaming).
+#
+# Idea general:
+# - Se aplica la misma receta que en `batch.py` a cada fotograma.
+# - El trabajo se organiza como una cadena de etapas conectadas por colas acotadas:
+#
+#     leer (1 hilo) -> máscara + reemplazo (N hilos) -> escribir (1 hilo)
+#
+# - OpenCV suelta el GIL mientras calcula, así que los N hilos de proceso aprovechan
+#   varios núcleos, y la lectura/escritura del vídeo se solapa con el cálculo.
+# - Las colas tienen tamaño máximo y un semáforo limita los fotogramas “en vuelo”:
+#   si el escritor va lento, el lector espera en lugar de llenar la memoria.
+#
+# Suavizado temporal (opcional):
+# - La máscara de cada fotograma se mezcla con la del anterior para evitar parpadeos.
+# - Como eso necesita los fotogramas en orden, se añade una etapa intermedia:
+#
+#     leer -> máscara (N hilos) -> suavizado temporal (1 hilo, en orden) -> reemplazo (N hilos) -> escribir
+#
+# Uso:
+#   python video.py clip.mp4 --salida clip_azul.mp4 --origen "#c01010" --destino "#1040c0"
+#   python video.py "frames/*.png" --salida frames_azul/ --origen 200,20,20 --destino 20,60,200 --temporal 0.5
+
+EXTENSIONES_VIDEO = (".mp4", ".avi", ".mov", ".mkv", ".m4v")
+
+# Marca de fin de flujo entre etapas.
+_FIN = object()
+
+
+# Etapa de la cadena: varios hilos que leen de una cola, aplican `funcion` y escriben
+# en la siguiente. Cuando llega `_FIN`, el último hilo en terminar lo pasa a la salida.
+#
+# Si `funcion` falla, se guarda el error y se activa `cancelado`; a partir de ahí la etapa
+# sigue vaciando su cola (sin calcular) para que ninguna otra etapa se quede bloqueada.
+class _Etapa:
+
+    def __init__(self, funcion, entrada, salida, hilos, nombre, cancelado):
+        self.funcion = funcion
+        self.entrada = entrada
+        self.salida = salida
+        self.cancelado = cancelado
+        self.error = None
+        self._vivos = hilos
+        self._lock = threading.Lock()
+        self._hilos = [
+            threading.Thread(target=self._bucle, name=f"{nombre}-{i}", daemon=True)
+            for i in range(hilos)
+        ]
+
+    def iniciar(self):
+        for hilo in self._hilos:
+            hilo.start()
+
+    def esperar(self):
+        for hilo in self._hilos:
+            hilo.join()
+
+    def _bucle(self):
+        while True:
+            item = self.entrada.get()
+            if item is _FIN:
+                # Devolvemos la marca para que la vean los demás hilos de la etapa.
+                self.entrada.put(_FIN)
+                break
+            if self.cancelado.is_set():
+                continue
+            try:
+                resultado = self.funcion(item)
+            except Exception as exc:
+                self.error = exc
+                self.cancelado.set()
+                continue
+            self.salida.put(resultado)
+
+        with self._lock:
+            self._vivos -= 1
+            ultimo = self._vivos == 0
+        if ultimo:
+            self.salida.put(_FIN)
+
+
+# Reordena los resultados de una etapa con varios hilos: los fotogramas pueden llegar
+# desordenados y se entregan a `entregar` estrictamente en orden de índice.
+class _Reordenador:
+
+    def __init__(self, entregar):
+        self.entregar = entregar
+        self.siguiente = 0
+        self.pendientes = {}
+
+    def recibir(self, item):
+        self.pendientes[item[0]] = item
+        while self.siguiente in self.pendientes:
+            self.entregar(self.pendientes.pop(self.siguiente))
+            self.siguiente += 1
+
+
+# Procesa una secuencia de fotogramas con la cadena de etapas.
+#
+# Entrada:
+# - fotogramas: iterable de imágenes BGR (en orden)
+# - escribir: función (indice, result_bgr) que guarda cada fotograma ya procesado, en orden
+# - receta: dict con los parámetros (mismas claves que en `batch.py`)
+# - workers: hilos por etapa de cálculo
+# - en_vuelo: máximo de fotogramas leídos y aún no escritos
+# - temporal: peso (0..1) de la máscara del fotograma anterior; 0 desactiva el suavizado
+# - progreso: callback opcional (fotogramas_escritos, fps_sostenidos)
+#
+# Devuelve:
+# - dict resumen: fotogramas, segundos, fps sostenidos y megapíxeles/s.
+def procesar_secuencia(fotogramas, escribir, receta, workers=None, en_vuelo=None, temporal=0.0, progreso=None):
+    workers = workers or os.cpu_count() or 1
+    en_vuelo = max(1, en_vuelo or workers * 2)
+    hueco = threading.BoundedSemaphore(en_vuelo)
+    cancelado = threading.Event()
+    errores = []
+    locales = threading.local()
+
+    def calcular_mascara(item):
+        indice, image_bgr = item
+        image_hsv = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2HSV)
+        mask = logic.crear_mascara_hsv(
+            image_hsv,
+            receta["origen_hsv"],
+            receta["tolerancia"],
+            receta["suavizado"],
+            receta["morph"],
+        )
+        return indice, image_bgr, image_hsv, mask
+
+    def reemplazar(item):
+        indice, image_bgr, image_hsv, mask = item
+        # Cada hilo reutiliza sus propios buffers entre fotogramas.
+        if not hasattr(locales, "trabajo"):
+            locales.trabajo = {}
+        result_bgr = logic.reemplazar_color_roi(
+            image_bgr,
+            image_hsv,
+            mask,
+            receta["destino_hsv"],
+            receta["fuerza"],
+            receta["mantener_brillo"],
+            trabajo=locales.trabajo,
+        )
+        return indice, result_bgr
+
+    def procesar(item):
+        return reemplazar(calcular_mascara(item))
+
+    cola_leidos = queue.Queue(maxsize=en_vuelo)
+    cola_final = queue.Queue(maxsize=en_vuelo)
+    if temporal > 0:
+        cola_mascaras = queue.Queue(maxsize=en_vuelo)
+        cola_suavizadas = queue.Queue(maxsize=en_vuelo)
+        etapas = [
+            _Etapa(calcular_mascara, cola_leidos, cola_mascaras, workers, "mascara", cancelado),
+            _Etapa(reemplazar, cola_suavizadas, cola_final, workers, "reemplazo", cancelado),
+        ]
+    else:
+        etapas = [_Etapa(procesar, cola_leidos, cola_final, workers, "proceso", cancelado)]
+
+    inicio = time.perf_counter()
+    estado = {"escritos": 0, "pixeles": 0}
+
+    def leer():
+        try:
+            for indice, image_bgr in enumerate(fotogramas):
+                # Esperar hueco, pero sin quedarse bloqueado si otra etapa ha fallado.
+                while not hueco.acquire(timeout=0.1):
+                    if cancelado.is_set():
+                        return
+                if cancelado.is_set():
+                    return
+                cola_leidos.put((indice, image_bgr))
+        except Exception as exc:
+            errores.append(exc)
+            cancelado.set()
+        finally:
+            cola_leidos.put(_FIN)
+
+    # Suavizado temporal, en orden: mezcla la máscara actual con la anterior ya suavizada.
+    def suavizar_en_orden():
+        anterior = [None]
+
+        def entregar(item):
+            indice, image_bgr, image_hsv, mask = item
+            if anterior[0] is not None and anterior[0].shape == mask.shape:
+                mask = cv2.addWeighted(mask, 1.0 - temporal, anterior[0], temporal, 0)
+            anterior[0] = mask
+            cola_suavizadas.put((indice, image_bgr, image_hsv, mask))
+
+        reordenador = _Reordenador(entregar)
+        while True:
+            item = cola_mascaras.get()
+            if item is _FIN:
+                break
+            if not cancelado.is_set():
+                reordenador.recibir(item)
+        cola_suavizadas.put(_FIN)
+
+    hilo_lector = threading.Thread(target=leer, name="lector", daemon=True)
+    hilo_lector.start()
+    for etapa in etapas:
+        etapa.iniciar()
+    hilo_suavizado = None
+    if temporal > 0:
+        hilo_suavizado = threading.Thread(target=suavizar_en_orden, name="temporal", daemon=True)
+        hilo_suavizado.start()
+
+    # Escritura en el hilo que llama, en orden.
+    def entregar_final(item):
+        indice, result_bgr = item
+        escribir(indice, result_bgr)
+        hueco.release()
+        estado["escritos"] += 1
+        estado["pixeles"] += result_bgr.shape[0] * result_bgr.shape[1]
+        if progreso is not None:
+            segundos = time.perf_counter() - inicio
+            progreso(estado["escritos"], estado["escritos"] / segundos if segundos > 0 else 0.0)
+
+    reordenador = _Reordenador(entregar_final)
+    while True:
+        item = cola_final.get()
+        if item is _FIN:
+            break
+        if cancelado.is_set():
+            continue
+        try:
+            reordenador.recibir(item)
+        except Exception as exc:
+            errores.append(exc)
+            cancelado.set()
+
+    for etapa in etapas:
+        etapa.esperar()
+        if etapa.error is not None:
+            errores.append(etapa.error)
+    if hilo_suavizado is not None:
+        hilo_suavizado.join()
+    hilo_lector.join()
+    if errores:
+        raise errores[0]
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "fotogramas": estado["escritos"],
+        "segundos": segundos,
+        "fps": estado["escritos"] / segundos if segundos > 0 else 0.0,
+        "mp_por_segundo": estado["pixeles"] / 1e6 / segundos if segundos > 0 else 0.0,
+        "workers": workers,
+    }
+
+
+# Abre la entrada: un vídeo, o un directorio / patrón glob de imágenes.
+#
+# Devuelve:
+# - (fotogramas, fps, nombres): `fotogramas` es un generador de imágenes BGR, `fps` los
+#   fotogramas por segundo del vídeo (o None en secuencias) y `nombres` los nombres de
+#   archivo de la secuencia (o None en vídeos).
+def abrir_entrada(entrada):
+    if os.path.isfile(entrada) and entrada.lower().endswith(EXTENSIONES_VIDEO):
+        captura = cv2.VideoCapture(entrada)
+        if not captura.isOpened():
+            return None, None, None
+        fps = captura.get(cv2.CAP_PROP_FPS) or None
+
+        def leer_video():
+            try:
+                while True:
+                    ok, frame = captura.read()
+                    if not ok:
+                        break
+                    yield frame
+            finally:
+                captura.release()
+
+        return leer_video(), fps, None
+
+    _, rutas = batch.buscar_imagenes(entrada)
+    if not rutas:
+        return None, None, None
+
+    def leer_secuencia():
+        for ruta in rutas:
+            frame = cv2.imread(ruta)
+            if frame is None:
+                raise IOError(f"No se pudo cargar la imagen: {ruta}")
+            yield frame
+
+    return leer_secuencia(), None, [os.path.basename(r) for r in rutas]
+
+
+# Crea la función de escritura.
+#
+# - Si `salida` es un archivo de vídeo, se usa cv2.VideoWriter (se abre con el tamaño
+#   del primer fotograma; si no se puede abrir, ese primer `escribir` lanza IOError).
+# - Si no, `salida` es un directorio y cada fotograma se guarda como imagen.
+#
+# Devuelve:
+# - (escribir, cerrar)
+def crear_salida(salida, fps, nombres):
+    if salida.lower().endswith(EXTENSIONES_VIDEO):
+        estado = {"writer": None}
+
+        def escribir_video(indice, frame):
+            if estado["writer"] is None:
+                carpeta = os.path.dirname(salida)
+                if carpeta:
+                    os.makedirs(carpeta, exist_ok=True)
+                h, w = frame.shape[:2]
+                fourcc = cv2.VideoWriter_fourcc(*"mp4v")
+                writer = cv2.VideoWriter(salida, fourcc, fps or 25.0, (w, h))
+                if not writer.isOpened():
+                    raise IOError(f"No se pudo crear el vídeo: {salida}")
+                estado["writer"] = writer
+            estado["writer"].write(frame)
+
+        def cerrar_video():
+            if estado["writer"] is not None:
+                estado["writer"].release()
+
+        return escribir_video, cerrar_video
+
+    os.makedirs(salida, exist_ok=True)
+
+    def escribir_imagen(indice, frame):
+        nombre = nombres[indice] if nombres else f"frame_{indice:06d}.png"
+        if not cv2.imwrite(os.path.join(salida, nombre), frame):
+            raise IOError(f"No se pudo guardar la imagen: {nombre}")
+
+    return escribir_imagen, lambda: None
+
+
+def _crear_parser():
+    parser = argparse.ArgumentParser(
+        description="Reemplaza un color en un vídeo o una secuencia de imágenes.",
+    )
+    parser.add_argument("entrada", help="Vídeo, directorio o patrón glob de fotogramas.")
+    parser.add_argument("--salida", required=True, help="Vídeo de salida (.mp4, .avi...) o directorio.")
+    parser.add_argument("--origen", required=True, type=batch.parsear_color, help="Color a cambiar (#RRGGBB o r,g,b).")
+    parser.add_argument("--destino", required=True, type=batch.parsear_color, help="Color nuevo (#RRGGBB o r,g,b).")
+    parser.add_argument("--tolerancia", type=int, default=batch.TOLERANCIA_DEFECTO, help="Tolerancia HSV (0..60). Por defecto 20.")
+    parser.add_argument("--suavizado", type=int, default=7, help="Suavizado/feather (1..31). Por defecto 7.")
+    parser.add_argument("--morph", type=int, default=1, help="Iteraciones de morfología (0..8). Por defecto 1.")
+    parser.add_argument("--fuerza", type=int, default=80, help="Fuerza de mezcla (0..100). Por defecto 80.")
+    parser.add_argument(
+        "--no-mantener-brillo",
+        dest="mantener_brillo",
+        action="store_false",
+        help="Mezclar también el canal V (por defecto se conserva el brillo).",
+    )
+    parser.add_argument(
+        "--temporal",
+        type=float,
+        default=0.0,
+        help="Peso (0..1) de la máscara del fotograma anterior para evitar parpadeos. Por defecto 0 (desactivado).",
+    )
+    parser.add_argument("--workers", type=int, default=None, help="Hilos por etapa de cálculo (por defecto, uno por núcleo).")
+    parser.add_argument("--en-vuelo", type=int, default=None, help="Máximo de fotogramas en proceso a la vez (por defecto 2 x workers).")
+    return parser
+
+
+# Punto de entrada del modo vídeo.
+#
+# Devuelve el código de salida del proceso (0 = todo bien, 1 = error, 2 = no hay nada que hacer).
+def main(argv=None):
+    args = _crear_parser().parse_args(argv)
+
+    if cv2 is None or np is None:
+        print("Error: faltan dependencias: cv2 o numpy.", file=sys.stderr)
+        return 2
+    if not 0.0 <= args.temporal < 1.0:
+        print("Error: --temporal debe estar entre 0 y 1 (sin incluir 1).", file=sys.stderr)
+        return 2
+
+    fotogramas, fps, nombres = abrir_entrada(args.entrada)
+    if fotogramas is None:
+        print(f"No se pudo abrir {args.entrada!r}.", file=sys.stderr)
+        return 2
+
+    receta = {
+        "origen_hsv": logic.convertir_rgb_a_hsv(*args.origen),
+        "destino_hsv": logic.convertir_rgb_a_hsv(*args.destino),
+        "tolerancia": args.tolerancia,
+        "suavizado": args.suavizado,
+        "morph": args.morph,
+        "fuerza": args.fuerza,
+        "mantener_brillo": args.mantener_brillo,
+    }
+
+    def progreso(escritos, fps_actual):
+        if escritos % 50 == 0:
+            print(f"{escritos} fotogramas | {fps_actual:.1f} fps")
+
+    escribir, cerrar = crear_salida(args.salida, fps, nombres)
+    try:
+        resumen = procesar_secuencia(
+            fotogramas,
+            escribir,
+            receta,
+            args.workers,
+            args.en_vuelo,
+            args.temporal,
+            progreso,
+        )
+    except Exception as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        cerrar()
+
+    print(
+        f"Procesados {resumen['fotogramas']} fotogramas en {resumen['segundos']:.2f} s "
+        f"con {resumen['workers']} hilos | {resumen['fps']:.1f} fps sostenidos | "
+        f"{resumen['mp_por_segundo']:.2f} MP/s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+import queue
+import threading
+import time
+
+
+# Hilo de cálculo en segundo plano para la interfaz (Tkinter).
+#
+# ¿Por qué existe?
+# - Si la máscara y el reemplazo se calculan en el hilo principal de Tk, la ventana se
+#   congela mientras tanto (segundos con imágenes grandes).
+# - Aquí cada trabajo se ejecuta en un hilo aparte y el resultado se entrega de vuelta
+#   al hilo principal a través de una cola (Tk no se puede tocar desde otros hilos).
+#
+# Reglas:
+# - “Gana la última petición”: solo hay un hueco de trabajo pendiente. Si llega una petición
+#   nueva mientras otra espera, la sustituye.
+# - Cancelación: cada trabajo recibe un `token`. En cuanto llega una petición más nueva (o se
+#   llama a `cancelar`), `token.cancelado()` pasa a True; el trabajo puede comprobarlo entre
+#   pasos para abandonar pronto, y su resultado se descarta en cualquier caso.
+# - Resultados intermedios: un trabajo largo puede entregar avances con `token.entregar`
+#   (por ejemplo, una vista previa a baja resolución antes de la definitiva). Se descartan
+#   igual que el resultado final si la petición ya no es la última.
+# - El hilo principal llama a `entregar_resultados` periódicamente (con `root.after`), que
+#   ejecuta los callbacks en el hilo de Tk.
+class TrabajadorFondo:
+
+    def __init__(self, nombre, resultados):
+        self.resultados = resultados
+        self._cond = threading.Condition()
+        self._pendiente = None
+        self._generacion = 0
+        self._hilo = threading.Thread(target=self._bucle, name=nombre, daemon=True)
+        self._hilo.start()
+
+    # Pide ejecutar `funcion(token)` en segundo plano.
+    #
+    # - al_terminar(resultado, segundos): se llama en el hilo de Tk si el trabajo no fue cancelado.
+    # - al_fallar(error): igual, si `funcion` lanzó una excepción. Es obligatorio: un error
+    #   en segundo plano no debe perderse sin que nadie se entere.
+    def enviar(self, funcion, al_terminar, al_fallar):
+        with self._cond:
+            self._generacion += 1
+            self._pendiente = (_Token(self, self._generacion), funcion, al_terminar, al_fallar)
+            self._cond.notify()
+
+    # Cancela el trabajo en curso (si lo hay) y descarta el pendiente.
+    def cancelar(self):
+        with self._cond:
+            self._generacion += 1
+            self._pendiente = None
+
+    def _bucle(self):
+        while True:
+            with self._cond:
+                while self._pendiente is None:
+                    self._cond.wait()
+                token, funcion, al_terminar, al_fallar = self._pendiente
+                self._pendiente = None
+
+            if token.cancelado():
+                continue
+            inicio = time.perf_counter()
+            try:
+                resultado = funcion(token)
+            except Exception as exc:
+                self.resultados.put((token, al_fallar, (exc,)))
+                continue
+            segundos = time.perf_counter() - inicio
+            self.resultados.put((token, al_terminar, (resultado, segundos)))
+
+
+# Identifica una petición concreta; queda cancelada cuando llega otra más nueva.
+class _Token:
+
+    def __init__(self, trabajador, generacion):
+        self._trabajador = trabajador
+        self._generacion = generacion
+
+    def cancelado(self):
+        return self._generacion != self._trabajador._generacion
+
+    # Entrega un resultado intermedio: `callback(*argumentos)` se ejecuta en el hilo de Tk
+    # (con `entregar_resultados`), salvo si para entonces esta petición ya fue sustituida.
+    def entregar(self, callback, *argumentos):
+        self._trabajador.resultados.put((self, callback, argumentos))
+
+
+# Ejecuta (en el hilo que llama, normalmente el de Tk) los callbacks de los trabajos
+# terminados. Los resultados de peticiones ya sustituidas o canceladas se descartan.
+def entregar_resultados(resultados):
+    while True:
+        try:
+            token, callback, argumentos = resultados.get_nowait()
+        except queue.Empty:
+            return
+        if not token.cancelado():
+            callback(*argumentos)